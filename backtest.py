@@ -0,0 +1,209 @@
+import argparse
+import itertools
+import json
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from exchangeinfo import ExchangeInfoCache, symbol_table, symbol_filters, NO_FILTERS
+from history import aligned
+from planner import plan_trades, ready, check_order, SIDE_BUY, SIDE_SELL
+from portfolio import PortfolioState
+from settings import Settings
+from timing import parse_time
+
+Market = namedtuple('Market', ['coins', 'times', 'bid', 'ask'])
+Market.__doc__ = '''
+Recorded market for a backtest: the allocation table with symbol
+filters, the sample times in ms, and bid/ask matrices of shape
+(times, coins) aligned as-of each sample time.
+'''
+
+
+def load_market(start, end, interval, portfolio='allocation.csv',
+                directory='records', exchange_info='exchange_info.json',
+                trade_currency='BTC'):
+    '''
+    Load the recorded bid/ask of every coin in the allocation file on a
+    regular grid of interval ms. Samples before every pair has a quote
+    are dropped. Symbol filters come from the exchange info cache when
+    one is available, otherwise coins are treated as unfiltered.
+    '''
+    coins = pd.read_csv(portfolio)
+    pairs = [coin + trade_currency for coin in coins['coin']]
+    times = np.arange(start, end, interval, dtype=np.int64)
+    bid = aligned(pairs, times, directory, 'bid', trade_currency).values
+    ask = aligned(pairs, times, directory, 'ask', trade_currency).values
+    valid = ~(np.isnan(bid).any(axis=1) | np.isnan(ask).any(axis=1))
+
+    info = ExchangeInfoCache(exchange_info, ttl=float('inf')).load()
+    symbols = symbol_table(info) if info is not None else {}
+    rows = []
+    for coin, pair in zip(coins['coin'], pairs):
+        row = {'coin': coin, 'symbol': pair}
+        if coin != trade_currency and pair in symbols:
+            row.update(symbol_filters(symbols[pair]))
+        else:
+            row.update(NO_FILTERS)
+            row['maxqty'] = np.inf
+        rows.append(row)
+    coins = pd.merge(coins, pd.DataFrame(rows), on='coin')
+    return Market(coins, times[valid], bid[valid], ask[valid])
+
+
+def simulate(market, rebalance_period, min_trade_value=None, trade_type='MARKET',
+             taker_fee=0.001, maker_fee=0.001, initial_value=1.0, trade_currency='BTC'):
+    '''
+    Replay a market through the engine's sizing rules. Every
+    rebalance_period seconds the planner is run for sells, the fills
+    are applied, and it is run again for buys, as RebalanceEngine.rebalance
+    does. Orders are quantized and checked against the symbol rules as
+    execute_transactions does, and orders the exchange would reject are
+    counted but not filled. Orders fill completely at the quoted
+    bid/ask (LIMIT orders at the quote rounded to the tick size); MARKET orders
+    pay the taker fee and LIMIT orders the maker fee, in the trade
+    currency. Between rebalances holdings are fixed and the portfolio
+    is revalued vectorized at every sample.
+    '''
+    coins = market.coins.copy()
+    n = len(market.times)
+    if n == 0:
+        raise ValueError('No recorded prices in the requested range')
+    coins['minnotional'] = coins['minnotional'].astype(float)
+    if min_trade_value is not None:
+        coins.loc[coins['coin'] != trade_currency, 'minnotional'] = float(min_trade_value)
+    market_orders = trade_type == 'MARKET'
+    fee = taker_fee if market_orders else maker_fee
+    allocation = coins['allocation'].values.astype(float)
+    fixed = coins['fixed_balance'].values.astype(float)
+    mid = (market.bid[0] + market.ask[0]) / 2.0
+    coins['exchange_balance'] = np.maximum(allocation / 100.0 * initial_value / mid - fixed, 0)
+    coins['locked_balance'] = 0.0
+    coins['price'] = mid
+    coins['bidprice'] = market.bid[0]
+    coins['askprice'] = market.ask[0]
+    coins['last_placement'] = np.nan
+    coins['last_execution'] = np.nan
+    state = PortfolioState(coins, trade_currency)
+    trade = state.trade_index
+
+    times = market.times
+    schedule = times[0] + np.arange(0, times[-1] - times[0] + 1, int(rebalance_period * 1000))
+    steps = np.unique(np.searchsorted(times, schedule))
+    steps = steps[steps < n]
+    totals = np.empty(n)
+    squared_error = np.empty(n)
+    traded = 0.0
+    fees = 0.0
+    orders = 0
+    rejected = 0
+    for k, step in enumerate(steps):
+        end = steps[k + 1] if k + 1 < len(steps) else n
+        state.bidprice[:] = market.bid[step]
+        state.askprice[:] = market.ask[step]
+        for side in (SIDE_SELL, SIDE_BUY):
+            state.value[:] = (state.exchange_balance + state.fixed_balance) * state.askprice
+            state.resum()
+            plan = plan_trades(state)
+            index = []
+            quantity = []
+            price = []
+            for i in ready(plan, side):
+                rules = state.rules[i]
+                order_quantity = rules.quantity.decimal(plan.quantity[i])
+                order_price = rules.price.decimal(plan.price[i])
+                if check_order(state, i, order_quantity, order_price, market_orders) is not None:
+                    rejected += 1
+                    continue
+                index.append(i)
+                quantity.append(float(order_quantity))
+                price.append(plan.price[i] if market_orders else float(order_price))
+            index = np.array(index, dtype=np.intp)
+            quantity = np.array(quantity)
+            notional = quantity * np.array(price)
+            cost = notional * fee
+            if side == SIDE_SELL:
+                state.exchange_balance[index] -= quantity
+                state.exchange_balance[trade] += np.sum(notional - cost)
+            else:
+                state.exchange_balance[index] += quantity
+                state.exchange_balance[trade] -= np.sum(notional + cost)
+            traded += np.sum(notional)
+            fees += np.sum(cost)
+            orders += len(index)
+        values = market.ask[step:end] * (state.exchange_balance + state.fixed_balance)
+        totals[step:end] = values.sum(axis=1)
+        actual = 100.0 * values / totals[step:end, None]
+        squared_error[step:end] = np.sum((actual - allocation) ** 2, axis=1)
+
+    hold = market.ask * (coins['exchange_balance'].values + fixed)
+    return {'rebalance_period': rebalance_period,
+            'min_trade_value': min_trade_value,
+            'trade_type': trade_type,
+            'rebalances': len(steps),
+            'orders': orders,
+            'rejected': rejected,
+            'turnover': traded / np.mean(totals),
+            'fees': fees,
+            'tracking_error': float(np.sqrt(np.mean(squared_error))),
+            'final_value': totals[-1],
+            'hold_value': float(np.sum(hold[-1]))}
+
+
+_market = None
+
+
+def _init_worker(market):
+    global _market
+    _market = market
+
+
+def _simulate_worker(params):
+    return simulate(_market, **params)
+
+
+def sweep(market, grid, processes=None):
+    '''
+    Simulate every parameter set in grid (a list of keyword argument
+    dictionaries for simulate) in a process pool. The market is sent
+    to each worker process once.
+    '''
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(market,)) as pool:
+        return list(pool.map(_simulate_worker, grid))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded ticks through the rebalancer')
+    parser.add_argument('--start', type=parse_time, required=True)
+    parser.add_argument('--end', type=parse_time, required=True)
+    parser.add_argument('--interval', type=float, default=10, help='sample interval (seconds)')
+    parser.add_argument('--period', type=int, nargs='+', default=[600], help='rebalance periods (seconds)')
+    parser.add_argument('--min-trade-value', type=float, nargs='+', default=None,
+                        help='minimum order values to try (default min_trade_value in config.ini)')
+    parser.add_argument('--trade-type', choices=['MARKET', 'LIMIT'], nargs='+', default=['MARKET'])
+    parser.add_argument('--taker-fee', type=float, default=0.001)
+    parser.add_argument('--maker-fee', type=float, default=0.001)
+    parser.add_argument('--portfolio', default='allocation.csv')
+    parser.add_argument('--directory', default='records')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+    if args.min_trade_value is None:
+        args.min_trade_value = [Settings('config.ini').min_trade_value]
+
+    market = load_market(args.start, args.end, int(args.interval * 1000),
+                         args.portfolio, args.directory)
+    grid = [{'rebalance_period': period,
+             'min_trade_value': min_trade_value,
+             'trade_type': trade_type,
+             'taker_fee': args.taker_fee,
+             'maker_fee': args.maker_fee}
+            for period, min_trade_value, trade_type
+            in itertools.product(args.period, args.min_trade_value, args.trade_type)]
+    print(json.dumps(sweep(market, grid, args.processes), indent=2, default=float))
+
+if __name__ == '__main__':
+    main()
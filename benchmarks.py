@@ -0,0 +1,389 @@
+'''
+Benchmarks for the hot paths of the rebalancer. Run with
+
+    python benchmarks.py planner [--sizes 10 100 1000]
+    python benchmarks.py handlers [--coins 10 100] [--rate 0 1000] [--output results.json]
+    python benchmarks.py capture --symbols ETHBTC LTCBTC --seconds 60 --file stream.jsonl
+    python benchmarks.py replay [--file stream.jsonl] [--rate 0 1000] [--drop-after 10000]
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from portfolio import PortfolioState
+from planner import plan_trades, describe
+from settings import Settings
+from engine import RebalanceEngine
+from marketdata import BinanceTransport, MarketDataStream, ReplayTransport
+from connection import ThreadScheduler
+
+# seconds bench_handlers waits for the engine to handle the messages already sent
+DRAIN_TIMEOUT = 30
+
+
+def synthetic_coins(n, trade_coin='BTC', seed=0):
+    '''
+    Build a merged allocation/exchange table with n coins, including the
+    trade coin, filled with plausible random balances, prices and filters
+    '''
+    rng = np.random.RandomState(seed)
+    coins = [trade_coin] + ['C{0:04d}'.format(i) for i in range(n - 1)]
+    allocation = rng.dirichlet(np.ones(n)) * 100
+    price = np.concatenate([[1.0], 10 ** rng.uniform(-8, -1, n - 1)])
+    value = rng.uniform(0.001, 1, n)
+    balance = value / price
+    ticksize = np.concatenate([[0], 10 ** np.floor(np.log10(price[1:]) - 3)])
+    stepsize = np.concatenate([[0], 10 ** np.clip(np.floor(-np.log10(balance[1:])), -8, 0)])
+    frame = pd.DataFrame({'coin':               coins,
+                          'symbol':             [coin + trade_coin for coin in coins],
+                          'fixed_balance':      np.zeros(n),
+                          'exchange_balance':   balance,
+                          'locked_balance':     np.zeros(n),
+                          'allocation':         allocation,
+                          'price':              price,
+                          'askprice':           price * 1.001,
+                          'bidprice':           price * 0.999,
+                          'minprice':           ticksize,
+                          'maxprice':           np.full(n, 1e5),
+                          'ticksize':           ticksize,
+                          'minqty':             stepsize,
+                          'maxqty':             np.full(n, 9e6),
+                          'stepsize':           stepsize,
+                          'minnotional':        np.where(price < 1, 0.001, 0),
+                          'multiplierup':       np.full(n, 5.0),
+                          'multiplierdown':     np.full(n, 0.2),
+                          'last_placement':     np.full(n, np.nan),
+                          'last_execution':     np.full(n, np.nan)})
+    return frame
+
+
+def timeit(fn, repeat):
+    ''' Mean wall-clock seconds per call of fn over repeat calls '''
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_planner(sizes, repeat=200):
+    ''' Per-tick cost of planning, and of formatting the plan for display '''
+    results = []
+    for n in sizes:
+        state = PortfolioState(synthetic_coins(n), 'BTC')
+        plan = timeit(lambda: plan_trades(state), repeat)
+        text = timeit(lambda: describe(plan_trades(state), state), max(1, repeat // 10))
+        results.append({'coins': n,
+                        'plan_us': round(1e6 * plan, 2),
+                        'plan_and_describe_us': round(1e6 * text, 2)})
+    return results
+
+
+class MessageGenerator(object):
+    '''
+    Produce realistic websocket payloads for a synthetic portfolio:
+    24hrTicker messages for random pairs, interleaved with
+    outboundAccountInfo and executionReport messages at the given
+    fractions of the message stream.
+    '''
+    def __init__(self, coins, trade_coin='BTC', account_fraction=0.01,
+                 execution_fraction=0.01, seed=0):
+        self.rng = np.random.RandomState(seed)
+        self.trade_coin = trade_coin
+        self.coins = [coin for coin in coins['coin'] if coin != trade_coin]
+        self.all_coins = list(coins['coin'])
+        self.price = dict(zip(coins['coin'], coins['price']))
+        self.balance = dict(zip(coins['coin'], coins['exchange_balance']))
+        self.account_fraction = account_fraction
+        self.execution_fraction = execution_fraction
+        self.order_id = 0
+
+    def ticker(self, coin, now):
+        price = self.price[coin] * np.exp(self.rng.normal(0, 1e-4))
+        self.price[coin] = price
+        spread = price * 5e-4
+        return {'e': '24hrTicker', 'E': now, 's': coin + self.trade_coin,
+                'p': '{0:.8f}'.format(price * 0.01), 'P': '1.000',
+                'w': '{0:.8f}'.format(price * 0.999),
+                'x': '{0:.8f}'.format(price), 'c': '{0:.8f}'.format(price), 'Q': '10.0',
+                'b': '{0:.8f}'.format(price - spread), 'B': '100.0',
+                'a': '{0:.8f}'.format(price + spread), 'A': '100.0',
+                'o': '{0:.8f}'.format(price * 0.99), 'h': '{0:.8f}'.format(price * 1.02),
+                'l': '{0:.8f}'.format(price * 0.98), 'v': '123456.0', 'q': '12.3',
+                'O': now - 86400000, 'C': now, 'F': 0, 'L': 18150, 'n': 18151}
+
+    def account(self, now):
+        balances = [{'a': coin,
+                     'f': '{0:.8f}'.format(self.balance[coin]),
+                     'l': '0.00000000'} for coin in self.all_coins]
+        return {'e': 'outboundAccountInfo', 'E': now, 'm': 10, 't': 10, 'b': 0, 's': 0,
+                'T': True, 'W': True, 'D': True, 'u': now, 'B': balances}
+
+    def execution(self, coin, now):
+        self.order_id += 1
+        quantity = '{0:.8f}'.format(self.balance[coin] * 0.01)
+        price = '{0:.8f}'.format(self.price[coin])
+        return {'e': 'executionReport', 'E': now, 's': coin + self.trade_coin,
+                'c': 'bench{0}'.format(self.order_id), 'S': 'BUY', 'o': 'MARKET',
+                'f': 'GTC', 'q': quantity, 'p': '0.00000000', 'P': '0.00000000',
+                'F': '0.00000000', 'g': -1, 'C': '', 'x': 'TRADE', 'X': 'FILLED',
+                'r': 'NONE', 'i': self.order_id, 'l': quantity, 'z': quantity,
+                'L': price, 'n': '0.00000100', 'N': 'BNB', 'T': now,
+                't': self.order_id, 'I': self.order_id, 'w': False, 'm': False,
+                'M': True, 'Z': price, 'Y': price}
+
+    def generate(self, count, start=1558282800000, interval=1):
+        ''' Return count messages with event times interval ms apart '''
+        kinds = self.rng.uniform(size=count)
+        coins = self.rng.randint(len(self.coins), size=count)
+        messages = []
+        for k in range(count):
+            now = start + k * interval
+            coin = self.coins[coins[k]]
+            if kinds[k] < self.account_fraction:
+                messages.append(self.account(now))
+            elif kinds[k] < self.account_fraction + self.execution_fraction:
+                messages.append(self.execution(coin, now))
+            else:
+                messages.append(self.ticker(coin, now))
+        return messages
+
+
+def bench_handlers(n, rate, duration, seed=0):
+    '''
+    Feed synthetic messages into a RebalanceEngine event loop at rate
+    messages per second (0 for as fast as possible) for duration seconds,
+    with no network and no window, and measure how many are handled
+    and how long each waited from arrival until its handler finished.
+    '''
+    tmp = tempfile.mkdtemp()
+    settings = Settings('config.ini')
+    settings.records_directory = os.path.join(tmp, 'records')
+    settings.journal_path = os.path.join(tmp, 'trade_history.csv')
+    settings.state_path = os.path.join(tmp, 'state.json')
+    coins = synthetic_coins(n, settings.trade_currency, seed)
+    engine = RebalanceEngine(coins[['coin', 'fixed_balance', 'allocation']], settings)
+    engine.set_state(coins)
+    engine.subscribe(lambda snapshot: None)
+
+    count = int(rate * duration) if rate else 200000
+    messages = MessageGenerator(coins, settings.trade_currency, seed=seed).generate(count)
+    latencies = []
+    handle = engine.get_msg
+
+    def timed(msg):
+        sent = msg.pop('_t')
+        handle(msg)
+        latencies.append(time.perf_counter() - sent)
+
+    engine.get_msg = timed
+    engine.start_loop()
+    start = time.perf_counter()
+    for k, msg in enumerate(messages):
+        if rate:
+            delay = start + k / float(rate) - time.perf_counter()
+            if delay > 0.001:
+                time.sleep(delay)
+        elif time.perf_counter() - start > duration:
+            break
+        msg['_t'] = time.perf_counter()
+        engine.queue_msg(msg)
+    sent = k + 1
+    # a stalled engine fails the run instead of hanging it
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while not engine.queue.empty():
+        if time.perf_counter() > deadline or not engine.thread.is_alive():
+            engine.close()
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise RuntimeError('The engine did not drain its queue ({0} messages left, {1} errors)'
+                               .format(engine.queue.stats()['depth'], engine.errors))
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    engine.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    stats = engine.queue.stats()
+    latencies = np.array(latencies)
+    p50, p99 = 1000 * np.percentile(latencies, [50, 99])
+    return {'coins': n,
+            'rate': rate,
+            'sent': sent,
+            'handled': len(latencies),
+            'conflated': stats['conflated'],
+            'throughput': sent / elapsed,
+            'handled_per_second': len(latencies) / elapsed,
+            'p50_ms': p50,
+            'p99_ms': p99,
+            'peak_depth': stats['peak_depth']}
+
+
+def write_replay(path, coins, trade_coin='BTC', count=100000, seed=0):
+    '''
+    Write count synthetic book ticker updates of the coins to path as
+    combined-stream messages, one JSON object per line, the format that
+    MarketDataStream(record=...) writes and ReplayTransport reads
+    '''
+    generator = MessageGenerator(coins, trade_coin, account_fraction=0, execution_fraction=0, seed=seed)
+    with open(path, 'w') as f:
+        for k, msg in enumerate(generator.generate(count)):
+            data = {'u': k, 's': msg['s'], 'b': msg['b'], 'B': msg['B'], 'a': msg['a'], 'A': msg['A']}
+            f.write(json.dumps({'stream': msg['s'].lower() + MarketDataStream.stream_suffix,
+                                'data': data}) + '\n')
+
+
+def replay_symbols(path):
+    ''' The symbols of the book ticker messages in a recorded stream, in order of appearance '''
+    symbols = dict()
+    with open(path) as f:
+        for line in f:
+            data = json.loads(line).get('data', {})
+            if 'e' not in data and 's' in data:
+                symbols.setdefault(data['s'])
+    return list(symbols)
+
+
+def bench_replay(path, rate, duration, drop_after=None, n=40, seed=0):
+    '''
+    Run a RebalanceEngine on market data replayed from a recorded
+    stream file through its supervised market stream, with no network,
+    for duration seconds at rate messages per second (0 for as fast as
+    possible), and measure how many updates are handled, their latency
+    and, with drop_after, how the stream recovers from a connection
+    dropped after every drop_after messages. Without a file, book
+    tickers of n synthetic coins are replayed.
+    '''
+    tmp = tempfile.mkdtemp()
+    settings = Settings('config.ini')
+    settings.records_directory = os.path.join(tmp, 'records')
+    settings.journal_path = os.path.join(tmp, 'trade_history.csv')
+    settings.state_path = os.path.join(tmp, 'state.json')
+    trade_coin = settings.trade_currency
+    if path is None:
+        coins = synthetic_coins(n, trade_coin, seed)
+        path = os.path.join(tmp, 'replay.jsonl')
+        write_replay(path, coins, trade_coin, seed=seed)
+    else:
+        pairs = [symbol for symbol in replay_symbols(path) if symbol.endswith(trade_coin)]
+        # recorded pairs on a synthetic portfolio; only the handling cost is measured
+        coins = synthetic_coins(len(pairs) + 1, trade_coin, seed)
+        coins['coin'] = [trade_coin] + [pair[:-len(trade_coin)] for pair in pairs]
+        coins['symbol'] = coins['coin'] + trade_coin
+    engine = RebalanceEngine(coins[['coin', 'fixed_balance', 'allocation']], settings)
+    engine.set_state(coins)
+    engine.subscribe(lambda snapshot: None)
+    engine.symbols = [symbol for symbol in engine.state.symbols if symbol != trade_coin + trade_coin]
+    engine.market_transport = lambda: ReplayTransport(path, rate or None, loop=True, drop_after=drop_after)
+    # no reactor runs without the exchange
+    engine.supervisor.scheduler = ThreadScheduler()
+    engine.supervisor.add('market', engine.start_market_data, lambda stream: stream.stop(), engine.queue_msg,
+                          stale_after=settings.stale_after, base=0.01, cap=0.1)
+    engine.start_loop()
+    time.sleep(duration)
+    stream = engine.supervisor.stats()['market']
+    latency = engine.latency.summary().get('bookTicker', {'p50': np.nan, 'p99': np.nan, 'count': 0})
+    stats = engine.queue.stats()
+    engine.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+    return {'coins': len(coins),
+            'rate': rate,
+            'drop_after': drop_after,
+            'handled': latency['count'],
+            'handled_per_second': latency['count'] / duration,
+            'p50_ms': latency['p50'],
+            'p99_ms': latency['p99'],
+            'conflated': stats['conflated'],
+            'peak_depth': stats['peak_depth'],
+            'reconnects': stream['reconnects'],
+            'downtime': stream['downtime']}
+
+
+def capture(symbols, seconds, path):
+    '''
+    Record the live book ticker stream of the symbols to path for
+    seconds, for the replay benchmark. Market streams are public, so
+    no API key is needed.
+    '''
+    from binance.client import Client
+    from binance.websockets import BinanceSocketManager
+    from twisted.internet import reactor
+    bm = BinanceSocketManager(Client(None, None))
+    stream = MarketDataStream(BinanceTransport(bm), symbols, lambda msg: None, record=path)
+    stream.start()
+    bm.start()
+    time.sleep(seconds)
+    stream.close()
+    bm.close()
+    reactor.stop()
+    return {'symbols': symbols, 'seconds': seconds, 'messages': stream.received, 'file': path}
+
+
+def environment():
+    ''' Describe the code version and machine a benchmark ran on '''
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'revision': revision,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.platform()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebalancer benchmarks')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--output', help='also write the results to this JSON file')
+    sub = parser.add_subparsers(dest='benchmark')
+    planner = sub.add_parser('planner', parents=[common], help='per-tick rebalance planning cost')
+    planner.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    planner.add_argument('--repeat', type=int, default=200)
+    handlers = sub.add_parser('handlers', parents=[common], help='message handling throughput and latency')
+    handlers.add_argument('--coins', type=int, nargs='+', default=[10, 40, 100])
+    handlers.add_argument('--rate', type=float, nargs='+', default=[0],
+                          help='messages per second, 0 for as fast as possible')
+    handlers.add_argument('--duration', type=float, default=5, help='seconds per run')
+    replay = sub.add_parser('replay', parents=[common], help='market stream handling from a recorded stream')
+    replay.add_argument('--file', help='stream recorded by capture (default: synthetic book tickers)')
+    replay.add_argument('--coins', type=int, default=40, help='synthetic coins without --file')
+    replay.add_argument('--rate', type=float, nargs='+', default=[0],
+                        help='messages per second, 0 for as fast as possible')
+    replay.add_argument('--duration', type=float, default=5, help='seconds per run')
+    replay.add_argument('--drop-after', type=int, default=None,
+                        help='drop the connection after every this many messages')
+    record = sub.add_parser('capture', parents=[common], help='record live book tickers for replay')
+    record.add_argument('--symbols', nargs='+', required=True)
+    record.add_argument('--seconds', type=float, default=60)
+    record.add_argument('--file', required=True)
+    args = parser.parse_args()
+    if args.benchmark == 'planner':
+        results = bench_planner(args.sizes, args.repeat)
+    elif args.benchmark == 'handlers':
+        results = [bench_handlers(n, rate, args.duration)
+                   for n in args.coins for rate in args.rate]
+    elif args.benchmark == 'replay':
+        results = [bench_replay(args.file, rate, args.duration, args.drop_after, args.coins)
+                   for rate in args.rate]
+    elif args.benchmark == 'capture':
+        results = capture(args.symbols, args.seconds, args.file)
+    else:
+        parser.error('choose a benchmark')
+    report = {'benchmark': args.benchmark,
+              'environment': environment(),
+              'results': results}
+    text = json.dumps(report, indent=2, default=float)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,69 +1,78 @@
+import time
+# measured before any other import for --profile-startup
+STARTED = time.perf_counter()
 import tkinter as tk
 import tkinter.ttk
-import tkinter.filedialog
-import pandas as pd
-from binance.client import Client
-from binance.websockets import BinanceSocketManager
-from binance.enums import *
-from binance.exceptions import *
-import numpy as np
 from datetime import datetime
-import time
 from tkinter import messagebox
-import queue
-from twisted.internet import reactor
-import os.path
+import os
+import sys
+import csv
+import json
+import math
+import logging
+import argparse
+import importlib
 import configparser
-from collections import deque
-from scipy.signal import detrend
+from render import CellRenderer
+from wakeup import TkWakeup
+from timing import PhaseTimer
+from settings import Settings, ConfigError
+IMPORTED = time.perf_counter()
 
-def round_decimal(num, decimal):
-    '''
-    Round a given floating point down number 'num' to the nearest integer
-    multiple of another floating point number 'decimal' smaller than
-    'num' and return it as a string with up to 8 decimal places,
-    dropping any trailing zeros.
-    '''
-    if decimal > 0:
-        x = int(num/decimal)*decimal
-    else:
-        x = np.round(num, 8)
-    return '{0:.8f}'.format(x).rstrip('0').rstrip('.')
+# numpy, pandas, twisted and python-binance are only imported once they are
+# needed: by the engine at login, or by the shared market data hub
+DEFERRED_IMPORTS = ('numpy', 'pandas', 'twisted.internet.reactor', 'binance.client', 'engine')
 
+logger = logging.getLogger('binancebalance')
+
+# optional Treeview columns and the snapshot indicators they show
+INDICATOR_COLUMNS = {'Volatility': 'volatility',
+                     'Spread':     'ewma_spread',
+                     'Detrended':  'detrended',
+                     'VWAP Drift': 'vwap_drift'}
 
-    
 class BalanceGUI(tk.Frame):
-    def __init__(self, parent, coins):
-        ''' Initialize the GUI and read the config file '''
+    def __init__(self, parent, coins, settings, hub=None):
+        '''
+        Initialize the GUI for a portfolio. The RebalanceEngine it
+        observes is created at login, so the window does not wait for
+        the engine's imports.
+        '''
         tk.Frame.__init__(self, parent)
         parent.protocol('WM_DELETE_WINDOW', self.on_closing)
         self.parent = parent
         parent.deiconify()
-        self.coins = coins
+        self.engine = None
         self.coins_base = coins
-        self.queue = queue.Queue()
-        self.trades_placed = 0
-        self.trades_completed = 0
-        self.trades = []
-        self.headers = self.column_headers()
-        self.read_config()
-        self.initalize_records()
+        self.settings = settings
+        self.hub = hub
+        self.coins = list(coins['coin'])
+        self.trade_currency = settings.trade_currency
+        self.ignore_backlog = settings.ignore_backlog
+        self.snapshot = None
+        self.shown_snapshot = None
+        self.wakeup = None
         
         #portfolio display
         self.portfolio_view = tk.LabelFrame(parent, text='Portfolio')
         self.portfolio_view.grid(row=0, column=0, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
         self.portfolio = tkinter.ttk.Treeview(self.portfolio_view, height = len(self.coins), selectmode = 'extended')
-        self.portfolio['columns']=('Stored',
-                                   'Exchange',
-                                   'Locked',
-                                   'Target',
-                                   'Actual',
-                                   'Bid',
-                                   'Ask',
-                                   'Action',
-                                   'Status',
-                                   'Event'
-                                   )
+        self.indicator_columns = settings.indicator_columns
+        columns = ('Stored',
+                   'Exchange',
+                   'Locked',
+                   'Target',
+                   'Actual',
+                   'Bid',
+                   'Ask',
+                   'Action',
+                   'Status',
+                   'Event'
+                   )
+        if self.indicator_columns:
+            columns += tuple(INDICATOR_COLUMNS)
+        self.portfolio['columns'] = columns
         for label in self.portfolio['columns']:
             if label == 'Status' or label == 'Event':
                 self.portfolio.column(label, width=200)
@@ -73,6 +82,7 @@ class BalanceGUI(tk.Frame):
                 self.portfolio.column(label, width=100)
             self.portfolio.heading(label, text=label)
         self.portfolio.grid(row=0,column=0)
+        self.render = CellRenderer(self.portfolio, settings.max_fps)
 
         for i in range(2):
             self.parent.columnconfigure(i,weight=1, uniform='parent')
@@ -138,35 +148,62 @@ class BalanceGUI(tk.Frame):
         self.trades_count_display = tk.Label(self.stats_view, textvariable=self.trades_count)
         self.trades_count_display.grid(row=1, column=3, sticky=tk.E + tk.W)
 
-    def read_config(self):
-        s_to_ms = 1000
-        config = configparser.RawConfigParser(allow_no_value=False)
-        config.read('config.ini')
-        self.trade_currency = config.get('trades', 'trade_currency')
-        if self.trade_currency != 'BTC':
-            self.display_error('Config Error',
-                               '{0} trading pairs are not supported yet, only BTC'.format(self.trade_currency),
-                               quit_on_exit=True)
-        self.rebalance_time = int(config.get('trades', 'rebalance_period')) * s_to_ms
-        if self.rebalance_time <= 0:
-            self.display_error('Config Error',
-                               'Rebalance period must be a positive integer (seconds)',
-                               quit_on_exit=True)
-        self.min_trade_value = float(config.get('trades', 'min_trade_value'))
-        if self.min_trade_value <= 0:
-            self.min_trade_value = None
-        self.trade_type = config.get('trades', 'trade_type')
-        if self. trade_type != 'MARKET' and self.trade_type != 'LIMIT':
-            self.display_error('Config Error',
-                               '{0} is not a supported trade type. Use MARKET or LIMIT'.format(trade_type),
-                               quit_on_exit=True)
-        self.ignore_backlog = int(config.get('websockets', 'ignore_backlog'))
-        
+        self.depth_label = tk.Label(self.stats_view, text='Queue Depth:', relief='ridge')
+        self.depth_label.grid(row=2, column=0, sticky=tk.E + tk.W)
+        self.depth_string = tk.StringVar()
+        self.depth_string.set('0 (peak 0)')
+        self.depth_value = tk.Label(self.stats_view, textvariable=self.depth_string)
+        self.depth_value.grid(row=2, column=1, sticky=tk.E + tk.W)
+
+        self.conflated_label = tk.Label(self.stats_view, text='Conflated/Dropped:', relief='ridge')
+        self.conflated_label.grid(row=2, column=2, sticky=tk.E + tk.W)
+        self.conflated_string = tk.StringVar()
+        self.conflated_string.set('0/0')
+        self.conflated_value = tk.Label(self.stats_view, textvariable=self.conflated_string)
+        self.conflated_value.grid(row=2, column=3, sticky=tk.E + tk.W)
+
+        self.writes_label = tk.Label(self.stats_view, text='Cell Writes Saved:', relief='ridge')
+        self.writes_label.grid(row=3, column=0, sticky=tk.E + tk.W)
+        self.writes_string = tk.StringVar()
+        self.writes_string.set('0/0')
+        self.writes_value = tk.Label(self.stats_view, textvariable=self.writes_string)
+        self.writes_value.grid(row=3, column=1, sticky=tk.E + tk.W)
+
+        self.latency_label = tk.Label(self.stats_view, text='Order Latency:', relief='ridge')
+        self.latency_label.grid(row=3, column=2, sticky=tk.E + tk.W)
+        self.latency_string = tk.StringVar()
+        self.latency_string.set('-')
+        self.latency_value = tk.Label(self.stats_view, textvariable=self.latency_string)
+        self.latency_value.grid(row=3, column=3, sticky=tk.E + tk.W)
+
+        self.tick_latency_label = tk.Label(self.stats_view, text='Price Latency:', relief='ridge')
+        self.tick_latency_label.grid(row=4, column=0, sticky=tk.E + tk.W)
+        self.tick_latency_string = tk.StringVar()
+        self.tick_latency_string.set('-')
+        self.tick_latency_value = tk.Label(self.stats_view, textvariable=self.tick_latency_string)
+        self.tick_latency_value.grid(row=4, column=1, sticky=tk.E + tk.W)
+
+        self.fill_latency_label = tk.Label(self.stats_view, text='Execution Latency:', relief='ridge')
+        self.fill_latency_label.grid(row=4, column=2, sticky=tk.E + tk.W)
+        self.fill_latency_string = tk.StringVar()
+        self.fill_latency_string.set('-')
+        self.fill_latency_value = tk.Label(self.stats_view, textvariable=self.fill_latency_string)
+        self.fill_latency_value.grid(row=4, column=3, sticky=tk.E + tk.W)
+
+        #recent executions from the trade journal, newest first
+        self.trades_view = tk.LabelFrame(parent, text='Recent Trades')
+        self.trades_view.grid(row=2, column=0, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
+        self.trades_view.columnconfigure(0, weight=1)
+        self.recent_trades = tk.Listbox(self.trades_view, height=6)
+        self.recent_trades.grid(row=0, column=0, sticky=tk.E + tk.W + tk.N + tk.S)
+        self.shown_journaled = 0
+
     def on_closing(self):
         ''' Check that all trades have executed
         before starting the save and exit process
         '''
-        if self.trades_placed > 0 and self.trades_completed < self.trades_placed:
+        engine = self.engine
+        if engine is not None and engine.trades_placed > 0 and engine.trades_completed < engine.trades_placed:
             if messagebox.askokcancel('Quit', 'Not all trades have completed. Quit anyway?'):
                 self.save_and_quit()
         else:
@@ -174,27 +211,14 @@ class BalanceGUI(tk.Frame):
 
     def save_and_quit(self):
         '''
-        If trades have been executed in the current session,
-        save them to file. Stop all websockets and exit the GUI.
+        Stop the engine, which saves trades executed in the current
+        session and stops all websockets, and exit the GUI.
         '''
-        if self.trades:
-            df = pd.DataFrame(self.trades)
-            if os.path.isfile('trade_history.csv'):
-                with open('trade_history.csv','a') as f:
-                    df.to_csv(f, sep=',', header=False, index=False)
-            else:
-                with open('trade_history.csv','w') as f:
-                    df.to_csv(f, sep=',', header=True, index=False)
-        for coin in self.coins['coin']:
-            pair = coin+self.trade_currency
-            self.records[pair].close()
-        try:
-            self.bm.close()
-            reactor.stop()
-        except AttributeError:
-            self.parent.destroy()
-        else:
-            self.parent.destroy()
+        if self.engine is not None:
+            self.engine.close()
+        if self.wakeup is not None:
+            self.wakeup.close()
+        self.parent.destroy()
 
     def exit_error(self):
         if self.quit_on_exit:
@@ -206,7 +230,7 @@ class BalanceGUI(tk.Frame):
     def display_error(self, title, error, quit_on_exit=False):
         self.quit_on_exit = quit_on_exit
         self.top = tk.Toplevel()
-        self.top.title('Login Error')
+        self.top.title(title)
         msg = tk.Message(self.top, text=error)
         msg.grid(row=0, column=0)
         button = tk.Button(self.top, text="Dismiss", command=self.exit_error)
@@ -216,17 +240,19 @@ class BalanceGUI(tk.Frame):
     def api_enter(self):
         '''
         Log in to Binance with the provided credentials,
-        update user portfolio and start listening to price and
-        account update websockets.
+        update user portfolio and start the engine.
         '''
+        from binance.exceptions import BinanceAPIException, BinanceRequestException
+        from engine import RebalanceEngine
         api_key = self.key_entry.get()
         self.key_entry.delete(0,'end')
         api_secret = self.secret_entry.get()
         self.secret_entry.delete(0,'end')
-        
+        if self.engine is None:
+            self.engine = RebalanceEngine(self.coins_base, self.settings, self.hub)
+
         try:
-            self.client = Client(api_key, api_secret)
-            status = self.client.get_system_status()
+            self.engine.login(api_key, api_secret)
         except (BinanceRequestException,
                 BinanceAPIException) as e:
             self.display_error('Login Error', e.message)
@@ -235,45 +261,20 @@ class BalanceGUI(tk.Frame):
                 self.populate_portfolio()
             except BinanceAPIException as e:
                 self.display_error('API Error', e.message, quit_on_exit=True)
+            except ConfigError as e:
+                self.display_error('Configuration Error', str(e), quit_on_exit=True)
             else:
-                self.start_websockets()
-            
-            
-            
-    def start_websockets(self):
-        '''
-        Start websockets to get price updates for all coins in the portfolio,
-        trade execution reports, and user account balance updates.
-        Start the message queue processor.
-        '''
-        self.bm = BinanceSocketManager(self.client)
-        trade_currency = self.trade_currency
-        symbols = self.coins['symbol'].tolist()
-        symbols.remove(trade_currency+trade_currency)
-        self.sockets = {}
-        for symbol in symbols:
-            self.sockets[symbol] = self.bm.start_symbol_ticker_socket(symbol, self.queue_msg)
-        self.sockets['user'] = self.bm.start_user_socket(self.queue_msg)
-        self.bm.start()
-        self.parent.after_idle(self.parent.after,1,self.process_queue)
-
-    def initalize_records(self):
-        self.records = dict()
-        for coin in self.coins['coin']:
-            pair = coin+self.trade_currency
-            self.records[pair] = open(pair + '.csv','a+',1) #unbuffered
-            
+                self.wakeup = TkWakeup(self.parent, self.render_frame, self.render.interval)
+                self.engine.subscribe(self.on_snapshot)
+                self.engine.start()
+
     def populate_portfolio(self):
         '''
-        Get all symbol info from Binance needed to
-        populate user portfolio data and execute trades
+        Let the engine fetch the user portfolio while showing
+        its progress, then fill the portfolio display
         '''
-        self.coins = self.coins_base
         self.portfolio.delete(*self.portfolio.get_children())
-        exchange_coins = []
-        trade_currency = self.trade_currency
-        self.trade_coin = trade_currency
-
+        self.render.reset()
 
         #update the GUI context
         self.key_label.destroy()
@@ -287,98 +288,43 @@ class BalanceGUI(tk.Frame):
         self.progresslabel = tk.Label(self.controls_view, textvariable=updatetext)
         self.progresslabel.grid(row=1, column=0, columnspan=4, sticky=tk.E + tk.W)
         progress_var = tk.DoubleVar()
-        progress = 0
-        progress_var.set(progress)
+        progress_var.set(0)
         self.progressbar = tkinter.ttk.Progressbar(self.controls_view, variable=progress_var, maximum=len(self.coins))
         self.progressbar.grid(row=0, column=0, columnspan=4, sticky=tk.E + tk.W)
-        for coin in self.coins['coin']:
+
+        def progress(n, text):
+            progress_var.set(n)
+            updatetext.set(text)
             self.progressbar.update()
-            progress += 1
-            progress_var.set(progress)
-            updatetext.set('Fetching {0} account information'.format(coin))
             self.progresslabel.update()
-            pair = coin+trade_currency
-            balance = self.client.get_asset_balance(asset=coin)
-            if coin != trade_currency:
-                price = float(self.client.get_symbol_ticker(symbol=pair)['price'])
-                symbolinfo = self.client.get_symbol_info(symbol=pair)['filters']
-                minvalue = float(symbolinfo[3]['minNotional'])
-                if self.min_trade_value is not None:
-                    minvalue = self.min_trade_value
-                row = {'coin':              coin,
-                       'exchange_balance':  float(balance['free']),
-                       'locked_balance':    float(balance['locked']),
-                       'minprice':          float(symbolinfo[0]['minPrice']),
-                       'maxprice':          float(symbolinfo[0]['maxPrice']),
-                       'ticksize':          float(symbolinfo[0]['tickSize']),
-                       'minqty':            float(symbolinfo[2]['minQty']),
-                       'maxqty':            float(symbolinfo[2]['maxQty']),
-                       'stepsize':          float(symbolinfo[2]['stepSize']),                   
-                       'minnotional':       minvalue,
-                       'symbol':            pair,
-                       'askprice' :         price,
-                       'bidprice':          price,
-                       'price':             price,
-                       'last_placement':    None,
-                       'last_execution':    None
-                       }
-            else:
-                fixed_balance = self.coins.loc[self.coins['coin'] == coin]['fixed_balance']
-                row = {'coin':              coin,
-                       'exchange_balance':  float(balance['free']),
-                       'locked_balance':    float(balance['locked']),
-                       'minprice':          0,
-                       'maxprice':          0,
-                       'ticksize':          0,
-                       'minqty':            0,
-                       'maxqty':            0,
-                       'stepsize':          0,                   
-                       'minnotional':       0,
-                       'symbol':            coin+coin,
-                       'askprice' :         1.0,
-                       'bidprice':          1.0,
-                       'price':             1.0,
-                       'last_placement':    None,
-                       'last_execution':    None
-                       }
-            exchange_coins.append(row)
-        exchange_coins = pd.DataFrame(exchange_coins)
-        self.coins = pd.merge(self.coins, exchange_coins, on='coin', how='outer')
-        self.coins['value'] = self.coins.apply(lambda row: row.price * (row.exchange_balance +
-                                                                        row.fixed_balance), axis=1)
-        self.total = np.sum(self.coins['value'])
-        self.coins['actual'] = self.coins.apply(lambda row: 100.0 * row.value/self.total, axis=1)
-        self.update_status()
-        i = 0
-        for row in self.coins.itertuples():
+
+        self.engine.populate(progress)
+        snapshot = self.engine.snapshot()
+        for i, coin in enumerate(snapshot['coins']):
             self.portfolio.insert('' ,
                                   i,
-                                  iid=row.coin,
-                                  text=row.coin,
-                                  values=(row.fixed_balance,
-                                          row.exchange_balance,
-                                          row.locked_balance,
-                                          '{0} %'.format(row.allocation),
-                                          '{0:.2f} %'.format(row.actual),
-                                          round_decimal(row.price, row.ticksize),
-                                          round_decimal(row.price, row.ticksize),
+                                  iid=coin,
+                                  text=coin,
+                                  values=(snapshot['fixed_balance'][i],
+                                          snapshot['exchange_balance'][i],
+                                          snapshot['locked_balance'][i],
+                                          '{0} %'.format(snapshot['allocation'][i]),
+                                          '',
+                                          '',
+                                          '',
                                           '',
                                           ''
                                           )
                                   )
-            i += 1
-        updatetext.set('Testing connection'.format(coin))
-        self.dryrun()
+        self.snapshot = snapshot
         self.progressbar.destroy()
         self.progresslabel.destroy()
 
-        self.automate=tk.BooleanVar()
-        self.automate.set(False)
         self.automate_text = tk.StringVar()
         self.automate_text.set('Start Automation')
         self.toggle_automate = tk.Button(self.controls_view,
                                          textvariable=self.automate_text,
-                                         command=lambda: self.automation(toggle=True))
+                                         command=self.automation)
         self.toggle_automate.grid(row=0, column=0, rowspan=2, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
         self.sell_button = tk.Button(self.controls_view,
                                      text='Execute Sells',
@@ -388,354 +334,385 @@ class BalanceGUI(tk.Frame):
                                     text='Execute Buys',
                                     command=self.execute_buys)
         self.buy_button.grid(row=1, column=2, columnspan=2, sticky=tk.E + tk.W)
-        
-    def update_status(self):
-        '''Update the statistics frame whenever a change occurs in balance or price'''
-        value = '{0:.8f}'.format(self.total)
-        diff = np.diff(self.coins['actual'].values - self.coins['allocation'].values)
-        imbalance = '{0:.2f}%'.format(np.sum(np.absolute(diff)))
-        self.trade_currency_value_string.set(value)
-        self.imbalance_string.set(imbalance)
-        
-    def queue_msg(self, msg):
+
+    def on_snapshot(self, snapshot):
         '''
-        Whenever a weboscket receives a message, check for errors.
-        If an error occurs, restart websockets. If no error, add it to
-        the message queue.
+        Receive a state snapshot from the engine thread. Only the
+        reference is stored; the Tk thread is woken to render it.
         '''
-        if msg['e'] == 'error':
-            self.bm.close()
-            reactor.stop()
-            self.start_websockets()
-        else:
-            self.queue.put(msg)
+        self.snapshot = snapshot
+        self.wakeup.wake()
 
-    def get_msg(self):
-        '''Reroute new websocket messages to the appropriate handler'''
-        try:
-            msg = self.queue.get(block=False)
-        except queue.Empty:
-            pass
-        else:
-            if msg['e'] == '24hrTicker':
-                self.update_price(msg)
-            elif msg['e'] == 'outboundAccountInfo':
-                self.update_balance(msg)
-            elif msg['e'] == 'executionReport':
-                self.update_trades(msg)
-                
-    def process_queue(self, flush=False):
+    def render_frame(self):
         '''
-        Check for new messages in the queue periodically.
-        Recursively calls itself to perpetuate the process.
+        Render the latest engine snapshot, if it has not been shown yet,
+        and write the changed cells to the Treeview. Runs only when the
+        engine published a new snapshot, which it does at most max_fps
+        times a second, so an idle window does no work at all.
         '''
-        if flush:
-            while not self.queue.empty():
-                self.get_msg()
-        else:
-            self.get_msg()
-            self.master.after_idle(self.master.after,1,self.process_queue)
-        n = self.queue.qsize()
-        if n > self.ignore_backlog:
+        snapshot = self.snapshot
+        if snapshot is not self.shown_snapshot:
+            self.shown_snapshot = snapshot
+            self.update_portfolio(snapshot)
+            self.update_status(snapshot)
+        self.render.flush()
+        self.writes_string.set('{0}/{1}'.format(self.render.saved(), self.render.requested))
+
+    def update_portfolio(self, snapshot):
+        ''' Write balances, prices, allocations, actions and events to the display '''
+        from portfolio import round_decimal
+        events = snapshot['events']
+        indicators = snapshot['indicators']
+        for i, coin in enumerate(snapshot['coins']):
+            stepsize = snapshot['stepsize'][i]
+            ticksize = snapshot['ticksize'][i]
+            self.render.set(coin, column='Exchange', value=round_decimal(snapshot['exchange_balance'][i], stepsize))
+            self.render.set(coin, column='Locked', value=round_decimal(snapshot['locked_balance'][i], stepsize))
+            self.render.set(coin, column='Actual', value='{0:.2f}%'.format(snapshot['actual'][i]))
+            self.render.set(coin, column='Bid', value=round_decimal(snapshot['bidprice'][i], ticksize))
+            self.render.set(coin, column='Ask', value=round_decimal(snapshot['askprice'][i], ticksize))
+            self.render.set(coin, column='Action', value=snapshot['actions'][i])
+            self.render.set(coin, column='Status', value=snapshot['statuses'][i])
+            if coin in events:
+                self.render.set(coin, column='Event', value=events[coin])
+            if self.indicator_columns:
+                for column, key in INDICATOR_COLUMNS.items():
+                    value = indicators[key][i]
+                    self.render.set(coin, column=column, value='' if math.isnan(value) else '{0:.3f}%'.format(value))
+
+    def update_status(self, snapshot):
+        '''Update the statistics frame whenever a change occurs in balance or price'''
+        self.trade_currency_value_string.set('{0:.8f}'.format(snapshot['total']))
+        self.imbalance_string.set('{0:.2f}%'.format(snapshot['imbalance']))
+        self.trades_count.set(snapshot['trades_completed'])
+        stats = snapshot['queue']
+        n = stats['depth']
+        down = [name for name, stream in snapshot['connections'].items()
+                if not stream['connected'] and stream['reconnects']]
+        if snapshot['provisional'] and snapshot['reconcile_error']:
+            self.messages_string.set('Provisional (reconcile failed: {0}, retrying)'.format(snapshot['reconcile_error']))
+        elif snapshot['provisional']:
+            self.messages_string.set('Provisional (restored state, reconciling)')
+        elif snapshot['reconcile_error']:
+            self.messages_string.set('Reconcile failed: {0}, retrying'.format(snapshot['reconcile_error']))
+        elif down:
+            self.messages_string.set('Reconnecting ' + ', '.join(down))
+        elif n > self.ignore_backlog:
             self.messages_string.set('{0} Updates Queued'.format(n))
         else:
             self.messages_string.set('Up to Date')
-
-
-    def update_trades(self, msg):
-        ''' Update balances whenever a partial execution occurs '''
-        coin = msg['s'][:-len(self.trade_coin)]
-        savemsg = {self.headers[key] : value for key, value in list(msg.items())}
-        filled = float(savemsg['cumulative_filled_quantity'])
-        orderqty = float(savemsg['order_quantity'])
-        side = savemsg['side']
-        if filled >= orderqty:
-            self.coins.loc[self.coins['coin'] == coin, 'last_execution'] = time.mktime(datetime.now().timetuple())
-            self.trades_completed += 1
-            self.trades_count.set(self.trades_completed)
-        self.portfolio.set(coin, column='Event', value = '{0} {1}/{2} {3}'.format(side, filled, orderqty,datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        self.trades.append(savemsg)    
-
-    def update_balance(self, msg):
-        '''
-        Update user balances internally and on the
-        display whenever an account update message is received.
-        '''
-        balances = msg['B']
-        coins = self.coins['coin'].values
-        for balance in balances:
-            coin = balance['a']
-            if coin in coins:
-                exchange_balance = float(balance['f']) + float(balance['l'])
-                locked_balance = float(balance['l'])
-                self.portfolio.set(coin, column='Exchange', value=round_decimal(exchange_balance,self.coins.loc[self.coins['coin'] == coin]['stepsize'].values[0]))
-                self.portfolio.set(coin, column='Locked', value=round_decimal(locked_balance,self.coins.loc[self.coins['coin'] == coin]['stepsize'].values[0]))
-                self.coins.loc[self.coins['coin'] == coin, 'exchange_balance'] = exchange_balance
-                self.coins.loc[self.coins['coin'] == coin, 'locked_balance'] = locked_balance
-                ask = self.coins.loc[self.coins['coin'] == coin, 'askprice'].values[0]
-                value = (self.coins.loc[self.coins['coin'] == coin, 'exchange_balance'].values[0] +
-                         self.coins.loc[self.coins['coin'] == coin, 'fixed_balance'].values[0]) * ask
-                self.coins.loc[self.coins['coin'] == coin, 'value'] = value
-
-        self.total = np.sum(self.coins['value']) 
-        self.coins['actual'] = self.coins.apply(lambda row: 100.0 * row.value / self.total, axis=1)
-        for row in self.coins.itertuples():
-            coin = row.coin
-            actual = '{0:.2f}%'.format(self.coins.loc[self.coins['coin'] == coin, 'actual'].values[0])
-            self.portfolio.set(coin, column='Actual', value=actual)
-        self.update_actions()
-        self.update_status()
-        
-    def update_price(self, msg):
-        '''
-        Update symbol prices and user allocations internally
-        and on the display whenever a price update is received.
-        '''
-        coin = msg['s'][:-len(self.trade_currency)]
-        ask = float(msg['a'])
-        bid = float(msg['b'])
-        askprice = round_decimal(ask,self.coins.loc[self.coins['coin'] == coin, 'ticksize'].values[0])
-        bidprice = round_decimal(bid,self.coins.loc[self.coins['coin'] == coin, 'ticksize'].values[0])
-        self.portfolio.set(coin, column='Ask', value=askprice)
-        self.coins.loc[self.coins['coin'] == coin, 'askprice'] = ask
-        self.portfolio.set(coin, column='Bid', value=bidprice)
-        self.coins.loc[self.coins['coin'] == coin, 'bidprice'] = bid
-        value = (self.coins.loc[self.coins['coin'] == coin, 'exchange_balance'].values[0] +
-                 self.coins.loc[self.coins['coin'] == coin, 'fixed_balance'].values[0]) * ask
-        self.coins.loc[self.coins['coin'] == coin, 'value'] = value
-        self.total = np.sum(self.coins['value'])
-        self.coins['actual'] = self.coins.apply(lambda row: 100.0 * row.value / self.total, axis=1)
-        for row in self.coins.itertuples():
-            coin = row.coin
-            actual = '{0:.2f}%'.format(self.coins.loc[self.coins['coin'] == coin, 'actual'].values[0])
-            self.portfolio.set(coin, column='Actual', value=actual)
-        self.update_actions()
-        self.update_status()
-        self.print_price(msg)
-
-    def print_price(self, msg):
-        pair = msg['s']
-        avg_price = float(msg['w'])
-        time = float(msg['E'])
-        mid_price = (float(msg['b']) + float(msg['a']))/2.0
-        self.records[pair].write('{0},{1},{2}\n'.format(time,avg_price,mid_price))
-
-    def update_actions(self):
-        '''
-        Calcuate required trades and update the main GUI
-        '''
-        for row in self.coins.itertuples():
-            tradecoin_balance = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['exchange_balance'].values)
-            tradecoin_locked = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['locked_balance'].values)
-            tradecoin_free = tradecoin_balance - tradecoin_locked
-            dif = (row.allocation - row.actual) / 100.0 * self.total / row.price
-
-            if dif < 0:
-                side = SIDE_SELL
-            if dif > 0:
-                side = SIDE_BUY
-            
-            status = ''
-            coin = row.coin
-            pair = coin + self.trade_coin
-            balance = float(row.exchange_balance) - float(row.locked_balance)
-            actual = row.actual
-            qty = np.absolute(dif)
-
-            action = '{0} {1}'.format(side, round_decimal(qty, row.stepsize))
-            if side == SIDE_SELL:
-                price = row.bidprice
-            if side == SIDE_BUY:
-                price = row.askprice
-            if side == SIDE_SELL and qty > balance and coin != self.trade_coin:
-                status = 'Insufficient ' + coin + ' for sale'
-            if coin == self.trade_coin:
-                status = 'Ready'
-            elif qty < row.minqty or qty * price < row.minnotional:
-                status = status = 'Trade value too small ({0:.0f}%)'.format(100.0 * qty * price / row.minnotional)
-            elif qty > row.maxqty:
-                status = 'Trade quantity too large'
-            elif side == SIDE_BUY and qty * price > tradecoin_free:
-                status = 'Insufficient ' + self.trade_coin + ' for purchase'
-            else:
-                status = 'Trade Ready'
-            self.portfolio.set(coin, column='Status', value=status)
-            self.portfolio.set(coin, column='Action', value=action)
-            
-    def execute_transactions(self, side, dryrun):
-        '''
-        Calculate the required trade for each coin and execute
-        them if they belong to the appropriate side
-        '''
-        for row in self.coins.itertuples():
-            self.process_queue(flush=True)
-            tradecoin_balance = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['exchange_balance'].values)
-            tradecoin_locked = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['locked_balance'].values)
-            tradecoin_free = tradecoin_balance - tradecoin_locked
-            dif = (row.allocation - row.actual) / 100.0 * self.total / row.price
-            if dif < 0 and side == SIDE_BUY:
-                continue
-            if dif > 0 and side == SIDE_SELL:
-                continue
-            status = ''
-            coin = row.coin
-            pair = coin + self.trade_coin
-            balance = float(row.exchange_balance) - float(row.locked_balance)
-            actual = row.actual
-            qty = np.absolute(dif)
-            action = '{0} {1}'.format(side, round_decimal(qty, row.stepsize))
-            last_placement = np.squeeze(self.coins[self.coins['coin'] == coin]['last_placement'].values)
-            last_execution = np.squeeze(self.coins[self.coins['coin'] == coin]['last_execution'].values)            
-            if side == SIDE_SELL:
-                price = row.bidprice
-            if side == SIDE_BUY:
-                price = row.askprice
-            if side == SIDE_SELL and qty > balance and coin != self.trade_coin:
-                status = 'Insufficient ' + coin + ' for sale'
-            if coin == self.trade_coin:
-                status = 'Ready'
-            elif qty < row.minqty or qty * price < row.minnotional:
-                status = 'Trade value too small ({0:.0f}%)'.format(100.0 * qty * price / row.minnotional)
-            elif qty > row.maxqty:
-                status = 'Trade quantity too large'
-            elif side == SIDE_BUY and qty * price > tradecoin_free:
-                status = 'Insufficient ' + self.trade_coin + ' for purchase'
-            elif last_placement == None or last_execution >= last_placement:
-                trade_currency = self.trade_coin
-                try:
-                    self.place_order(coin, pair, self.trade_type, qty, price, side, dryrun, row.stepsize, row.ticksize)
-                except (BinanceRequestException,
-                        BinanceAPIException,
-                        BinanceOrderException,
-                        BinanceOrderMinAmountException,
-                        BinanceOrderMinPriceException,
-                        BinanceOrderMinTotalException,
-                        BinanceOrderUnknownSymbolException,
-                        BinanceOrderInactiveSymbolException) as e:
-                    self.portfolio.set(coin, column='Event', value=e.message)
-                else:
-                    status = 'Trade Ready'
-                    if not dryrun:
-                        self.trades_placed += 1
-                        status = 'Trade Placed'
-                        self.portfolio.set(coin, column='Event', value='Trade Placed')
-            self.portfolio.set(coin, column='Status', value=status)
-            self.portfolio.set(coin, column='Action', value=action)
-            
-            
-    def automation(self, toggle=False):
-        if toggle:
-            if not self.automate.get():
-                self.automate_text.set('Stop Automation')
-            else:
-                self.automate_text.set('Start Automation')
-            self.automate.set(not self.automate.get())
-        if self.automate.get():
-            self.execute_sells()
-            self.execute_buys()
-            self.rebalance_callback = self.parent.after(self.rebalance_time, self.automation)
+        self.depth_string.set('{0} (peak {1})'.format(n, stats['peak_depth']))
+        self.conflated_string.set('{0}/{1}'.format(stats['conflated'], stats['dropped']))
+        orders = snapshot['orders']
+        if orders and orders['sent']:
+            self.latency_string.set('p50 {0:.0f} ms, p99 {1:.0f} ms'.format(orders['p50'], orders['p99']))
+        latency = snapshot['latency']
+        for event, string in (('bookTicker', self.tick_latency_string),
+                              ('executionReport', self.fill_latency_string)):
+            if event in latency:
+                string.set('p50 {0:.0f} ms, p99 {1:.0f} ms'.format(latency[event]['p50'], latency[event]['p99']))
+        if snapshot['journaled'] != self.shown_journaled:
+            self.shown_journaled = snapshot['journaled']
+            self.recent_trades.delete(0, 'end')
+            for record in reversed(snapshot['recent_trades']):
+                self.recent_trades.insert('end', describe_execution(record))
+        if snapshot['automate']:
+            self.automate_text.set('Stop Automation')
         else:
-            self.parent.after_cancel(self.rebalance_callback)
+            self.automate_text.set('Start Automation')
+
+    def automation(self):
+        ''' Toggle automatic rebalancing in the engine '''
+        engine = self.engine
+        engine.submit(engine.set_automation, not engine.automate)
     
     def execute_sells(self):
         '''
         Perform any sells required by overachieving coins
         '''
-        self.execute_transactions(side=SIDE_SELL, dryrun=False)
+        self.engine.submit(self.engine.execute_sells)
 
     def execute_buys(self):
         '''
         Perform any buys required by underachieving coins
         '''
-        self.execute_transactions(side=SIDE_BUY, dryrun=False)
+        self.engine.submit(self.engine.execute_buys)
+
+
+class JsonFormatter(logging.Formatter):
+    ''' Format log records as one JSON object per line '''
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S'),
+                 'level': record.levelname,
+                 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def describe_execution(record):
+    ''' One line summary of a journaled execution report '''
+    when = datetime.fromtimestamp(int(record['transaction_time']) / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
+    return '{0}  {1} {2} {3}/{4} @ {5}  {6}'.format(when,
+                                                   record['side'],
+                                                   record['symbol'],
+                                                   record['cumulative_filled_quantity'],
+                                                   record['order_quantity'],
+                                                   record['last_executed_price'],
+                                                   record['current_order_status'])
+
+
+def log_snapshots(interval, name=None):
+    '''
+    Return an engine observer that logs a portfolio summary
+    at most once every interval seconds
+    '''
+    last = [0]
+    def observer(snapshot):
+        if snapshot['time'] - last[0] < interval:
+            return
+        last[0] = snapshot['time']
+        logger.info('portfolio', extra={'fields': {'portfolio': name,
+                                                   'total': snapshot['total'],
+                                                   'imbalance': snapshot['imbalance'],
+                                                   'queue_depth': snapshot['queue']['depth'],
+                                                   'connected': {name: stream['connected'] for name, stream
+                                                                 in snapshot['connections'].items()},
+                                                   'provisional': snapshot['provisional'],
+                                                   'reconcile_error': snapshot['reconcile_error'],
+                                                   'trades_placed': snapshot['trades_placed'],
+                                                   'trades_completed': snapshot['trades_completed'],
+                                                   'actual': {coin: round(float(actual), 2) for coin, actual
+                                                              in zip(snapshot['coins'], snapshot['actual'])}}})
+    return observer
+
+
+def credentials(name):
+    '''
+    API key and secret of a portfolio from the environment:
+    BINANCE_API_KEY/BINANCE_API_SECRET, suffixed with _NAME in
+    multi-portfolio mode
+    '''
+    suffix = '_' + name.upper() if name else ''
+    return (os.environ['BINANCE_API_KEY' + suffix],
+            os.environ['BINANCE_API_SECRET' + suffix])
+
+
+def headless(portfolios, automate, hub=None):
+    '''
+    Run one engine per (name, coins, settings) portfolio without a
+    display. API credentials are read from the environment (see
+    credentials) and all output is logged as JSON lines.
+    '''
+    from binance.exceptions import BinanceAPIException, BinanceRequestException
+    from engine import RebalanceEngine
+    engines = []
+    for name, coins, settings in portfolios:
+        try:
+            api_key, api_secret = credentials(name)
+        except KeyError as e:
+            logger.error('config_error', extra={'fields': {'portfolio': name,
+                                                           'error': 'Missing environment variable {0}'.format(e)}})
+            return 1
+        engine = RebalanceEngine(coins, settings, hub)
+        try:
+            engine.login(api_key, api_secret)
+            engine.populate()
+        except ConfigError as e:
+            logger.error('config_error', extra={'fields': {'portfolio': name, 'error': str(e)}})
+            return 1
+        except (BinanceRequestException,
+                BinanceAPIException) as e:
+            logger.error('api_error', extra={'fields': {'portfolio': name, 'error': e.message}})
+            return 1
+        engine.subscribe(log_snapshots(settings.log_interval, name))
+        engines.append(engine)
+    if hub is not None:
+        hub.start()
+    for engine in engines:
+        engine.start()
+        if automate:
+            engine.submit(engine.set_automation, True)
+    try:
+        while all(engine.thread.is_alive() for engine in engines):
+            engines[0].thread.join(1)
+    except KeyboardInterrupt:
+        pass
+    dead = [engine for engine in engines if not engine.thread.is_alive()]
+    for engine in engines:
+        engine.close()
+    if hub is not None:
+        hub.close()
+    if dead:
+        logger.error('engine_died', extra={'fields': {'portfolios': len(dead)}})
+        return 1
+    return 0
+
+
+def read_portfolio(path):
+    '''
+    Read an allocation file into a dictionary of columns, with every
+    column but coin as numbers, and check that it sums to 100%. The
+    engine turns it into a DataFrame, so pandas is not needed to
+    show the window.
+    '''
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    columns = rows[0].keys() if rows else ('coin', 'fixed_balance', 'allocation')
+    coins = {column: [row[column] if column == 'coin' else float(row[column]) for row in rows]
+             for column in columns}
+    if not sum(coins['allocation']) == 100:
+        raise ConfigError('The coin allocations in {0} do not sum to 100%'.format(path))
+    return coins
+
+
+def load_portfolios(path):
+    '''
+    Read a multi-portfolio file with one section per portfolio, e.g.
+
+        [main]
+        allocation = allocation-main.csv
+        config = config.ini
+        journal = trade_history-main.csv
+        state = state-main.json
+
+    config defaults to config.ini, journal to trade_history-NAME.csv
+    and state to state-NAME.json.
+    Return a list of (name, coins, settings).
+    '''
+    config = configparser.RawConfigParser()
+    if not config.read(path):
+        raise ConfigError('Cannot read portfolio file {0}'.format(path))
+    portfolios = []
+    for name in config.sections():
+        section = config[name]
+        if 'allocation' not in section:
+            raise ConfigError('Portfolio {0} has no allocation file'.format(name))
+        settings = Settings(section.get('config', 'config.ini'))
+        settings.journal_path = section.get('journal', 'trade_history-{0}.csv'.format(name))
+        settings.state_path = section.get('state', 'state-{0}.json'.format(name))
+        portfolios.append((name, read_portfolio(section['allocation']), settings))
+    if not portfolios:
+        raise ConfigError('{0} lists no portfolios'.format(path))
+    return portfolios
+
+
+def profile_startup(headless_mode=False, budget=None):
+    '''
+    Time each startup step from the first import to the first window on
+    screen, then the imports deferred until login, and print the
+    breakdown in milliseconds as JSON. Return 1 if the first window took
+    longer than budget seconds (the window_budget setting by default),
+    so the check can gate a build, otherwise 0. Headless, there is no
+    window and no budget.
+    '''
+    timer = PhaseTimer()
+    timer.started = STARTED
+    timer.phases['imports'] = IMPORTED - STARTED
+    with timer.phase('settings'):
+        settings = Settings('config.ini')
+    with timer.phase('portfolio'):
+        coins = read_portfolio('allocation.csv')
+    first_window = None
+    if not headless_mode:
+        with timer.phase('tk'):
+            root = tk.Tk()
+            root.withdraw()
+        with timer.phase('window'):
+            BalanceGUI(root, coins, settings).grid(row=0, column=0)
+            root.wm_title('BinanceBalance')
+            root.update()
+        first_window = timer.total()
+    for name in DEFERRED_IMPORTS:
+        with timer.phase('deferred import ' + name):
+            importlib.import_module(name)
+    report = timer.as_dict()
+    status = 0
+    if first_window is not None:
+        budget = settings.window_budget if budget is None else budget
+        report['first_window'] = round(1000 * first_window, 3)
+        report['budget'] = round(1000 * budget, 3)
+        status = int(first_window > budget)
+        root.destroy()
+    print(json.dumps(report, indent=2))
+    return status
+
 
-    def dryrun(self):
-        '''
-        perform a dry run to list what trades are required
-        '''
-        self.execute_transactions(side=SIDE_SELL, dryrun=True)
-        self.execute_transactions(side=SIDE_BUY, dryrun=True)        
-        
-    def place_order(self, coin, pair, trade_type,
-                    quantity, price, side, dryrun,
-                    stepsize, ticksize):
-        '''
-        Format and place an order using the Binance API
-        '''
-        if trade_type == 'LIMIT':
-            if dryrun:
-                order = self.client.create_test_order(symbol=pair,
-                                                      side=side,
-                                                      type=ORDER_TYPE_LIMIT,
-                                                      timeInForce=TIME_IN_FORCE_GTC,
-                                                      quantity=round_decimal(quantity, stepsize),
-                                                      price=round_decimal(price, ticksize))
-            else:
-                order = self.client.create_order(symbol=pair,
-                                                 side=side,
-                                                 type=ORDER_TYPE_LIMIT,
-                                                 timeInForce=TIME_IN_FORCE_GTC,
-                                                 quantity=round_decimal(quantity, stepsize),
-                                                 price=round_decimal(price, ticksize))
-        elif trade_type == 'MARKET':
-            if dryrun:
-                order = self.client.create_test_order(symbol=pair,
-                                                      side=side,
-                                                      type=ORDER_TYPE_MARKET,
-                                                      quantity=round_decimal(quantity, stepsize))
-            else:
-                order = self.client.create_order(symbol=pair,
-                                                 side=side,
-                                                 type=ORDER_TYPE_MARKET,
-                                                 quantity=round_decimal(quantity, stepsize))
-        if not dryrun:
-            self.coins.loc[self.coins['coin'] == coin, 'last_placement'] = time.mktime(datetime.now().timetuple())
-            
-    def column_headers(self):
-        ''' define human readable aliases for the headers in trade execution reports. '''
-        return {'e': 'event_type',
-                'E': 'event_time',
-                's': 'symbol',
-                'c': 'client_order_id',
-                'S': 'side',
-                'o': 'type',
-                'O': 'order_creation_time',
-                'f': 'time_in_force',
-                'q': 'order_quantity',
-                'p': 'order_price',
-                'P': 'stop_price',
-                'F': 'iceberg_quantity',
-                'g': 'ignore_1',
-                'C': 'original_client_order_id',
-                'x': 'current_execution_type',
-                'X': 'current_order_status',
-                'r': 'order_reject_reason',
-                'i': 'order_id',
-                'l': 'last_executed_quantity',
-                'z': 'cumulative_filled_quantity',
-                'Z': 'cumulative_quote_asset_transacted_qty',
-                'L': 'last_executed_price',
-                'n': 'commission_amount',
-                'N': 'commission_asset',
-                'T': 'transaction_time',
-                't': 'trade_id',
-                'I': 'ignore_2',
-                'w': 'order_working',
-                'm': 'maker_side',
-                'M': 'ignore_3',
-                'Y': 'last_quote_asset_transacted_qty'}
- 
 def main():
+    parser = argparse.ArgumentParser(description='Binance portfolio rebalancer')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without a window and log JSON lines to stdout')
+    parser.add_argument('--automate', action='store_true',
+                        help='start automatic rebalancing immediately (headless only)')
+    parser.add_argument('--portfolios', metavar='FILE',
+                        help='run every portfolio listed in FILE over one shared market data stream')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print the time each startup step takes and exit, with status 1 if '
+                             'the first window takes longer than the budget')
+    parser.add_argument('--startup-budget', type=float, metavar='SECONDS',
+                        help='time to first window allowed by --profile-startup (default window_budget)')
+    args = parser.parse_args()
+    if args.profile_startup:
+        sys.exit(profile_startup(args.headless, args.startup_budget))
+    if args.headless:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
     portfolio = 'allocation.csv'
-    coins = pd.read_csv(portfolio)
-    if not np.sum(coins['allocation']) == 100:
-        messagebox.showinfo('Bad Configuration','Your coin allocations to not sum to 100%')
+    error = None
+    try:
+        settings = Settings('config.ini')
+        if args.portfolios:
+            portfolios = load_portfolios(args.portfolios)
+        else:
+            portfolios = [('', read_portfolio(portfolio), settings)]
+    except ConfigError as e:
+        error = ('Config Error', str(e))
+
+    if error is None and args.portfolios:
+        from hub import MarketDataHub
+        hub = MarketDataHub(settings)
     else:
+        hub = None
+    if args.headless:
+        if error is not None:
+            logger.error('config_error', extra={'fields': {'error': error[1]}})
+            sys.exit(1)
+        sys.exit(headless(portfolios, args.automate, hub))
+    elif error is not None:
+        messagebox.showinfo(*error)
+    elif hub is None:
         root = tk.Tk()
         root.withdraw()
-        BalanceGUI(root, coins).grid(row=0, column=0)
+        BalanceGUI(root, portfolios[0][1], settings).grid(row=0, column=0)
         root.wm_title('BinanceBalance')
         root.mainloop()
+    else:
+        # one window per portfolio; the hidden root exits with the last one
+        root = tk.Tk()
+        root.withdraw()
+        hub.start()
+        windows = set()
+
+        def on_destroy(event):
+            # a Toplevel's bindings also fire for the widgets inside it
+            if event.widget not in windows:
+                return
+            windows.discard(event.widget)
+            if not windows:
+                hub.close()
+                root.destroy()
+        for name, coins, portfolio_settings in portfolios:
+            top = tk.Toplevel(root)
+            top.withdraw()
+            windows.add(top)
+            BalanceGUI(top, coins, portfolio_settings, hub).grid(row=0, column=0)
+            top.wm_title('BinanceBalance - ' + name)
+            top.bind('<Destroy>', on_destroy)
+        root.mainloop()
 
 if __name__=='__main__':
     main()
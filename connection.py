@@ -0,0 +1,266 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('binancebalance')
+
+
+class Backoff(object):
+    '''
+    Exponential backoff with full jitter: the n-th consecutive retry
+    waits a random time between 0 and min(cap, base * 2**n) seconds, so
+    streams that failed together do not reconnect in lockstep.
+    '''
+    def __init__(self, base=1.0, cap=60.0, rng=None):
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+        self.attempt = 0
+
+    def next(self):
+        delay = self.rng.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class PendingCall(object):
+    ''' A delayed call that is skipped if cancelled before it is due '''
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def run(self):
+        if not self.cancelled:
+            self.fn(*self.args)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ThreadScheduler(object):
+    '''
+    Run stream operations on the calling thread and delayed ones on
+    timer threads, for transports that need no event loop, such as a
+    ReplayTransport
+    '''
+    def call(self, fn, *args):
+        fn(*args)
+
+    def call_later(self, delay, fn, *args):
+        timer = threading.Timer(delay, fn, args)
+        timer.daemon = True
+        timer.start()
+
+
+class ReactorScheduler(object):
+    '''
+    Run stream operations on the twisted reactor thread. The reactor
+    APIs that open and close websockets are not thread-safe, so every
+    call, and every backoff delay, is handed to the reactor with
+    callFromThread.
+    '''
+    def __init__(self, reactor):
+        self.reactor = reactor
+
+    def call(self, fn, *args):
+        self.reactor.callFromThread(fn, *args)
+
+    def call_later(self, delay, fn, *args):
+        self.reactor.callFromThread(self.reactor.callLater, delay, fn, *args)
+
+
+class SupervisedStream(object):
+    '''
+    One websocket stream under supervision. start(callback) opens the
+    stream and returns a handle that stop(handle) closes. stale_after,
+    if given, is the number of seconds without a message after which
+    the stream is considered dead even though it reported no error;
+    such a stream counts as connected once its first message arrives.
+    Quiet streams without stale_after, like the user data stream, count
+    as connected as soon as they are opened.
+    '''
+    def __init__(self, name, start, stop, stale_after=None, base=1.0, cap=60.0):
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.stale_after = stale_after
+        self.backoff = Backoff(base, cap)
+        self.handle = None
+        self.connected = False
+        self.started = None
+        self.last_message = None
+        self.down_since = None
+        self.downtime = 0.0
+        self.reconnects = 0
+        self.errors = 0
+        self.last_error = None
+        self.timer = None
+        self.callback = None
+
+
+class StreamSupervisor(object):
+    '''
+    Keep a set of websocket streams alive without ever stopping the
+    reactor. A stream that reports an error, or goes silent for longer
+    than its stale_after, is closed and reopened on its own after a
+    jittered exponential backoff; the other streams are not touched.
+    on_reconnect(name) is called once a reopened stream is connected,
+    so the owner can reconcile any state it missed while it was down.
+    Streams are opened and closed through scheduler, a ReactorScheduler
+    for python-binance sockets; the default ThreadScheduler runs them
+    on the calling thread.
+    '''
+    def __init__(self, on_reconnect=None, scheduler=None):
+        self.on_reconnect = on_reconnect
+        self.scheduler = scheduler or ThreadScheduler()
+        self.streams = dict()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def add(self, name, start, stop, callback, stale_after=None, base=1.0, cap=60.0):
+        ''' Open a stream whose messages, other than errors, are passed to callback '''
+        stream = SupervisedStream(name, start, stop, stale_after, base, cap)
+        stream.callback = self.wrap(stream, callback)
+        self.streams[name] = stream
+        self.scheduler.call(self.open, stream)
+        return stream
+
+    def wrap(self, stream, callback):
+        def on_message(msg):
+            if msg.get('e') == 'error':
+                self.failed(stream, msg.get('m', 'error'))
+                return
+            with self.lock:
+                stream.last_message = time.time()
+                reconnected = not stream.connected and self.connected(stream)
+            if reconnected:
+                self.reconnected(stream)
+            callback(msg)
+        return on_message
+
+    def connected(self, stream):
+        ''' Mark a stream connected; return True if it was down before. Call with the lock held '''
+        stream.connected = True
+        stream.backoff.reset()
+        if stream.down_since is None:
+            return False
+        stream.downtime += time.time() - stream.down_since
+        stream.down_since = None
+        return True
+
+    def reconnected(self, stream):
+        logger.info('stream_reconnected', extra={'fields': {'stream': stream.name,
+                                                            'reconnects': stream.reconnects}})
+        if self.on_reconnect is not None:
+            self.on_reconnect(stream.name)
+
+    def open(self, stream):
+        '''
+        Open a stream, on the scheduler's thread. A stream that fails to
+        open, e.g. because the listen key request failed, is retried
+        after the backoff delay.
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            stream.timer = None
+            stream.started = time.time()
+        try:
+            stream.handle = stream.start(stream.callback)
+        except Exception as e:
+            stream.handle = None
+            self.failed(stream, 'Open failed: {0}: {1}'.format(type(e).__name__, e))
+            return
+        if stream.stale_after is None:
+            with self.lock:
+                reconnected = self.connected(stream)
+            if reconnected:
+                self.reconnected(stream)
+
+    def failed(self, stream, error):
+        '''
+        Close a failed stream and schedule it to reopen after the backoff
+        delay. Failures reported while a reopen is pending are ignored.
+        '''
+        with self.lock:
+            if self.closed or stream.timer is not None:
+                return
+            stream.errors += 1
+            stream.last_error = error
+            stream.connected = False
+            if stream.down_since is None:
+                stream.down_since = time.time()
+            delay = stream.backoff.next()
+            stream.reconnects += 1
+            stream.timer = reopen = PendingCall(self.open, (stream,))
+        self.scheduler.call(self.stop, stream)
+        self.scheduler.call_later(delay, reopen.run)
+        logger.warning('stream_error', extra={'fields': {'stream': stream.name,
+                                                         'error': error,
+                                                         'retry_in': round(delay, 2)}})
+
+    def stop(self, stream):
+        ''' Close a stream's connection, on the scheduler's thread '''
+        handle, stream.handle = stream.handle, None
+        if handle is not None:
+            try:
+                stream.stop(handle)
+            except Exception as e:
+                logger.warning('stream_stop_error', extra={'fields': {'stream': stream.name, 'error': str(e)}})
+
+    def check(self, now=None):
+        ''' Fail streams that have been silent for longer than their stale_after '''
+        now = time.time() if now is None else now
+        for stream in list(self.streams.values()):
+            if stream.stale_after is None or stream.timer is not None or stream.started is None:
+                continue
+            idle = now - max(stream.last_message or 0, stream.started)
+            if idle > stream.stale_after:
+                self.failed(stream, 'No message for {0:.0f} s'.format(idle))
+
+    def next_check(self):
+        ''' Time at which the first open stream goes stale if it stays silent, or None '''
+        deadlines = [max(stream.last_message or 0, stream.started) + stream.stale_after
+                     for stream in self.streams.values()
+                     if stream.stale_after is not None and stream.timer is None and stream.started is not None]
+        return min(deadlines) if deadlines else None
+
+    def reopen(self, name):
+        ''' Close and immediately reopen a stream, e.g. to change its subscriptions '''
+        stream = self.streams[name]
+        with self.lock:
+            if stream.timer is not None:
+                stream.timer.cancel()
+                stream.timer = None
+        self.scheduler.call(self.stop, stream)
+        self.scheduler.call(self.open, stream)
+
+    def stats(self, now=None):
+        ''' Connection health of every stream '''
+        now = time.time() if now is None else now
+        stats = dict()
+        for name, stream in self.streams.items():
+            downtime = stream.downtime
+            if stream.down_since is not None:
+                downtime += now - stream.down_since
+            stats[name] = {'connected': stream.connected,
+                           'reconnects': stream.reconnects,
+                           'errors': stream.errors,
+                           'last_error': stream.last_error,
+                           'downtime': downtime,
+                           'idle': now - stream.last_message if stream.last_message else None}
+        return stats
+
+    def close(self):
+        ''' Cancel pending reopens and close every stream '''
+        with self.lock:
+            self.closed = True
+        for stream in self.streams.values():
+            if stream.timer is not None:
+                stream.timer.cancel()
+            self.scheduler.call(self.stop, stream)
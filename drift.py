@@ -0,0 +1,50 @@
+import numpy as np
+
+
+class DriftTrigger(object):
+    '''
+    Decide when a drift rebalance is due from the per-coin absolute
+    deviation between actual and target allocation (in percentage
+    points). A coin triggers once its deviation exceeds band, and is
+    then disarmed until it has fallen back below band - hysteresis, so
+    a coin hovering around the band edge does not trade over and over.
+    Triggers are at least min_interval seconds apart. Coins that could
+    not be traded are not disarmed, so they trigger again after it.
+    '''
+    def __init__(self, n, band, hysteresis, min_interval):
+        self.band = band
+        self.rearm = band - hysteresis
+        self.min_interval = min_interval
+        self.armed = np.ones(n, dtype=bool)
+        self.last_fired = None
+        self.fired = 0
+
+    def reset(self):
+        ''' Arm every coin, e.g. when automation is switched on '''
+        self.armed.fill(True)
+        self.last_fired = None
+
+    def due(self, now):
+        ''' Seconds until the minimum interval allows another trigger '''
+        if self.last_fired is None:
+            return 0
+        return max(self.last_fired + self.min_interval - now, 0)
+
+    def check(self, deviation, now):
+        '''
+        Return the indices of the armed coins outside the band, or an
+        empty array if no rebalance is due. They stay armed until
+        disarm() is called with the ones that were actually traded.
+        '''
+        self.armed |= deviation < self.rearm
+        if self.due(now) > 0:
+            return np.zeros(0, dtype=np.intp)
+        triggered = np.flatnonzero(self.armed & (deviation > self.band))
+        if len(triggered):
+            self.last_fired = now
+            self.fired += 1
+        return triggered
+
+    def disarm(self, coins):
+        ''' Disarm the given coins until they are back inside the band '''
+        self.armed[coins] = False
@@ -0,0 +1,1128 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from binance.client import Client
+from binance.websockets import BinanceSocketManager
+from binance.enums import *
+from binance.exceptions import *
+from twisted.internet import reactor
+
+from portfolio import PortfolioState
+from filters import format_decimal
+from messages import ConflatingMailbox, dispatch
+from marketdata import BinanceTransport, MarketDataStream
+from exchangeinfo import ExchangeInfoCache, symbol_table, symbol_filters, NO_FILTERS
+from timing import PhaseTimer
+from executor import OrderExecutor
+from planner import plan_trades, limit_depth, limit_spread, ready, describe, check_order
+from orderbook import DepthBooks, snapshot_weight
+from ticks import TickRecorder
+from journal import TradeJournal
+from latency import LatencyMonitor, MetricsServer, write_metrics
+from drift import DriftTrigger
+from openorders import OpenOrderBook
+from connection import Backoff, ReactorScheduler, StreamSupervisor
+from warmstart import StateSnapshot
+from indicators import MarketIndicators
+from settings import ConfigError
+
+logger = logging.getLogger('binancebalance')
+
+# request weights of the reconciliation requests
+ACCOUNT_WEIGHT = 10
+BOOK_TICKERS_WEIGHT = 2
+OPEN_ORDERS_WEIGHT = 40
+# reconciliation replies that must all arrive before a warm-started state is trusted
+RECONCILE_EVENTS = ('accountSnapshot', 'tickerSnapshot', 'openOrdersSnapshot')
+# reconciliation reply event -> weight and client method of its request
+RECONCILE_REQUESTS = {'accountSnapshot':    (ACCOUNT_WEIGHT, 'get_account'),
+                      'tickerSnapshot':     (BOOK_TICKERS_WEIGHT, 'get_orderbook_tickers'),
+                      'openOrdersSnapshot': (OPEN_ORDERS_WEIGHT, 'get_open_orders')}
+# seconds between snapshots when nothing changed, so connection and latency stats stay fresh
+HEARTBEAT_INTERVAL = 1.0
+
+def column_headers():
+    ''' define human readable aliases for the headers in trade execution reports. '''
+    return {'e': 'event_type',
+            'E': 'event_time',
+            's': 'symbol',
+            'c': 'client_order_id',
+            'S': 'side',
+            'o': 'type',
+            'O': 'order_creation_time',
+            'f': 'time_in_force',
+            'q': 'order_quantity',
+            'p': 'order_price',
+            'P': 'stop_price',
+            'F': 'iceberg_quantity',
+            'g': 'ignore_1',
+            'C': 'original_client_order_id',
+            'x': 'current_execution_type',
+            'X': 'current_order_status',
+            'r': 'order_reject_reason',
+            'i': 'order_id',
+            'l': 'last_executed_quantity',
+            'z': 'cumulative_filled_quantity',
+            'Z': 'cumulative_quote_asset_transacted_qty',
+            'L': 'last_executed_price',
+            'n': 'commission_amount',
+            'N': 'commission_asset',
+            'T': 'transaction_time',
+            't': 'trade_id',
+            'I': 'ignore_2',
+            'w': 'order_working',
+            'm': 'maker_side',
+            'M': 'ignore_3',
+            'Y': 'last_quote_asset_transacted_qty'}
+
+
+class RebalanceEngine(object):
+    '''
+    GUI-independent rebalancing engine. Owns the portfolio model, the
+    websocket streams, order sizing and order placement, and runs its
+    own event loop on a background thread. Observers registered with
+    subscribe() receive state snapshots from the engine thread. With a
+    MarketDataHub the engine shares the hub's market data stream, tick
+    recorder and exchange info with other engines in the process and
+    only opens its own user data stream.
+    '''
+    def __init__(self, coins, settings, hub=None):
+        # the allocation table, as read by read_portfolio or already as a DataFrame
+        self.coins_base = pd.DataFrame(coins)
+        self.settings = settings
+        self.hub = hub
+        self.trade_coin = settings.trade_currency
+        self.state = None
+        self.indicators = None
+        self.client = None
+        self.executor = None
+        self.bm = None
+        self.wakeup = threading.Event()
+        self.queue = ConflatingMailbox(self.wakeup)
+        self.commands = deque()
+        self.observers = []
+        self.trades_placed = 0
+        self.trades_completed = 0
+        self.headers = column_headers()
+        self.journal = TradeJournal(settings.journal_path,
+                                    self.headers.values(),
+                                    fsync=settings.journal_fsync,
+                                    tail=settings.journal_tail)
+        self.events = dict()
+        self.automate = False
+        self.next_rebalance = None
+        self.drift = None
+        self.books = None
+        self.slices = set()
+        # row indices of the orders sent since check_drift last cleared it
+        self.submitted = set()
+        self.next_slice = None
+        self.supervisor = StreamSupervisor(self.on_reconnect, ReactorScheduler(reactor))
+        self.reconciles = 0
+        # reconciliation event -> time of its next retry, or None while the retry is in flight
+        self.reconcile_retries = dict()
+        self.reconcile_backoff = Backoff(settings.reconnect_base, settings.reconnect_max)
+        self.reconcile_error = None
+        self.running = False
+        self.thread = None
+        self.errors = 0
+        self.dirty = True
+        self.last_publish = 0
+        self.snapshot_interval = 1.0 / settings.max_fps
+        self.exchange_info = ExchangeInfoCache(settings.exchange_info_cache,
+                                               settings.exchange_info_ttl)
+        self.startup_times = None
+        self.state_file = StateSnapshot(settings.state_path, settings.state_max_age)
+        self.provisional = set()
+        self.next_state_save = 0
+        self.latency = LatencyMonitor()
+        self.metrics_server = None
+        self.next_export = 0
+        self.open_orders = OpenOrderBook()
+        # row index -> orders sent to the executor whose result has not arrived yet
+        self.in_flight = Counter()
+        self.next_order_check = 0
+        self.replacements = 0
+        self.replace_cycles = 0
+        self.last_replace_cycles = 0
+        self.initalize_records()
+
+    def login(self, api_key, api_secret):
+        '''
+        Log in to Binance with the provided credentials. Raises
+        BinanceRequestException or BinanceAPIException on failure.
+        '''
+        self.client = Client(api_key, api_secret)
+        self.client.get_system_status()
+        self.executor = OrderExecutor(self.client,
+                                      self.queue.put,
+                                      workers=self.settings.order_workers,
+                                      orders_per_second=self.settings.orders_per_second,
+                                      weight_per_minute=self.settings.weight_per_minute)
+
+    def initalize_records(self):
+        if self.hub is not None:
+            # the hub records every pair once for all portfolios
+            self.records = None
+            return
+        settings = self.settings
+        self.records = TickRecorder(settings.records_directory,
+                                    max_bytes=settings.records_max_bytes,
+                                    batch_size=settings.records_batch_size,
+                                    flush_interval=settings.records_flush_interval,
+                                    fsync=settings.records_fsync)
+
+    def fetch_startup_data(self, timer):
+        '''
+        Fetch the account snapshot, all ticker prices, the open orders and
+        the exchange info with one bulk request each, concurrently if
+        configured.
+        '''
+        requests = (('account', self.client.get_account),
+                    ('tickers', self.client.get_all_tickers),
+                    ('open_orders', self.client.get_open_orders),
+                    ('exchange_info', self.get_exchange_info))
+
+        def timed(name, fn):
+            with timer.phase(name):
+                return fn()
+
+        if self.settings.concurrent_startup:
+            with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+                futures = [pool.submit(timed, name, fn) for name, fn in requests]
+                return [future.result() for future in futures]
+        return [timed(name, fn) for name, fn in requests]
+
+    def get_exchange_info(self):
+        if self.hub is not None:
+            return self.hub.get_exchange_info()
+        return self.exchange_info.get(self.client)
+
+    def refresh_exchange_info(self, stale):
+        ''' Refetch an exchange info payload that lacks a symbol, e.g. a cached one from before a listing '''
+        if self.hub is not None:
+            return self.hub.refresh_exchange_info(stale)
+        return self.exchange_info.refresh(self.client)
+
+    def populate(self, progress=None):
+        '''
+        Get all symbol info from Binance needed to populate user portfolio
+        data and execute trades. progress, if given, is called with the
+        number of startup steps completed and a description of the next one.
+        Raises ConfigError if a coin is not traded against the trade currency.
+        '''
+        timer = PhaseTimer()
+        coins = self.coins_base
+        exchange_coins = []
+        trade_currency = self.trade_coin
+        with timer.phase('warm_start'):
+            warm = self.warm_start()
+        if warm:
+            self.startup_times = timer.as_dict()
+            logger.info('startup', extra={'fields': dict(self.startup_times, warm_start=True,
+                                                         state_age=round(self.state_file.age, 1))})
+            return
+        if progress is not None:
+            progress(0, 'Fetching account information')
+        with timer.phase('fetch'):
+            account, tickers, open_orders, exchange_info = self.fetch_startup_data(timer)
+        balances = {balance['asset']: balance for balance in account['balances']}
+        prices = {ticker['symbol']: float(ticker['price']) for ticker in tickers}
+        symbols = symbol_table(exchange_info)
+        if (self.hub or self).exchange_info.hit and any(coin + trade_currency not in symbols
+                                                         for coin in coins['coin'] if coin != trade_currency):
+            symbols = symbol_table(self.refresh_exchange_info(exchange_info))
+        if progress is not None:
+            progress(len(coins) // 2, 'Building portfolio')
+        with timer.phase('build'):
+            for coin in coins['coin']:
+                pair = coin+trade_currency
+                balance = balances.get(coin, {'free': 0, 'locked': 0})
+                row = {'coin':              coin,
+                       'exchange_balance':  float(balance['free']),
+                       'locked_balance':    float(balance['locked']),
+                       'last_placement':    None,
+                       'last_execution':    None
+                       }
+                if coin != trade_currency:
+                    if pair not in symbols or pair not in prices:
+                        raise ConfigError('Pair {0} is not listed on Binance, check coin {1} in the allocation file'
+                                          .format(pair, coin))
+                    price = prices[pair]
+                    row.update(symbol_filters(symbols[pair], self.settings.min_trade_value))
+                else:
+                    price = 1.0
+                    pair = coin+coin
+                    row.update(NO_FILTERS)
+                row.update({'symbol':   pair,
+                            'askprice': price,
+                            'bidprice': price,
+                            'price':    price})
+                exchange_coins.append(row)
+            exchange_coins = pd.DataFrame(exchange_coins)
+            self.set_state(pd.merge(coins, exchange_coins, on='coin', how='outer'))
+            self.open_orders.load(open_orders)
+            for order in self.open_orders.open():
+                # orders left open by an earlier session block their coin like new ones
+                i = self.state.coin_for_symbol(order['symbol'])
+                if i is not None:
+                    self.state.last_placement[i] = np.fmax(self.state.last_placement[i], order['placed'])
+        if progress is not None:
+            progress(len(coins), 'Testing connection')
+        with timer.phase('dryrun'):
+            self.dryrun()
+        self.startup_times = timer.as_dict()
+        logger.info('startup', extra={'fields': dict(self.startup_times,
+                                                     warm_start=False,
+                                                     exchange_info_cached=(self.hub or self).exchange_info.hit,
+                                                     concurrent=self.settings.concurrent_startup)})
+
+    def warm_start(self):
+        '''
+        Restore the portfolio state and the open orders from the last
+        state snapshot, if there is a valid one for the current coins.
+        The restored state is provisional until start() has reconciled
+        the balances, prices and open orders with the exchange; no
+        orders are placed until then. Return True on success.
+        '''
+        coins = self.coins_base
+        payload = self.state_file.load(list(coins['coin']), self.trade_coin)
+        if payload is None:
+            return False
+        exchange_coins = pd.DataFrame(dict(payload['columns'],
+                                           coin=payload['coins'],
+                                           symbol=payload['symbols']))
+        self.set_state(pd.merge(coins, exchange_coins, on='coin', how='outer'))
+        for order in payload['orders']:
+            self.open_orders.add(order)
+        self.provisional = set(RECONCILE_EVENTS)
+        return True
+
+    def set_state(self, merged):
+        ''' Build the portfolio state from the merged allocation/exchange table, with fresh indicators '''
+        self.state = PortfolioState(merged, self.trade_coin)
+        self.indicators = MarketIndicators(len(self.state), self.settings.indicator_window)
+
+    def save_state(self):
+        ''' Write a state snapshot for the next warm start, unless the state is still provisional '''
+        if self.state is None or self.provisional:
+            return
+        try:
+            self.state_file.store(self.state, self.open_orders.open())
+        except (IOError, OSError) as e:
+            logger.warning('state_save_error', extra={'fields': {'error': str(e)}})
+
+    def subscribe(self, observer):
+        ''' Register a callable to receive state snapshots '''
+        self.observers.append(observer)
+
+    def submit(self, fn, *args):
+        ''' Run fn(*args) on the engine thread '''
+        self.commands.append((fn, args))
+        self.wakeup.set()
+
+    def start(self):
+        '''
+        Start websockets to get price updates for all coins in the portfolio,
+        trade execution reports, and user account balance updates.
+        Start the engine event loop.
+        '''
+        self.start_websockets()
+        if self.provisional:
+            self.reconcile()
+        if self.settings.metrics_port:
+            self.metrics_server = MetricsServer(self.metrics_text, self.settings.metrics_port)
+        self.start_loop()
+        logger.info('engine_started', extra={'fields': {'coins': len(self.state)}})
+
+    def start_loop(self):
+        ''' Start the engine event loop on a background thread '''
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='engine')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def start_websockets(self):
+        '''
+        Start one combined book ticker stream for all coins in the portfolio
+        and a user socket for trade execution reports and account balance
+        updates. Both are supervised and reconnect on their own.
+        '''
+        settings = self.settings
+        self.bm = BinanceSocketManager(self.client)
+        trade_currency = self.trade_coin
+        symbols = list(self.state.symbols)
+        symbols.remove(trade_currency+trade_currency)
+        self.symbols = symbols
+        if settings.depth_books:
+            self.books = DepthBooks(symbols, self.request_depth)
+            self.books.start()
+        self.supervisor.add('user', self.bm.start_user_socket, self.bm.stop_socket, self.queue_msg,
+                            base=settings.reconnect_base, cap=settings.reconnect_max)
+        if self.hub is not None:
+            # the hub's socket manager runs the reactor for every engine
+            self.hub.subscribe(symbols, self.queue_msg)
+            return
+        self.supervisor.add('market', self.start_market_data, lambda stream: stream.stop(), self.queue_msg,
+                            stale_after=settings.stale_after,
+                            base=settings.reconnect_base, cap=settings.reconnect_max)
+        self.bm.start()
+
+    def market_transport(self):
+        ''' Transport of the market data stream; a ReplayTransport can stand in for the exchange '''
+        return BinanceTransport(self.bm)
+
+    def start_market_data(self, callback):
+        stream = MarketDataStream(self.market_transport(), self.symbols, callback,
+                                  depth=self.settings.depth_books)
+        stream.start()
+        return stream
+
+    def on_reconnect(self, stream):
+        ''' Called from a socket thread when a stream is back; reconcile on the engine thread '''
+        self.queue.put({'e': 'reconnected', 'stream': stream})
+
+    def reconcile(self):
+        '''
+        Refetch all balances, book tickers and open orders in the
+        background after a warm start or after a stream reconnected, so
+        updates missed while it was down do not leave gaps in the
+        portfolio state
+        '''
+        if self.executor is None:
+            return
+        self.reconciles += 1
+        for event in RECONCILE_EVENTS:
+            self.request_snapshot(event)
+
+    def request_snapshot(self, event):
+        weight, method = RECONCILE_REQUESTS[event]
+        self.executor.fetch(event, weight, getattr(self.client, method))
+
+    def reconcile_failed(self, event, error):
+        '''
+        A reconciliation request failed or its reply could not be applied.
+        Request it again after a backoff; until a retry succeeds the error
+        is shown in the status, and a warm-started state stays provisional.
+        '''
+        delay = self.reconcile_backoff.next()
+        self.reconcile_retries[event] = time.time() + delay
+        self.reconcile_error = error
+        self.dirty = True
+        logger.warning('reconcile_error', extra={'fields': {'request': event,
+                                                            'error': error,
+                                                            'retry_in': round(delay, 1)}})
+
+    def retry_reconcile(self):
+        ''' Send the reconciliation requests whose retry is due '''
+        now = time.time()
+        for event, due in list(self.reconcile_retries.items()):
+            if due is not None and now >= due:
+                self.reconcile_retries[event] = None
+                self.request_snapshot(event)
+
+    def reconciled(self, event):
+        ''' Record a successful reconciliation reply; the state is trusted once all have arrived '''
+        self.reconcile_retries.pop(event, None)
+        if not self.reconcile_retries and self.reconcile_error is not None:
+            self.reconcile_backoff.reset()
+            self.reconcile_error = None
+            self.dirty = True
+        if not self.provisional:
+            return
+        self.provisional.discard(event)
+        if not self.provisional:
+            logger.info('warm_start_reconciled', extra={'fields': {'state_age': round(self.state_file.age, 1)}})
+            self.dryrun()
+
+    def run(self):
+        '''
+        Engine event loop: sleep until there is work, then do it. An
+        error in a step is logged and the loop carries on, so one bad
+        message or timer cannot stop the engine.
+        '''
+        while self.running:
+            self.wakeup.wait(self.timeout())
+            self.wakeup.clear()
+            try:
+                self.step()
+            except Exception:
+                self.errors += 1
+                logger.exception('engine_error')
+
+    def timeout(self):
+        '''
+        Seconds the event loop may sleep before the next timer is due, or
+        None to sleep until a message or command wakes it
+        '''
+        now = time.time()
+        deadlines = [self.next_rebalance, self.next_slice, self.supervisor.next_check()]
+        deadlines.extend(self.reconcile_retries.values())
+        if self.hub is not None:
+            deadlines.append(self.hub.next_check())
+        if self.automate and self.drift is not None:
+            # due() is 0 until the first drift rebalance, which is checked on every update
+            due = self.drift.due(now)
+            if due > 0:
+                deadlines.append(now + due)
+        if self.observers:
+            interval = self.snapshot_interval if self.dirty else HEARTBEAT_INTERVAL
+            deadlines.append(self.last_publish + interval)
+        if self.settings.metrics_file:
+            deadlines.append(self.next_export)
+        if len(self.open_orders):
+            deadlines.append(self.next_order_check)
+        if self.settings.state_interval and not self.provisional:
+            deadlines.append(self.next_state_save)
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if not deadlines:
+            return None
+        return max(min(deadlines) - now, 0)
+
+    def step(self):
+        ''' Run pending commands and timers, dispatch messages and publish state '''
+        while self.commands:
+            fn, args = self.commands.popleft()
+            fn(*args)
+        if self.next_rebalance is not None and time.time() >= self.next_rebalance:
+            self.rebalance()
+        if self.next_slice is not None and time.time() >= self.next_slice:
+            self.execute_slices()
+        dispatch(self.queue, self.get_msg, self.settings.dispatch_budget)
+        if not self.queue.empty():
+            self.wakeup.set()
+        self.supervisor.check()
+        if self.hub is not None:
+            self.hub.check()
+        if self.reconcile_retries:
+            self.retry_reconcile()
+        if self.automate and self.drift is not None and not self.provisional:
+            self.check_drift()
+        if self.executor is not None and len(self.open_orders) and not self.provisional \
+                and time.time() >= self.next_order_check:
+            self.next_order_check = time.time() + 1.0
+            self.replace_stale_orders()
+        self.publish()
+        if self.settings.metrics_file and time.time() >= self.next_export:
+            self.next_export = time.time() + self.settings.metrics_interval
+            write_metrics(self.settings.metrics_file, self.metrics_text())
+        if self.settings.state_interval and not self.provisional and time.time() >= self.next_state_save:
+            self.next_state_save = time.time() + self.settings.state_interval
+            self.save_state()
+
+    def publish(self, force=False):
+        ''' Send a snapshot to all observers, at most once per snapshot interval '''
+        now = time.time()
+        if not self.observers:
+            self.dirty = False
+            return
+        if not force and now - self.last_publish < self.snapshot_interval:
+            return
+        if not force and not self.dirty and now - self.last_publish < HEARTBEAT_INTERVAL:
+            return
+        self.dirty = False
+        self.last_publish = now
+        snapshot = self.snapshot()
+        for observer in self.observers:
+            observer(snapshot)
+
+    def snapshot(self):
+        ''' Return a copy of the engine state that is safe to read from other threads '''
+        state = self.state
+        actions, statuses = self.update_actions()
+        return {'time':             time.time(),
+                'coins':            list(state.coins),
+                'fixed_balance':    state.fixed_balance.copy(),
+                'exchange_balance': state.exchange_balance.copy(),
+                'locked_balance':   state.locked_balance.copy(),
+                'allocation':       state.allocation.copy(),
+                'actual':           state.actual.copy(),
+                'bidprice':         state.bidprice.copy(),
+                'askprice':         state.askprice.copy(),
+                'ticksize':         state.ticksize.copy(),
+                'stepsize':         state.stepsize.copy(),
+                'actions':          actions,
+                'statuses':         statuses,
+                'events':           dict(self.events),
+                'total':            state.total,
+                'imbalance':        self.imbalance(),
+                'indicators':       self.indicators.as_dict(),
+                'queue':            self.queue.stats(),
+                'latency':          self.latency.summary(),
+                'orders':           self.executor.stats() if self.executor else None,
+                'open_orders':      len(self.open_orders),
+                'connections':      self.connections(),
+                'trades_placed':    self.trades_placed,
+                'trades_completed': self.trades_completed,
+                'journaled':        self.journal.count,
+                'recent_trades':    self.journal.recent(),
+                'automate':         self.automate,
+                'provisional':      bool(self.provisional),
+                'reconcile_error':  self.reconcile_error}
+
+    def metrics_text(self):
+        ''' Engine metrics in the Prometheus text exposition format '''
+        lines = []
+        def gauge(name, value, help, label=None):
+            '''
+            One gauge: a single value, or with label a dictionary of
+            label value -> value, one sample each under one HELP and TYPE
+            '''
+            name = 'binancebalance_' + name
+            lines.extend(['# HELP {0} {1}'.format(name, help),
+                          '# TYPE {0} gauge'.format(name)])
+            if label is None:
+                lines.append('{0} {1}'.format(name, value))
+                return
+            for key, sample in sorted(value.items()):
+                lines.append('{0}{{{1}="{2}"}} {3}'.format(name, label, key, sample))
+        stats = self.queue.stats()
+        gauge('queue_depth', stats['depth'], 'Messages waiting to be handled')
+        gauge('queue_peak_depth', stats['peak_depth'], 'Highest queue depth seen')
+        gauge('messages_received', stats['received'], 'Websocket messages received')
+        gauge('messages_conflated', stats['conflated'], 'Ticker messages replaced by a newer one')
+        gauge('messages_dropped', stats['dropped'], 'Messages of unknown type dropped')
+        if self.executor is not None:
+            orders = self.executor.stats()
+            gauge('orders_sent', orders['sent'], 'Orders sent to the exchange')
+            gauge('orders_failed', orders['failed'], 'Orders rejected or failed')
+        book = self.open_orders
+        gauge('open_orders', len(book), 'Orders resting on the exchange')
+        gauge('orders_filled', book.filled, 'Orders filled completely')
+        gauge('orders_cancelled', book.cancelled, 'Orders cancelled, expired or rejected')
+        gauge('order_replacements', self.replacements, 'Stale LIMIT orders cancelled and re-placed')
+        gauge('replace_cycles_last_rebalance', self.last_replace_cycles,
+              'Cancel/replace cycles between the last two rebalances')
+        if book.fill_times.total:
+            gauge('time_to_fill_p50_seconds', book.fill_times.percentile(50), 'Median time from placement to fill')
+            gauge('time_to_fill_p99_seconds', book.fill_times.percentile(99), '99th percentile time from placement to fill')
+        if self.state is not None:
+            gauge('imbalance_percent', self.imbalance(), 'Portfolio value away from its target allocation')
+        streams = self.connections()
+        gauge('stream_connected', {name: int(stream['connected']) for name, stream in streams.items()},
+              'Whether a websocket stream is connected', 'stream')
+        gauge('stream_reconnects', {name: stream['reconnects'] for name, stream in streams.items()},
+              'Reconnections of a websocket stream', 'stream')
+        gauge('stream_downtime_seconds', {name: round(stream['downtime'], 3) for name, stream in streams.items()},
+              'Time a websocket stream spent disconnected', 'stream')
+        gauge('reconciliations', self.reconciles, 'Balance and price refetches after a reconnection')
+        gauge('engine_errors', self.errors, 'Messages and steps that raised an error')
+        if self.books is not None:
+            gauge('depth_books_synced', self.books.synced(), 'Local order books in sync with the exchange')
+            gauge('depth_resyncs', self.books.resyncs, 'Order book snapshots reloaded after a sequence gap')
+        if self.drift is not None:
+            gauge('drift_rebalances', self.drift.fired, 'Rebalances triggered by allocation drift')
+        return '\n'.join(lines) + '\n' + self.latency.prometheus()
+
+    def connections(self):
+        ''' Health of this engine's streams and, in multi-portfolio mode, of the shared hub stream '''
+        stats = self.supervisor.stats()
+        if self.hub is not None:
+            stats.update(('hub_' + name, stream) for name, stream in self.hub.supervisor.stats().items())
+        return stats
+
+    def imbalance(self):
+        ''' Portfolio imbalance in percent '''
+        return self.state.imbalance()
+
+    def close(self):
+        '''
+        Stop the event loop, flush the trade journal
+        and stop all websockets.
+        '''
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.save_state()
+        if self.executor is not None:
+            self.executor.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.supervisor.close()
+        self.journal.close()
+        if self.records is not None:
+            self.records.close()
+        if self.hub is not None:
+            self.hub.unsubscribe(self.queue_msg)
+        if self.bm is not None:
+            self.bm.close()
+            if self.hub is None:
+                reactor.stop()
+        logger.info('engine_stopped', extra={'fields': {'trades': self.journal.count}})
+
+    def queue_msg(self, msg):
+        '''
+        Stamp a websocket message with its receipt time and add it to
+        the conflating mailbox. Stream errors never get here; the
+        supervisor reconnects the stream instead.
+        '''
+        msg['_recv'] = time.time()
+        self.queue.put(msg)
+
+    def get_msg(self, msg):
+        '''
+        Reroute new websocket messages to the appropriate handler
+        and record how long they took to reach and pass through it
+        '''
+        received = msg.pop('_recv', None)
+        dequeued = time.time()
+        event = msg['e']
+        try:
+            self.handle(event, msg)
+        except Exception as e:
+            # drop the message, not the engine
+            self.errors += 1
+            logger.exception('handler_error', extra={'fields': {'event': event}})
+            if event in RECONCILE_REQUESTS:
+                self.reconcile_failed(event, '{0}: {1}'.format(type(e).__name__, e))
+        self.latency.record(event, msg.get('E'), received, dequeued, time.time())
+
+    def handle(self, event, msg):
+        ''' Pass a message to the handler of its event type '''
+        if event in ('bookTicker', '24hrTicker'):
+            self.update_price(msg)
+        elif event == 'outboundAccountInfo':
+            self.update_balance(msg)
+        elif event == 'executionReport':
+            self.update_trades(msg)
+        elif event == 'orderResult':
+            self.update_order(msg)
+        elif event == 'depthUpdate':
+            if self.books is not None:
+                self.books.on_update(msg)
+        elif event == 'depthSnapshot':
+            self.update_depth(msg)
+        elif event == 'reconnected':
+            self.reconcile()
+        elif event == 'accountSnapshot':
+            self.update_account_snapshot(msg)
+        elif event == 'tickerSnapshot':
+            self.update_ticker_snapshot(msg)
+        elif event == 'openOrdersSnapshot':
+            self.update_open_orders_snapshot(msg)
+
+    def process_queue(self, flush=False):
+        '''
+        Dispatch as many queued messages as fit in the time budget, or
+        drain the mailbox completely with flush.
+        '''
+        budget = self.settings.dispatch_budget
+        dispatch(self.queue, self.get_msg, budget)
+        while flush and not self.queue.empty():
+            dispatch(self.queue, self.get_msg, budget)
+
+    def update_trades(self, msg):
+        '''
+        Journal every execution report, then update the coin it belongs
+        to. Pairs outside the portfolio, e.g. a manual trade or a BNB fee
+        top-up, are only journaled.
+        '''
+        # fields added to the API since column_headers was written keep their own names
+        savemsg = {self.headers.get(key, key): value for key, value in msg.items()}
+        self.journal.append(savemsg)
+        filled = float(savemsg['cumulative_filled_quantity'])
+        orderqty = float(savemsg['order_quantity'])
+        side = savemsg['side']
+        order = self.open_orders.apply(msg)
+        if order is not None and order['status'] in ('CANCELED', 'EXPIRED', 'REJECTED'):
+            self.release(order)
+        i = self.state.coin_for_symbol(msg['s'])
+        if i is not None:
+            if filled >= orderqty:
+                self.state.last_execution[i] = time.mktime(datetime.now().timetuple())
+                self.trades_completed += 1
+            self.events[self.state.coins[i]] = '{0} {1}/{2} {3}'.format(side, filled, orderqty,
+                                                                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self.dirty = True
+        logger.info('execution', extra={'fields': {'symbol': msg['s'],
+                                                   'side': side,
+                                                   'filled': filled,
+                                                   'quantity': orderqty}})
+
+    def update_balance(self, msg):
+        ''' Update user balances whenever an account update message is received '''
+        balances = msg['B']
+        state = self.state
+        for balance in balances:
+            i = state.index.get(balance['a'])
+            if i is not None:
+                exchange_balance = float(balance['f']) + float(balance['l'])
+                locked_balance = float(balance['l'])
+                state.set_balance(i, exchange_balance, locked_balance)
+        state.refresh_actual()
+        self.dirty = True
+
+    def update_account_snapshot(self, msg):
+        ''' Overwrite all balances with a reconciliation account snapshot '''
+        if 'error' in msg:
+            self.reconcile_failed('accountSnapshot', msg['error'])
+            return
+        state = self.state
+        for balance in msg['response']['balances']:
+            i = state.index.get(balance['asset'])
+            if i is not None:
+                locked_balance = float(balance['locked'])
+                state.set_balance(i, float(balance['free']) + locked_balance, locked_balance)
+        state.refresh_actual()
+        self.dirty = True
+        self.reconciled('accountSnapshot')
+
+    def update_ticker_snapshot(self, msg):
+        ''' Overwrite all prices with a reconciliation book ticker snapshot '''
+        if 'error' in msg:
+            self.reconcile_failed('tickerSnapshot', msg['error'])
+            return
+        state = self.state
+        for ticker in msg['response']:
+            i = state.coin_for_symbol(ticker['symbol'])
+            if i is not None:
+                state.set_price(i, float(ticker['bidPrice']), float(ticker['askPrice']))
+        state.refresh_actual()
+        self.dirty = True
+        self.reconciled('tickerSnapshot')
+
+    def update_open_orders_snapshot(self, msg):
+        ''' Replace the open order book with a reconciliation open orders snapshot '''
+        if 'error' in msg:
+            self.reconcile_failed('openOrdersSnapshot', msg['error'])
+            return
+        changed = self.open_orders.sync(msg['response'])
+        if changed:
+            logger.info('open_orders_reconciled', extra={'fields': {'changed': changed,
+                                                                    'open': len(self.open_orders)}})
+        # an order that closed while the user stream was down left no execution
+        # report, so unblock every coin with nothing open or on its way
+        state = self.state
+        now = time.time()
+        for i, symbol in enumerate(state.symbols):
+            if i != state.trade_index and i not in self.in_flight and not self.open_orders.has_open(symbol):
+                state.last_execution[i] = now
+        self.dirty = True
+        self.reconciled('openOrdersSnapshot')
+
+    def update_price(self, msg):
+        ''' Update symbol prices and user allocations whenever a price update is received '''
+        state = self.state
+        i = state.coin_for_symbol(msg['s'])
+        if i is None:
+            return
+        bid = float(msg['b'])
+        ask = float(msg['a'])
+        state.set_price(i, bid, ask)
+        state.refresh_actual()
+        # top of book quantities weight the VWAP; ticks without them count equally
+        size = float(msg.get('B', 0)) + float(msg.get('A', 0))
+        self.indicators.update(i, bid, ask, size or 1.0)
+        self.dirty = True
+        self.print_price(msg)
+
+    def print_price(self, msg):
+        bid = float(msg['b'])
+        ask = float(msg['a'])
+        avg_price = float(msg['w']) if 'w' in msg else (bid + ask)/2.0
+        if self.records is not None:
+            self.records.record(msg['s'], msg['E'], avg_price, bid, ask)
+
+    def release(self, order):
+        '''
+        Release the balance locked by a closed order right away, so the
+        next pass can use it before the account update arrives, and
+        unblock its coin unless a replacement is on its way
+        '''
+        state = self.state
+        i = state.coin_for_symbol(order['symbol'])
+        if i is None:
+            return
+        remaining = order['quantity'] - order['filled']
+        if order['side'] == SIDE_SELL:
+            j, locked = i, remaining
+        else:
+            j, locked = state.trade_index, remaining * order['price']
+        state.set_balance(j, state.exchange_balance[j], max(state.locked_balance[j] - locked, 0.0))
+        if not order.get('replacing'):
+            state.last_execution[i] = time.time()
+        self.dirty = True
+
+    def replace_stale_orders(self):
+        '''
+        Cancel resting LIMIT orders that timed out or that the market
+        moved away from, and re-place what is left of them at the
+        current bid (sells) or ask (buys). Remainders too small to trade
+        are only cancelled.
+        '''
+        state = self.state
+        settings = self.settings
+
+        def quote(order):
+            i = state.coin_for_symbol(order['symbol'])
+            if i is None:
+                return None
+            price = state.askprice[i] if order['side'] == SIDE_BUY else state.bidprice[i]
+            return price, state.ticksize[i]
+
+        stale = self.open_orders.stale(time.time(), quote, settings.limit_timeout, settings.reprice_ticks)
+        orders = []
+        for order in stale:
+            i = state.coin_for_symbol(order['symbol'])
+            rules = state.rules[i]
+            price = rules.price.decimal(quote(order)[0])
+            remaining = rules.quantity.decimal(order['quantity'] - order['filled'])
+            if self.check_order(i, remaining, price, market=False) is not None:
+                quantity = None
+            else:
+                quantity = format_decimal(remaining)
+            order['replacing'] = True
+            self.in_flight[i] += 1
+            orders.append({'coin': state.coins[i],
+                           'symbol': order['symbol'],
+                           'side': order['side'],
+                           'type': 'LIMIT',
+                           'quantity': quantity,
+                           'price': format_decimal(price),
+                           'dryrun': False,
+                           'previous_placement': state.last_placement[i],
+                           'replace': order['order_id']})
+            logger.info('order_replace', extra={'fields': {'symbol': order['symbol'],
+                                                           'order_id': order['order_id'],
+                                                           'age': round(time.time() - order['placed'], 1),
+                                                           'price': order['price'],
+                                                           'new_price': float(price)}})
+        if orders:
+            self.replacements += len(orders)
+            self.replace_cycles += len(orders)
+            self.executor.submit(orders)
+
+    def check_order(self, i, quantity, price, market=None):
+        ''' planner.check_order for row i, by default for the configured order type '''
+        if market is None:
+            market = self.settings.trade_type == 'MARKET'
+        return check_order(self.state, i, quantity, price, market)
+
+    def request_depth(self, symbol):
+        ''' Fetch a depth snapshot for a local order book on the executor pool '''
+        limit = self.settings.depth_levels
+        self.executor.fetch('depthSnapshot', snapshot_weight(limit),
+                            self.client.get_order_book, symbol=symbol, limit=limit)
+
+    def update_depth(self, msg):
+        ''' Load a depth snapshot into its order book '''
+        if 'error' in msg:
+            logger.warning('depth_error', extra={'fields': {'symbol': msg['symbol'], 'error': msg['error']}})
+            self.books.on_snapshot(msg['symbol'])
+        else:
+            self.books.on_snapshot(msg['symbol'], msg['response'])
+        self.dirty = True
+
+    def plan(self):
+        '''
+        Plan the trades of the current state. Trades in coins with an
+        abnormally wide spread are held back, and MARKET trades are cut to
+        the slippage budget when local order books are available. Return
+        the plan and a mask of the trades that were cut.
+        '''
+        plan = plan_trades(self.state)
+        if self.settings.spread_limit:
+            plan = limit_spread(plan, self.indicators, self.settings.spread_limit)
+        if self.books is not None and self.settings.trade_type == 'MARKET':
+            return limit_depth(plan, self.state, self.books, self.settings.max_slippage)
+        return plan, np.zeros(len(self.state), dtype=bool)
+
+    def update_actions(self):
+        '''
+        Calcuate required trades and return the action and status
+        strings for every coin
+        '''
+        return describe(self.plan()[0], self.state, self.indicators)
+
+    def update_order(self, msg):
+        ''' Record the outcome of an order sent by the executor '''
+        coin = msg['coin']
+        if not msg['dryrun']:
+            i = self.state.index[coin]
+            self.in_flight[i] -= 1
+            if self.in_flight[i] <= 0:
+                del self.in_flight[i]
+        fields = {'symbol': msg['symbol'],
+                  'side': msg['side'],
+                  'quantity': msg['quantity'],
+                  'price': msg['price'],
+                  'latency_ms': round(1000 * msg['latency'], 3)}
+        if 'replace' in msg:
+            fields['replace'] = msg['replace']
+            order = self.open_orders.orders.get(msg['replace'])
+            if order is not None and 'cancelled' not in msg:
+                # the cancel failed, e.g. because the order filled meanwhile
+                order['replacing'] = False
+            if msg['quantity'] is None or ('error' in msg and 'cancelled' in msg):
+                # nothing was re-placed, so the coin is free for the next pass
+                self.state.last_execution[self.state.index[coin]] = time.time()
+        if 'error' in msg:
+            if not msg['dryrun'] and 'replace' not in msg:
+                self.state.last_placement[self.state.index[coin]] = msg['previous_placement']
+            self.events[coin] = msg['error']
+            fields['error'] = msg['error']
+            logger.warning('order_error', extra={'fields': fields})
+        elif msg['quantity'] is None:
+            self.events[coin] = 'Order Cancelled'
+            logger.info('order_cancelled', extra={'fields': fields})
+        elif not msg['dryrun']:
+            self.trades_placed += 1
+            self.events[coin] = 'Order Replaced' if 'replace' in msg else 'Trade Placed'
+            logger.info('order_placed', extra={'fields': fields})
+        self.dirty = True
+
+    def execute_transactions(self, side, dryrun, coins=None):
+        '''
+        Calculate the required trade for each coin and send the orders
+        that belong to the appropriate side to the executor as one batch.
+        coins optionally restricts the batch to the given row indices.
+        Return the futures of the submitted orders.
+        '''
+        self.process_queue(flush=True)
+        if self.provisional:
+            logger.info('provisional_state', extra={'fields': {'side': side, 'pending': sorted(self.provisional)}})
+            return []
+        state = self.state
+        plan, cut = self.plan()
+        placement = time.mktime(datetime.now().timetuple())
+        orders = []
+        index = ready(plan, side)
+        if coins is not None:
+            index = np.intersect1d(index, coins)
+        for i in index:
+            last_placement = state.last_placement[i]
+            if not (np.isnan(last_placement) or state.last_execution[i] >= last_placement):
+                continue
+            coin = state.coins[i]
+            rules = state.rules[i]
+            quantity = rules.quantity.decimal(plan.quantity[i])
+            price = rules.price.decimal(plan.price[i])
+            error = self.check_order(i, quantity, price)
+            if error is not None:
+                # the exchange would reject it, so do not send it
+                self.events[coin] = error
+                self.dirty = True
+                continue
+            orders.append({'coin': coin,
+                           'symbol': coin + self.trade_coin,
+                           'side': side,
+                           'type': self.settings.trade_type,
+                           'quantity': format_decimal(quantity),
+                           'price': format_decimal(price),
+                           'dryrun': dryrun,
+                           'previous_placement': last_placement})
+            if not dryrun:
+                # block further orders for this coin while this one is in flight
+                state.last_placement[i] = placement
+                self.in_flight[i] += 1
+                self.submitted.add(i)
+                if cut[i] and self.automate:
+                    self.slices.add(i)
+        if self.slices and self.next_slice is None:
+            self.next_slice = time.time() + self.settings.slice_interval
+        return self.executor.submit(orders)
+
+    def set_automation(self, automate):
+        '''
+        Start or stop automatic rebalancing, either every rebalance
+        period or whenever a coin drifts out of its band
+        '''
+        self.automate = automate
+        self.next_rebalance = None
+        self.slices.clear()
+        self.next_slice = None
+        if automate and self.settings.rebalance_trigger == 'drift':
+            if self.drift is None:
+                self.drift = DriftTrigger(len(self.state),
+                                          self.settings.drift_band,
+                                          self.settings.drift_hysteresis,
+                                          self.settings.min_rebalance_interval)
+            self.drift.reset()
+        elif automate:
+            self.rebalance()
+        self.dirty = True
+
+    def check_drift(self):
+        '''
+        Rebalance the coins that drifted out of their band. The trade
+        coin cannot be traded directly, so when it is out of band every
+        coin is rebalanced. Only the coins that placed an order are
+        disarmed.
+        '''
+        state = self.state
+        coins = self.drift.check(state.deviation, time.time())
+        if len(coins) == 0:
+            return
+        logger.info('drift', extra={'fields': {'coins': [state.coins[i] for i in coins],
+                                               'deviation': [round(state.deviation[i], 3) for i in coins]}})
+        self.submitted.clear()
+        self.rebalance(None if state.trade_index in coins else coins)
+        # coins held back or too small to trade stay armed and trigger again
+        traded = [i for i in coins if i in self.submitted or (i == state.trade_index and self.submitted)]
+        self.drift.disarm(np.array(traded, dtype=np.intp))
+
+    def rebalance(self, coins=None):
+        '''
+        Execute sells, wait for the sell batch to be acknowledged so that
+        its balance updates are applied, then execute buys and, on the
+        timer trigger, schedule the next rebalance
+        '''
+        logger.info('rebalance', extra={'fields': {'imbalance': self.imbalance(),
+                                                   'replace_cycles': self.replace_cycles}})
+        self.last_replace_cycles = self.replace_cycles
+        self.replace_cycles = 0
+        wait(self.execute_sells(coins))
+        self.execute_buys(coins)
+        if self.settings.rebalance_trigger == 'timer':
+            self.next_rebalance = time.time() + self.settings.rebalance_period
+
+    def execute_slices(self):
+        '''
+        Trade the next slice of the orders that were cut to the slippage
+        budget, once the book has had time to refill
+        '''
+        coins = sorted(self.slices)
+        self.slices.clear()
+        self.next_slice = None
+        logger.info('slice', extra={'fields': {'coins': [self.state.coins[i] for i in coins]}})
+        wait(self.execute_sells(coins))
+        self.execute_buys(coins)
+
+    def execute_sells(self, coins=None):
+        '''
+        Perform any sells required by overachieving coins
+        '''
+        return self.execute_transactions(side=SIDE_SELL, dryrun=False, coins=coins)
+
+    def execute_buys(self, coins=None):
+        '''
+        Perform any buys required by underachieving coins
+        '''
+        return self.execute_transactions(side=SIDE_BUY, dryrun=False, coins=coins)
+
+    def dryrun(self):
+        '''
+        Check every trade the current plan requires against the exchange
+        filters locally, without sending test orders, and show why the
+        ones that would fail are rejected. Return the reasons by coin.
+        '''
+        state = self.state
+        plan = self.plan()[0]
+        failures = dict()
+        for side in (SIDE_SELL, SIDE_BUY):
+            for i in ready(plan, side):
+                rules = state.rules[i]
+                error = self.check_order(i, rules.quantity.decimal(plan.quantity[i]),
+                                         rules.price.decimal(plan.price[i]))
+                if error is not None:
+                    failures[state.coins[i]] = error
+        self.events.update(failures)
+        self.dirty = True
+        return failures
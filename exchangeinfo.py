@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import time
+
+CACHE_VERSION = 1
+
+
+def checksum(payload):
+    ''' SHA-256 of the canonical JSON encoding of payload '''
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class ExchangeInfoCache(object):
+    '''
+    On-disk cache for the Binance exchange info payload. Entries older
+    than ttl seconds, from a different cache version, or whose checksum
+    does not match their payload are ignored and refetched.
+    '''
+    def __init__(self, path='exchange_info.json', ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.hit = False
+
+    def load(self):
+        ''' Return the cached payload, or None if there is no valid entry '''
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('version') != CACHE_VERSION:
+            return None
+        if time.time() - entry.get('saved', 0) > self.ttl:
+            return None
+        payload = entry.get('payload')
+        if payload is None or checksum(payload) != entry.get('checksum'):
+            return None
+        return payload
+
+    def store(self, payload):
+        ''' Atomically replace the cache file with payload '''
+        entry = {'version': CACHE_VERSION,
+                 'saved': time.time(),
+                 'checksum': checksum(payload),
+                 'payload': payload}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, self.path)
+
+    def get(self, client):
+        ''' Return the exchange info, from the cache if possible '''
+        payload = self.load()
+        self.hit = payload is not None
+        if payload is None:
+            payload = self.refresh(client)
+        return payload
+
+    def refresh(self, client):
+        ''' Fetch the exchange info, bypassing the cache, and cache it '''
+        payload = client.get_exchange_info()
+        self.hit = False
+        self.store(payload)
+        return payload
+
+
+def symbol_table(exchange_info):
+    ''' Map each symbol in an exchange info payload to its symbol info '''
+    return {info['symbol']: info for info in exchange_info['symbols']}
+
+
+# filters of the trade currency itself, which is never traded
+NO_FILTERS = {'minprice':       0.0,
+              'maxprice':       0.0,
+              'ticksize':       0.0,
+              'minqty':         0.0,
+              'maxqty':         0.0,
+              'stepsize':       0.0,
+              'minnotional':    0.0,
+              'multiplierup':   0.0,
+              'multiplierdown': 0.0}
+
+
+def filter_table(symbolinfo):
+    ''' Filters of a symbol keyed by filterType, whatever order the exchange lists them in '''
+    return {f['filterType']: f for f in symbolinfo['filters']}
+
+
+def symbol_filters(symbolinfo, min_trade_value=None):
+    '''
+    Price and quantity filters of a symbol as portfolio table columns.
+    Missing filters are disabled (zero limits, unlimited maximum
+    quantity). min_trade_value, if given, replaces the exchange minimum
+    notional.
+    '''
+    filters = filter_table(symbolinfo)
+    price = filters.get('PRICE_FILTER', {})
+    lot = filters.get('LOT_SIZE', {})
+    notional = filters.get('MIN_NOTIONAL') or filters.get('NOTIONAL') or {}
+    percent = filters.get('PERCENT_PRICE', {})
+    minvalue = float(notional.get('minNotional', 0))
+    if min_trade_value is not None:
+        minvalue = min_trade_value
+    return {'minprice':       float(price.get('minPrice', 0)),
+            'maxprice':       float(price.get('maxPrice', 0)),
+            'ticksize':       float(price.get('tickSize', 0)),
+            'minqty':         float(lot.get('minQty', 0)),
+            'maxqty':         float(lot.get('maxQty', 'inf')),
+            'stepsize':       float(lot.get('stepSize', 0)),
+            'minnotional':    minvalue,
+            'multiplierup':   float(percent.get('multiplierUp', 0)),
+            'multiplierdown': float(percent.get('multiplierDown', 0))}
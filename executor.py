@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from binance.enums import *
+from binance.exceptions import *
+
+ORDER_EXCEPTIONS = (BinanceRequestException,
+                    BinanceAPIException,
+                    BinanceOrderException,
+                    BinanceOrderMinAmountException,
+                    BinanceOrderMinPriceException,
+                    BinanceOrderMinTotalException,
+                    BinanceOrderUnknownSymbolException,
+                    BinanceOrderInactiveSymbolException)
+
+# request weight of the order endpoints
+ORDER_WEIGHT = 1
+
+
+class TokenBucket(object):
+    '''
+    Thread-safe token bucket refilled continuously at rate tokens per
+    second up to capacity. acquire() blocks until enough tokens are
+    available.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        ''' Take tokens from the bucket, waiting if necessary. Return the time waited '''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class OrderExecutor(object):
+    '''
+    Send orders concurrently from a worker pool while honouring the
+    exchange orders-per-second and request-weight limits. Each order is
+    a dictionary with coin, symbol, side, type, quantity, price and
+    dryrun keys; the outcome of every order, with its latency, is passed
+    to on_result from the worker thread, also when the request failed
+    on the network. An order with a replace key first cancels the open
+    order with that id, and is only cancelled if its quantity is None.
+    '''
+    def __init__(self, client, on_result, workers=8,
+                 orders_per_second=10, weight_per_minute=1200):
+        self.client = client
+        self.on_result = on_result
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.order_bucket = TokenBucket(orders_per_second)
+        self.weight_bucket = TokenBucket(weight_per_minute / 60.0, weight_per_minute)
+        self.latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        # the counters are updated from every worker thread
+        self.lock = threading.Lock()
+
+    def submit(self, orders):
+        ''' Send a batch of orders and return one future per order '''
+        return [self.pool.submit(self.send, order) for order in orders]
+
+    def send(self, order):
+        ''' Place a single order, blocking until the rate limits allow it '''
+        if not order['dryrun']:
+            self.order_bucket.acquire()
+        self.weight_bucket.acquire(ORDER_WEIGHT)
+        if order['dryrun']:
+            create = self.client.create_test_order
+        else:
+            create = self.client.create_order
+        params = {'symbol': order['symbol'],
+                  'side': order['side'],
+                  'quantity': order['quantity']}
+        if order['type'] == 'LIMIT':
+            params.update(type=ORDER_TYPE_LIMIT,
+                          timeInForce=TIME_IN_FORCE_GTC,
+                          price=order['price'])
+        else:
+            params.update(type=ORDER_TYPE_MARKET)
+        result = dict(order, e='orderResult')
+        start = time.perf_counter()
+        try:
+            if 'replace' in order:
+                self.weight_bucket.acquire(ORDER_WEIGHT)
+                self.client.cancel_order(symbol=order['symbol'], orderId=order['replace'])
+                result['cancelled'] = True
+            if order['quantity'] is not None:
+                result['response'] = create(**params)
+        except ORDER_EXCEPTIONS as e:
+            result['error'] = e.message
+        except Exception as e:
+            # network errors (requests ConnectionError, Timeout) and anything
+            # else still post a result, or the coin would stay blocked
+            result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        result['latency'] = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(result['latency'])
+            self.sent += 1
+            if 'error' in result:
+                self.failed += 1
+        self.on_result(result)
+        return result
+
+    def fetch(self, event, weight, fn, **params):
+        '''
+        Run a REST request within the request-weight limit on the worker
+        pool and pass its response, or error, to on_result as an event
+        message carrying the request params
+        '''
+        def request():
+            self.weight_bucket.acquire(weight)
+            result = dict(params, e=event)
+            try:
+                result['response'] = fn(**params)
+            except ORDER_EXCEPTIONS as e:
+                result['error'] = e.message
+            except Exception as e:
+                result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+            self.on_result(result)
+        return self.pool.submit(request)
+
+    def stats(self):
+        ''' Order counts and latency percentiles in milliseconds '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            sent = self.sent
+            failed = self.failed
+        if len(latencies) == 0:
+            p50 = p99 = 0.0
+        else:
+            p50, p99 = 1000 * np.percentile(latencies, [50, 99])
+        return {'sent': sent,
+                'failed': failed,
+                'p50': p50,
+                'p99': p99}
+
+    def close(self):
+        self.pool.shutdown(wait=True)
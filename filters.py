@@ -0,0 +1,101 @@
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_EVEN
+
+# precision used where a symbol has no step or tick size
+EIGHT_PLACES = Decimal('1e-8')
+
+
+def to_decimal(value):
+    ''' Exact decimal of the shortest representation of a float '''
+    return Decimal(repr(float(value)))
+
+
+class Quantizer(object):
+    '''
+    Round values down to a multiple of a tick or step size with exact
+    decimal arithmetic. The step is converted once; power-of-ten steps,
+    which almost all Binance filters use, are rounded with a single
+    quantize. Calling the quantizer returns the string sent to the
+    exchange, without trailing zeros.
+    '''
+    def __init__(self, step):
+        if step > 0:
+            self.step = to_decimal(step).normalize()
+            self.power_of_ten = self.step == Decimal(1).scaleb(self.step.adjusted())
+        else:
+            self.step = None
+            self.power_of_ten = False
+
+    def decimal(self, value):
+        value = to_decimal(value)
+        if self.step is None:
+            return value.quantize(EIGHT_PLACES, rounding=ROUND_HALF_EVEN)
+        if self.power_of_ten:
+            return value.quantize(self.step, rounding=ROUND_DOWN)
+        return (value / self.step).to_integral_value(rounding=ROUND_DOWN) * self.step
+
+    def __call__(self, value):
+        return format_decimal(self.decimal(value))
+
+
+def format_decimal(value):
+    ''' Plain notation without trailing zeros, as round_decimal formats floats '''
+    text = '{0:f}'.format(value)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+
+class SymbolRules(object):
+    '''
+    Compiled exchange filters of one symbol: quantizers for its tick and
+    step size and the PRICE_FILTER, LOT_SIZE, MIN_NOTIONAL and
+    PERCENT_PRICE limits as decimals, so orders can be validated locally
+    instead of with a test order. Zero limits are disabled, as on the
+    exchange.
+    '''
+    def __init__(self, minprice, maxprice, ticksize, minqty, maxqty, stepsize,
+                 minnotional, multiplierup, multiplierdown):
+        self.price = Quantizer(ticksize)
+        self.quantity = Quantizer(stepsize)
+        self.minprice = to_decimal(minprice)
+        self.maxprice = to_decimal(maxprice)
+        self.ticksize = to_decimal(ticksize)
+        self.minqty = to_decimal(minqty)
+        self.maxqty = to_decimal(maxqty) if maxqty < float('inf') else Decimal(0)
+        self.stepsize = to_decimal(stepsize)
+        self.minnotional = to_decimal(minnotional)
+        self.multiplierup = to_decimal(multiplierup)
+        self.multiplierdown = to_decimal(multiplierdown)
+
+    def check(self, quantity, price, reference=None, market=False):
+        '''
+        Validate an order of quantity at price (decimals, as they will
+        be sent). reference is the average price PERCENT_PRICE is
+        measured against; MARKET orders are only checked against
+        LOT_SIZE and MIN_NOTIONAL at price. Return None if the order
+        passes, or the exchange's rejection message otherwise.
+        '''
+        if quantity < self.minqty or (self.maxqty and quantity > self.maxqty):
+            return 'Filter failure: LOT_SIZE'
+        if self.stepsize and (quantity - self.minqty) % self.stepsize:
+            return 'Filter failure: LOT_SIZE'
+        if not market:
+            if price < self.minprice or (self.maxprice and price > self.maxprice):
+                return 'Filter failure: PRICE_FILTER'
+            if self.ticksize and (price - self.minprice) % self.ticksize:
+                return 'Filter failure: PRICE_FILTER'
+            if reference is not None and self.multiplierup:
+                reference = to_decimal(reference)
+                if price > reference * self.multiplierup or price < reference * self.multiplierdown:
+                    return 'Filter failure: PERCENT_PRICE'
+        if quantity * price < self.minnotional:
+            return 'Filter failure: MIN_NOTIONAL'
+        return None
+
+
+def compile_rules(state):
+    ''' SymbolRules for every coin of a PortfolioState, in row order '''
+    return [SymbolRules(state.minprice[i], state.maxprice[i], state.ticksize[i],
+                        state.minqty[i], state.maxqty[i], state.stepsize[i],
+                        state.minnotional[i], state.multiplierup[i], state.multiplierdown[i])
+            for i in range(len(state))]
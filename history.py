@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from ticks import RECORD, segment_paths
+
+TICK_DTYPE = np.dtype([('time', '<i8'),
+                       ('vwap', '<f8'),
+                       ('bid', '<f8'),
+                       ('ask', '<f8'),
+                       ('mid', '<f8')])
+assert TICK_DTYPE.itemsize == RECORD.size
+
+OHLC_DTYPE = np.dtype([('time', '<i8'),
+                       ('open', '<f8'),
+                       ('high', '<f8'),
+                       ('low', '<f8'),
+                       ('close', '<f8'),
+                       ('count', '<i8')])
+
+
+class TickHistory(object):
+    '''
+    Read-only, memory-mapped view over the recorded tick segments of
+    one pair. Segments are mapped lazily by the operating system, so
+    opening a history is cheap regardless of its size, and time range
+    queries are answered by binary search on the event time column.
+    '''
+    def __init__(self, pair, directory='records'):
+        self.pair = pair
+        self.segments = []
+        for path in segment_paths(directory, pair):
+            records = os.path.getsize(path) // TICK_DTYPE.itemsize
+            if records == 0:
+                continue
+            self.segments.append(np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(records,)))
+        self.segments.sort(key=lambda segment: segment['time'][0])
+        self.first_times = np.array([segment['time'][0] for segment in self.segments], dtype=np.int64)
+        self.last_times = np.array([segment['time'][-1] for segment in self.segments], dtype=np.int64)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def range(self, start=None, end=None):
+        '''
+        Ticks with start <= time < end (times in ms, None for unbounded).
+        The result is a zero-copy view of the mapped file when the range
+        falls within one segment, and a copy when it spans several.
+        '''
+        parts = []
+        for segment, first, last in zip(self.segments, self.first_times, self.last_times):
+            if start is not None and last < start:
+                continue
+            if end is not None and first >= end:
+                continue
+            times = segment['time']
+            lo = 0 if start is None else np.searchsorted(times, start, side='left')
+            hi = len(segment) if end is None else np.searchsorted(times, end, side='left')
+            if hi > lo:
+                parts.append(segment[lo:hi])
+        if not parts:
+            return np.zeros(0, dtype=TICK_DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def asof(self, times, field='mid'):
+        '''
+        Value of field at the last tick at or before each of the sorted
+        times, or NaN before the first tick
+        '''
+        times = np.asarray(times, dtype=np.int64)
+        values = np.full(len(times), np.nan)
+        which = np.searchsorted(self.first_times, times, side='right') - 1
+        for s, segment in enumerate(self.segments):
+            mask = which == s
+            if not mask.any():
+                continue
+            index = np.searchsorted(segment['time'], times[mask], side='right') - 1
+            values[mask] = segment[field][index]
+        return values
+
+    def ohlc(self, interval, start=None, end=None, field='mid'):
+        '''
+        Downsample field to open/high/low/close bars of interval ms.
+        Bars are aligned to multiples of interval and only bars that
+        contain at least one tick are returned.
+        '''
+        ticks = self.range(start, end)
+        if len(ticks) == 0:
+            return np.zeros(0, dtype=OHLC_DTYPE)
+        values = np.ascontiguousarray(ticks[field])
+        bins = ticks['time'] // interval
+        first = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        last = np.r_[first[1:] - 1, len(values) - 1]
+        bars = np.zeros(len(first), dtype=OHLC_DTYPE)
+        bars['time'] = bins[first] * interval
+        bars['open'] = values[first]
+        bars['high'] = np.maximum.reduceat(values, first)
+        bars['low'] = np.minimum.reduceat(values, first)
+        bars['close'] = values[last]
+        bars['count'] = last - first + 1
+        return bars
+
+
+def allocation_pairs(portfolio='allocation.csv', trade_currency='BTC'):
+    ''' Trading pairs of the coins in an allocation file '''
+    coins = pd.read_csv(portfolio)
+    return [coin + trade_currency for coin in coins['coin']]
+
+
+def aligned(pairs, times, directory='records', field='mid', trade_currency='BTC'):
+    '''
+    As-of join of several pairs on a common time axis. Return a
+    DataFrame indexed by times with one column per pair holding the
+    last value of field at or before each time. The trade currency
+    pair (e.g. BTCBTC) is not recorded and is filled with 1.0.
+    '''
+    times = np.asarray(times, dtype=np.int64)
+    columns = dict()
+    for pair in pairs:
+        if pair == trade_currency + trade_currency:
+            columns[pair] = np.ones(len(times))
+        else:
+            columns[pair] = TickHistory(pair, directory).asof(times, field)
+    return pd.DataFrame(columns, index=pd.Index(times, name='time'), columns=list(pairs))
+
+
+def aligned_portfolio(start, end, interval, portfolio='allocation.csv',
+                      directory='records', field='mid', trade_currency='BTC'):
+    ''' As-of aligned view of every coin in an allocation file on a regular grid '''
+    times = np.arange(start, end, interval, dtype=np.int64)
+    return aligned(allocation_pairs(portfolio, trade_currency), times, directory, field, trade_currency)
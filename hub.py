@@ -0,0 +1,136 @@
+import logging
+import threading
+
+from binance.client import Client
+from binance.websockets import BinanceSocketManager
+from twisted.internet import reactor
+
+from exchangeinfo import ExchangeInfoCache
+from marketdata import BinanceTransport, MarketDataStream
+from connection import ReactorScheduler, StreamSupervisor
+from ticks import TickRecorder
+
+logger = logging.getLogger('binancebalance')
+
+
+class MarketDataHub(object):
+    '''
+    Market data shared by several RebalanceEngines in one process: a
+    single combined book ticker stream over the union of their symbols,
+    one tick recorder, and one in-memory copy of the exchange info.
+    Each update is fanned out to the engines that hold its symbol, so
+    sockets and memory grow with the number of unique symbols rather
+    than with portfolios x symbols. Market streams and exchange info
+    are public, so the hub uses its own unauthenticated client; the
+    engines keep their own credentials and user data streams.
+    '''
+    def __init__(self, settings):
+        self.settings = settings
+        self.depth = settings.depth_books
+        self.client = Client(None, None)
+        self.bm = BinanceSocketManager(self.client)
+        self.exchange_info = ExchangeInfoCache(settings.exchange_info_cache,
+                                               settings.exchange_info_ttl)
+        self.records = TickRecorder(settings.records_directory,
+                                    max_bytes=settings.records_max_bytes,
+                                    batch_size=settings.records_batch_size,
+                                    flush_interval=settings.records_flush_interval,
+                                    fsync=settings.records_fsync)
+        self.payload = None
+        self.subscribers = dict()
+        self.supervisor = StreamSupervisor(self.on_reconnect, ReactorScheduler(reactor))
+        self.lock = threading.Lock()
+
+    def get_exchange_info(self):
+        ''' Return the exchange info, fetching or loading it only once per process '''
+        with self.lock:
+            if self.payload is None:
+                self.payload = self.exchange_info.get(self.client)
+            return self.payload
+
+    def refresh_exchange_info(self, stale):
+        ''' Refetch the exchange info, unless another engine already replaced the stale payload '''
+        with self.lock:
+            if self.payload is stale:
+                self.payload = self.exchange_info.refresh(self.client)
+            return self.payload
+
+    def start(self):
+        ''' Start the websocket reactor shared by the hub and the engines' user streams '''
+        self.bm.start()
+
+    def subscribe(self, symbols, callback):
+        '''
+        Deliver updates for symbols to callback. The combined stream is
+        reopened only when a symbol no engine held before is added.
+        '''
+        with self.lock:
+            subscribers = dict(self.subscribers)
+            for symbol in symbols:
+                subscribers[symbol] = subscribers.get(symbol, frozenset()) | {callback}
+            restart = set(subscribers) != set(self.subscribers)
+            # replaced rather than mutated so on_message can read it without the lock
+            self.subscribers = subscribers
+            if restart:
+                self.restart()
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            subscribers = dict()
+            for symbol, callbacks in self.subscribers.items():
+                callbacks = callbacks - {callback}
+                if callbacks:
+                    subscribers[symbol] = callbacks
+            self.subscribers = subscribers
+
+    def restart(self):
+        ''' Reopen the shared stream over the current symbols '''
+        settings = self.settings
+        if 'market' in self.supervisor.streams:
+            self.supervisor.reopen('market')
+        else:
+            self.supervisor.add('market', self.start_stream, lambda stream: stream.stop(), self.on_message,
+                                stale_after=settings.stale_after,
+                                base=settings.reconnect_base, cap=settings.reconnect_max)
+        logger.info('hub_subscribed', extra={'fields': {'symbols': len(self.subscribers)}})
+
+    def start_stream(self, callback):
+        stream = MarketDataStream(BinanceTransport(self.bm), sorted(self.subscribers),
+                                  callback, depth=self.depth)
+        stream.start()
+        return stream
+
+    def check(self):
+        '''
+        Enforce stale_after on the shared stream. Every engine calls this
+        from its loop, at the hub's next_check deadline; a stream failed
+        by one engine is skipped by the others while its reopen is pending.
+        '''
+        self.supervisor.check()
+
+    def next_check(self):
+        return self.supervisor.next_check()
+
+    def on_reconnect(self, stream):
+        ''' Let every engine reconcile the prices it may have missed '''
+        callbacks = set()
+        for symbol_callbacks in self.subscribers.values():
+            callbacks |= symbol_callbacks
+        for callback in callbacks:
+            callback({'e': 'reconnected', 'stream': 'hub'})
+
+    def on_message(self, msg):
+        ''' Record a book ticker update once and pass a copy to every engine holding the symbol '''
+        if msg['e'] == 'bookTicker':
+            bid = float(msg['b'])
+            ask = float(msg['a'])
+            self.records.record(msg['s'], msg['E'], (bid + ask) / 2.0, bid, ask)
+        for callback in self.subscribers.get(msg['s'], ()):
+            callback(dict(msg))
+
+    def close(self):
+        ''' Stop the shared stream and the reactor and flush the tick recorder '''
+        self.supervisor.close()
+        self.records.close()
+        self.bm.close()
+        reactor.stop()
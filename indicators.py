@@ -0,0 +1,151 @@
+import math
+from collections import deque
+
+import numpy as np
+
+
+class PairIndicators(object):
+    '''
+    Streaming indicators of one pair over its last window ticks, kept in
+    fixed-size ring buffers. Every indicator is maintained from running
+    sums that are adjusted for the tick entering and the tick leaving
+    the window, so an update is O(1) whatever the window size:
+
+    - volatility: standard deviation of the tick-to-tick log returns of
+      the mid price, in percent
+    - detrended: distance of the latest mid price from the least squares
+      line through the window, in percent of that line
+    - spread: the latest bid/ask spread and its exponentially weighted
+      moving average, in percent of the mid price
+    - vwap_drift: distance of the latest mid price from the window's
+      volume weighted average price, in percent. Ticker streams carry no
+      trade volume, so each tick is weighted by the quantity quoted at
+      the top of the book.
+
+    The sums are recomputed from the buffers every resum_interval ticks
+    so that the floating point error of the updates cannot accumulate.
+    '''
+    resum_interval = 4096
+
+    def __init__(self, window=100, alpha=None):
+        self.window = window
+        self.alpha = 2.0 / (window + 1) if alpha is None else alpha
+        self.mids = deque(maxlen=window)
+        self.returns = deque(maxlen=window)
+        self.weights = deque(maxlen=window)
+        self.sum_mid = 0.0
+        self.sum_index_mid = 0.0
+        self.sum_return = 0.0
+        self.sum_return2 = 0.0
+        self.sum_weight = 0.0
+        self.sum_weight_mid = 0.0
+        self.spread = math.nan
+        self.ewma_spread = math.nan
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.mids)
+
+    def update(self, bid, ask, size=1.0):
+        ''' Add a tick with its best bid and ask and the quantity quoted at them '''
+        if bid <= 0 or ask <= 0:
+            return
+        mid = (bid + ask) / 2.0
+        mids = self.mids
+        if mids:
+            r = math.log(mid / mids[-1])
+            if len(self.returns) == self.window:
+                old = self.returns[0]
+                self.sum_return -= old
+                self.sum_return2 -= old * old
+            self.returns.append(r)
+            self.sum_return += r
+            self.sum_return2 += r * r
+        n = len(mids)
+        if n == self.window:
+            old_mid = mids[0]
+            old_weight = self.weights[0]
+            # every remaining tick moves one place down the line
+            self.sum_mid -= old_mid
+            self.sum_index_mid -= self.sum_mid
+            self.sum_weight -= old_weight
+            self.sum_weight_mid -= old_weight * old_mid
+            n -= 1
+        mids.append(mid)
+        self.weights.append(size)
+        self.sum_mid += mid
+        self.sum_index_mid += n * mid
+        self.sum_weight += size
+        self.sum_weight_mid += size * mid
+        self.spread = (ask - bid) / mid * 100.0
+        if math.isnan(self.ewma_spread):
+            self.ewma_spread = self.spread
+        else:
+            self.ewma_spread += self.alpha * (self.spread - self.ewma_spread)
+        self.updates += 1
+        if self.updates >= self.resum_interval:
+            self.resum()
+
+    def resum(self):
+        ''' Recompute the running sums from the ring buffers '''
+        self.sum_mid = math.fsum(self.mids)
+        self.sum_index_mid = math.fsum(i * mid for i, mid in enumerate(self.mids))
+        self.sum_return = math.fsum(self.returns)
+        self.sum_return2 = math.fsum(r * r for r in self.returns)
+        self.sum_weight = math.fsum(self.weights)
+        self.sum_weight_mid = math.fsum(w * mid for w, mid in zip(self.weights, self.mids))
+        self.updates = 0
+
+    def volatility(self):
+        k = len(self.returns)
+        if k < 2:
+            return math.nan
+        variance = (self.sum_return2 - self.sum_return * self.sum_return / k) / (k - 1)
+        return math.sqrt(max(variance, 0.0)) * 100.0
+
+    def detrended(self):
+        n = len(self.mids)
+        if n < 3:
+            return math.nan
+        sum_index = n * (n - 1) / 2.0
+        sum_index2 = (n - 1) * n * (2 * n - 1) / 6.0
+        slope = (n * self.sum_index_mid - sum_index * self.sum_mid) / (n * sum_index2 - sum_index * sum_index)
+        fitted = (self.sum_mid - slope * sum_index) / n + slope * (n - 1)
+        return (self.mids[-1] / fitted - 1) * 100.0
+
+    def vwap_drift(self):
+        if not self.mids or self.sum_weight <= 0:
+            return math.nan
+        return (self.mids[-1] * self.sum_weight / self.sum_weight_mid - 1) * 100.0
+
+
+class MarketIndicators(object):
+    '''
+    PairIndicators for every coin in a PortfolioState, by row index, with
+    the current values mirrored in NumPy arrays that the planner and the
+    display read directly. Rows with fewer than warmup ticks, and the
+    trade coin which never ticks, read NaN.
+    '''
+    columns = ('volatility', 'detrended', 'spread', 'ewma_spread', 'vwap_drift')
+
+    def __init__(self, n, window=100, warmup=None):
+        self.pairs = [PairIndicators(window) for i in range(n)]
+        self.warmup = window if warmup is None else warmup
+        for column in self.columns:
+            setattr(self, column, np.full(n, np.nan))
+
+    def update(self, i, bid, ask, size=1.0):
+        ''' Add a tick for row i and refresh its indicator values '''
+        pair = self.pairs[i]
+        pair.update(bid, ask, size)
+        if len(pair) < self.warmup:
+            return
+        self.volatility[i] = pair.volatility()
+        self.detrended[i] = pair.detrended()
+        self.spread[i] = pair.spread
+        self.ewma_spread[i] = pair.ewma_spread
+        self.vwap_drift[i] = pair.vwap_drift()
+
+    def as_dict(self):
+        ''' Copies of the indicator arrays, safe to read from other threads '''
+        return {column: getattr(self, column).copy() for column in self.columns}
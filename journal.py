@@ -0,0 +1,115 @@
+import csv
+import io
+import os
+import threading
+from collections import deque
+
+
+def recover(path):
+    '''
+    Truncate a partially written trailing line left by a crash.
+    Return the number of bytes removed.
+    '''
+    if not os.path.isfile(path):
+        return 0
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return 0
+        # search backwards for the end of the last complete line
+        end = size
+        chunk = 4096
+        while end > 0:
+            start = max(0, end - chunk)
+            f.seek(start)
+            data = f.read(end - start)
+            newline = data.rfind(b'\n')
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            end = start
+        else:
+            keep = 0
+        f.truncate(keep)
+        return size - keep
+
+
+class TradeJournal(object):
+    '''
+    Append-only CSV journal of execution reports. append() hands a
+    record to a background thread that writes everything pending as one
+    group commit, so each report reaches the file shortly after it
+    arrives instead of at exit. The most recent records are also kept
+    in a bounded in-memory tail for display.
+    '''
+    def __init__(self, path, columns, fsync=True, tail=100):
+        self.path = path
+        self.fsync = fsync
+        self.tail = deque(maxlen=tail)
+        self.recovered = recover(path)
+        self.columns = self.read_header() or list(columns)
+        self.file = open(path, 'a', newline='')
+        if self.file.tell() == 0:
+            self.write([dict(zip(self.columns, self.columns))])
+        self.pending = []
+        self.count = 0
+        self.commits = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='trade-journal')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def read_header(self):
+        ''' Column order of an existing journal, so appended rows line up with it '''
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        with open(self.path, newline='') as f:
+            return next(csv.reader(f), None)
+
+    def append(self, record):
+        ''' Queue an execution report for writing '''
+        with self.condition:
+            self.pending.append(record)
+            self.tail.append(record)
+            self.count += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                batch = self.pending
+                self.pending = []
+                closed = self.closed
+            if batch:
+                self.write(batch)
+                self.commits += 1
+            if closed:
+                return
+
+    def write(self, records):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=self.columns, extrasaction='ignore', lineterminator='\n')
+        writer.writerows(records)
+        self.file.write(buf.getvalue())
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def recent(self):
+        ''' The most recent records, oldest first '''
+        with self.condition:
+            return list(self.tail)
+
+    def close(self):
+        ''' Write any pending records and close the file '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.file.close()
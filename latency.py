@@ -0,0 +1,143 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class LatencyHistogram(object):
+    '''
+    Fixed-memory latency histogram in the style of HdrHistogram.
+    Values (in microseconds) below 2**sub_bits are counted exactly and
+    larger ones in log-linear buckets with a relative error of at most
+    2**(1 - sub_bits), up to max_value. Recording is O(1).
+    '''
+    def __init__(self, sub_bits=7, max_value=60 * 1000 * 1000):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half = self.sub_count >> 1
+        self.max_value = max_value
+        self.counts = [0] * (self.index(max_value) + 1)
+        self.total = 0
+        self.sum = 0
+
+    def index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+    def value(self, index):
+        ''' Midpoint of the values counted in a bucket '''
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        low = ((index - self.sub_count) % self.half + self.half) << shift
+        return low + (1 << shift) // 2
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        self.counts[self.index(value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def percentile(self, p):
+        ''' Latency in seconds below which p percent of the recorded values lie '''
+        if self.total == 0:
+            return 0.0
+        rank = max(1, int(round(p / 100.0 * self.total)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.value(index) / 1e6
+        return self.max_value / 1e6
+
+
+class LatencyMonitor(object):
+    '''
+    Per-event-type latency histograms for each stage of message handling:
+    queue (receipt to dequeue), handle (dequeue to state applied) and
+    total (exchange event time to state applied). The total includes
+    any clock offset between the exchange and this machine.
+    '''
+    stages = ('queue', 'handle', 'total')
+
+    def __init__(self):
+        self.histograms = dict()
+
+    def histogram(self, event, stage):
+        key = (event, stage)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        return histogram
+
+    def record(self, event, event_time, received, dequeued, applied):
+        '''
+        Record one handled message. Times are epoch seconds, except
+        event_time which is the exchange event time in ms (or None).
+        '''
+        if received is not None:
+            self.histogram(event, 'queue').record(dequeued - received)
+        self.histogram(event, 'handle').record(applied - dequeued)
+        if event_time is not None:
+            self.histogram(event, 'total').record(applied - event_time / 1000.0)
+
+    def summary(self, stage='total'):
+        ''' p50/p99 in milliseconds of one stage for every event type '''
+        return {event: {'p50': 1000 * histogram.percentile(50),
+                        'p99': 1000 * histogram.percentile(99),
+                        'count': histogram.total}
+                for (event, s), histogram in self.histograms.items() if s == stage}
+
+    def prometheus(self, prefix='binancebalance'):
+        ''' Prometheus text exposition of all histograms as summaries '''
+        name = prefix + '_message_latency_seconds'
+        lines = ['# HELP {0} Websocket message latency by event type and stage'.format(name),
+                 '# TYPE {0} summary'.format(name)]
+        for (event, stage), histogram in sorted(self.histograms.items()):
+            labels = 'event="{0}",stage="{1}"'.format(event, stage)
+            for quantile in (0.5, 0.9, 0.99, 0.999):
+                lines.append('{0}{{{1},quantile="{2}"}} {3:.6f}'.format(
+                    name, labels, quantile, histogram.percentile(100 * quantile)))
+            lines.append('{0}_sum{{{1}}} {2:.6f}'.format(name, labels, histogram.sum / 1e6))
+            lines.append('{0}_count{{{1}}} {2}'.format(name, labels, histogram.total))
+        return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path, text):
+    ''' Atomically replace a metrics file, e.g. for the node exporter textfile collector '''
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class MetricsServer(object):
+    '''
+    Serve the text returned by render() at http://host:port/metrics
+    from a background thread
+    '''
+    def __init__(self, render, port, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+
+
+class BinanceTransport(object):
+    '''
+    Transport that opens one combined stream through a python-binance
+    BinanceSocketManager. The manager must be started by the caller.
+    '''
+    def __init__(self, bm):
+        self.bm = bm
+        self.conn_key = None
+
+    def start(self, streams, callback):
+        self.conn_key = self.bm.start_multiplex_socket(streams, callback)
+        return self.conn_key
+
+    def close(self):
+        if self.conn_key is not None:
+            self.bm.stop_socket(self.conn_key)
+            self.conn_key = None
+
+
+class ReplayTransport(object):
+    '''
+    Local stand-in for the exchange that replays recorded combined-stream
+    messages (one JSON object per line) from a file on a background
+    thread. With rate=None messages are sent as fast as the callback
+    accepts them, otherwise at roughly rate messages per second. With
+    drop_after the connection fails with an error message after that
+    many messages, to exercise reconnection without a network.
+    '''
+    def __init__(self, path, rate=None, loop=False, drop_after=None):
+        self.path = path
+        self.rate = rate
+        self.loop = loop
+        self.drop_after = drop_after
+        self.sent = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, streams, callback):
+        wanted = set(streams)
+        self.thread = threading.Thread(target=self.run, args=(wanted, callback))
+        self.thread.daemon = True
+        self.thread.start()
+        return self.path
+
+    def run(self, wanted, callback):
+        interval = 1.0 / self.rate if self.rate else 0
+        while not self.stopped.is_set():
+            with open(self.path) as f:
+                for line in f:
+                    if self.stopped.is_set():
+                        return
+                    msg = json.loads(line)
+                    if msg.get('stream') not in wanted:
+                        continue
+                    callback(msg)
+                    self.sent += 1
+                    if self.drop_after and self.sent % self.drop_after == 0:
+                        callback({'e': 'error', 'm': 'Replay connection dropped'})
+                        return
+                    if interval:
+                        time.sleep(interval)
+            if not self.loop:
+                return
+
+    def close(self):
+        self.stopped.set()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+class MarketDataStream(object):
+    '''
+    Subscribe to the book ticker of every pair over a single combined
+    stream and pass each update to callback as a 'bookTicker' message.
+    Book ticker payloads carry no event time or weighted average price,
+    so the local receipt time is used for 'E'. With depth, the diff
+    depth stream of every pair is added to the same connection and its
+    'depthUpdate' events are passed on unchanged.
+    '''
+    stream_suffix = '@bookTicker'
+    depth_suffix = '@depth@100ms'
+
+    def __init__(self, transport, symbols, callback, record=None, depth=False):
+        self.transport = transport
+        self.symbols = list(symbols)
+        self.callback = callback
+        self.streams = [symbol.lower() + self.stream_suffix for symbol in self.symbols]
+        if depth:
+            self.streams += [symbol.lower() + self.depth_suffix for symbol in self.symbols]
+        self.record = open(record, 'a') if record else None
+        self.received = 0
+
+    def start(self):
+        return self.transport.start(self.streams, self.on_message)
+
+    def stop(self):
+        ''' Close the connection; the stream can be started again '''
+        self.transport.close()
+
+    def close(self):
+        self.transport.close()
+        if self.record is not None:
+            self.record.close()
+            self.record = None
+
+    def on_message(self, msg):
+        ''' Unwrap a combined-stream message and route it by symbol '''
+        if self.record is not None:
+            self.record.write(json.dumps(msg) + '\n')
+        data = msg.get('data', msg)
+        if data.get('e') in ('error', 'depthUpdate'):
+            self.callback(data)
+            return
+        self.received += 1
+        self.callback({'e': 'bookTicker',
+                       'E': int(time.time() * 1000),
+                       's': data['s'],
+                       'b': data['b'],
+                       'a': data['a'],
+                       'B': data.get('B'),
+                       'A': data.get('A')})
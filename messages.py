@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import deque
+
+# market data events where only the most recent message per symbol matters
+CONFLATED_EVENTS = ('bookTicker', '24hrTicker')
+# account, order, depth and connection events that must be delivered, in order, without loss
+ORDERED_EVENTS = ('outboundAccountInfo', 'executionReport', 'orderResult',
+                  'depthUpdate', 'depthSnapshot',
+                  'reconnected', 'accountSnapshot', 'tickerSnapshot', 'openOrdersSnapshot')
+
+
+class ConflatingMailbox(object):
+    '''
+    Thread-safe handoff between the websocket threads and the dispatcher.
+    Ticker messages are conflated so that only the latest message per
+    symbol is waiting at any time, while account and execution messages
+    are kept in arrival order and are never dropped. If a wakeup event
+    is given it is set whenever a message becomes available.
+    '''
+    def __init__(self, wakeup=None):
+        self.wakeup = wakeup
+        self.lock = threading.Lock()
+        self.order = deque()
+        self.latest = dict()
+        self.conflated = 0
+        self.dropped = 0
+        self.received = 0
+        self.peak_depth = 0
+
+    def put(self, msg):
+        ''' Add a websocket message, replacing any pending ticker for the same symbol '''
+        event = msg.get('e')
+        with self.lock:
+            self.received += 1
+            if event in CONFLATED_EVENTS:
+                symbol = msg['s']
+                if symbol in self.latest:
+                    self.conflated += 1
+                else:
+                    self.order.append(symbol)
+                self.latest[symbol] = msg
+            elif event in ORDERED_EVENTS:
+                self.order.append(msg)
+            else:
+                self.dropped += 1
+                return
+            depth = len(self.order)
+            if depth > self.peak_depth:
+                self.peak_depth = depth
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def get(self):
+        ''' Pop the oldest pending message, or return None if there is none '''
+        with self.lock:
+            if not self.order:
+                return None
+            item = self.order.popleft()
+            if isinstance(item, dict):
+                return item
+            return self.latest.pop(item)
+
+    def qsize(self):
+        return len(self.order)
+
+    def empty(self):
+        return not self.order
+
+    def stats(self):
+        ''' Return a dictionary of the mailbox counters '''
+        return {'depth': len(self.order),
+                'peak_depth': self.peak_depth,
+                'received': self.received,
+                'conflated': self.conflated,
+                'dropped': self.dropped}
+
+
+def dispatch(mailbox, handler, budget):
+    '''
+    Pass pending messages to handler until the mailbox is empty or
+    budget seconds have elapsed. Return the number of messages handled.
+    '''
+    deadline = time.perf_counter() + budget
+    handled = 0
+    while True:
+        msg = mailbox.get()
+        if msg is None:
+            break
+        handler(msg)
+        handled += 1
+        if time.perf_counter() >= deadline:
+            break
+    return handled
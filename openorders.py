@@ -0,0 +1,130 @@
+from latency import LatencyHistogram
+
+# order statuses after which an order no longer rests on the book
+CLOSED_STATUSES = ('FILLED', 'CANCELED', 'REJECTED', 'EXPIRED')
+
+
+class OpenOrderBook(object):
+    '''
+    In-memory index of the account's open orders, keyed by order id and
+    by symbol, kept up to date from executionReport messages. Each order
+    is a dictionary with order_id, client_order_id, symbol, side, type,
+    price, quantity, filled and placed (epoch seconds) keys. The time
+    from placement to complete fill is recorded in a histogram.
+    '''
+    def __init__(self):
+        self.orders = dict()
+        self.by_symbol = dict()
+        self.fill_times = LatencyHistogram(max_value=24 * 3600 * 1000 * 1000)
+        self.filled = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, order):
+        self.orders[order['order_id']] = order
+        self.by_symbol.setdefault(order['symbol'], set()).add(order['order_id'])
+
+    def remove(self, order_id):
+        order = self.orders.pop(order_id)
+        ids = self.by_symbol[order['symbol']]
+        ids.discard(order_id)
+        if not ids:
+            del self.by_symbol[order['symbol']]
+        return order
+
+    def load(self, orders):
+        ''' Add the open orders returned by the REST API, e.g. at startup '''
+        for order in orders:
+            self.add({'order_id':           order['orderId'],
+                      'client_order_id':    order['clientOrderId'],
+                      'symbol':             order['symbol'],
+                      'side':               order['side'],
+                      'type':               order['type'],
+                      'price':              float(order['price']),
+                      'quantity':           float(order['origQty']),
+                      'filled':             float(order['executedQty']),
+                      'placed':             order['time'] / 1000.0})
+
+    def sync(self, orders):
+        '''
+        Replace the book with the open orders returned by the REST API,
+        e.g. after a reconnection, keeping the replacement flags of the
+        orders that are still open. Return how many orders were added or
+        dropped.
+        '''
+        known = self.orders
+        self.orders = dict()
+        self.by_symbol = dict()
+        self.load(orders)
+        for order_id, order in self.orders.items():
+            if order_id in known and known[order_id].get('replacing'):
+                order['replacing'] = known[order_id]['replacing']
+        return len(set(known) ^ set(self.orders))
+
+    def apply(self, msg):
+        '''
+        Update the book from an executionReport. Return the order with
+        its new status, or None if the report is for an unknown order
+        that is already closed.
+        '''
+        order_id = msg['i']
+        status = msg['X']
+        order = self.orders.get(order_id)
+        if order is None:
+            if status in CLOSED_STATUSES:
+                return None
+            placed = msg.get('O', msg['T'])
+            order = {'order_id':        order_id,
+                     'client_order_id': msg['c'],
+                     'symbol':          msg['s'],
+                     'side':            msg['S'],
+                     'type':            msg['o'],
+                     'price':           float(msg['p']),
+                     'quantity':        float(msg['q']),
+                     'placed':          placed / 1000.0}
+            self.add(order)
+        order['filled'] = float(msg['z'])
+        order['status'] = status
+        if status in CLOSED_STATUSES:
+            self.remove(order_id)
+            if status == 'FILLED':
+                self.fill_times.record(msg['T'] / 1000.0 - order['placed'])
+                self.filled += 1
+            else:
+                self.cancelled += 1
+        return order
+
+    def has_open(self, symbol):
+        ''' Whether any order of symbol is open '''
+        return symbol in self.by_symbol
+
+    def open(self, symbol=None):
+        ''' Open orders, for one symbol or for all '''
+        if symbol is None:
+            return list(self.orders.values())
+        return [self.orders[order_id] for order_id in self.by_symbol.get(symbol, ())]
+
+    def stale(self, now, quote, timeout, ticks):
+        '''
+        Resting LIMIT orders that are older than timeout seconds, or
+        whose price is ticks or more tick sizes away from the current
+        quote. quote(order) returns the (price, ticksize) the order would
+        be placed at now, or None to leave the order alone. Orders
+        already being replaced are skipped. A zero timeout or ticks
+        disables that rule.
+        '''
+        stale = []
+        for order in self.orders.values():
+            if order['type'] != 'LIMIT' or order.get('replacing'):
+                continue
+            current = quote(order)
+            if current is None:
+                continue
+            price, ticksize = current
+            expired = timeout > 0 and now - order['placed'] >= timeout
+            moved = ticks > 0 and ticksize > 0 and abs(price - order['price']) >= ticks * ticksize
+            if expired or moved:
+                stale.append(order)
+        return stale
@@ -0,0 +1,217 @@
+import time
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+
+
+def snapshot_weight(limit):
+    ''' Request weight of a REST depth snapshot with limit levels '''
+    if limit <= 100:
+        return 1
+    if limit <= 500:
+        return 5
+    if limit <= 1000:
+        return 10
+    return 50
+
+
+class BookSide(object):
+    '''
+    One side of an order book: a price -> quantity map plus the prices
+    in a sorted list, best price first, kept sorted by binary search
+    insertion as levels appear and disappear.
+    '''
+    def __init__(self, descending):
+        self.descending = descending
+        self.levels = dict()
+        self.keys = []
+
+    def clear(self):
+        self.levels.clear()
+        self.keys = []
+
+    def key(self, price):
+        return -price if self.descending else price
+
+    def set(self, price, quantity):
+        ''' Set the quantity at a price level; zero removes the level '''
+        if quantity == 0:
+            if self.levels.pop(price, None) is not None:
+                key = self.key(price)
+                del self.keys[bisect_left(self.keys, key)]
+        else:
+            if price not in self.levels:
+                insort(self.keys, self.key(price))
+            self.levels[price] = quantity
+
+    def best(self):
+        if not self.keys:
+            return None
+        return abs(self.keys[0])
+
+    def arrays(self):
+        ''' Prices and quantities, best first, as NumPy arrays '''
+        prices = np.abs(np.array(self.keys))
+        quantities = np.array([self.levels[price] for price in prices])
+        return prices, quantities
+
+
+class OrderBook(object):
+    '''
+    Local order book of one pair, built from a REST depth snapshot and
+    kept current with diff depth stream events. Events that arrive
+    before the snapshot are buffered, up to max_buffer, and replayed on
+    top of it. A gap in
+    the update ids marks the book out of sync until a new snapshot is
+    loaded.
+    '''
+    def __init__(self, symbol, max_buffer=1000):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.last_update_id = None
+        self.synced = False
+        self.buffer = deque(maxlen=max_buffer)
+
+    def reset(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.last_update_id = None
+        self.synced = False
+        self.buffer.clear()
+
+    def load(self, snapshot):
+        ''' Load a REST depth snapshot and replay the buffered events. Return False on a gap '''
+        self.bids.clear()
+        self.asks.clear()
+        for price, quantity in snapshot['bids']:
+            self.bids.set(float(price), float(quantity))
+        for price, quantity in snapshot['asks']:
+            self.asks.set(float(price), float(quantity))
+        self.last_update_id = snapshot['lastUpdateId']
+        buffered = list(self.buffer)
+        self.buffer.clear()
+        self.synced = True
+        for event in buffered:
+            if not self.apply(event):
+                return False
+        return True
+
+    def apply(self, event):
+        '''
+        Apply a diff depth event. Return False if an update was missed,
+        in which case the book must be reloaded from a new snapshot.
+        '''
+        if not self.synced:
+            self.buffer.append(event)
+            return True
+        first, last = event['U'], event['u']
+        if last <= self.last_update_id:
+            return True
+        if first > self.last_update_id + 1:
+            self.reset()
+            return False
+        for price, quantity in event['b']:
+            self.bids.set(float(price), float(quantity))
+        for price, quantity in event['a']:
+            self.asks.set(float(price), float(quantity))
+        self.last_update_id = last
+        return True
+
+    def side(self, buy):
+        ''' The levels a buy (asks) or a sell (bids) order would fill against '''
+        return self.asks if buy else self.bids
+
+    def estimate(self, buy, quantity):
+        '''
+        Average fill price of a market order for quantity, and its
+        slippage as a fraction of the best price. Quantity beyond the
+        visible depth is assumed to fill at the last visible level.
+        Return (nan, nan) if that side of the book is empty.
+        '''
+        prices, quantities = self.side(buy).arrays()
+        if len(prices) == 0 or quantity <= 0:
+            return np.nan, np.nan
+        filled = np.minimum(quantities, np.maximum(quantity - (np.cumsum(quantities) - quantities), 0))
+        filled[-1] += max(quantity - np.sum(quantities), 0)
+        average = np.dot(filled, prices) / quantity
+        return average, abs(average / prices[0] - 1)
+
+    def within(self, buy, budget):
+        '''
+        Largest quantity a market order can have while its average fill
+        price stays within budget (a fraction) of the best price
+        '''
+        prices, quantities = self.side(buy).arrays()
+        if len(prices) == 0:
+            return 0.0
+        limit = prices[0] * (1 + budget if buy else 1 - budget)
+        cumulative = np.cumsum(quantities)
+        notional = np.cumsum(quantities * prices)
+        average = notional / cumulative
+        over = average > limit if buy else average < limit
+        k = np.argmax(over) if over.any() else len(prices)
+        if k == len(prices):
+            return float(cumulative[-1])
+        # take the part of level k that brings the average exactly to the limit
+        before_quantity = cumulative[k - 1] if k else 0.0
+        before_notional = notional[k - 1] if k else 0.0
+        partial = (limit * before_quantity - before_notional) / (prices[k] - limit)
+        return float(before_quantity + max(partial, 0.0))
+
+
+class DepthBooks(object):
+    '''
+    Local order books for a set of pairs. request_snapshot(symbol) is
+    called whenever a book needs a REST snapshot, at start and after a
+    sequence gap, and the snapshot or the error is passed back through
+    on_snapshot. A failed request is retried after retry_delay seconds,
+    at the next update of the pair.
+    '''
+    def __init__(self, symbols, request_snapshot, retry_delay=5.0):
+        self.books = {symbol: OrderBook(symbol) for symbol in symbols}
+        self.request_snapshot = request_snapshot
+        self.retry_delay = retry_delay
+        self.pending = set()
+        self.retry_at = dict()
+        self.resyncs = 0
+
+    def start(self):
+        for book in self.books.values():
+            self.request(book)
+
+    def get(self, symbol):
+        ''' The book of a pair if it is in sync, otherwise None '''
+        book = self.books.get(symbol)
+        if book is None or not book.synced:
+            return None
+        return book
+
+    def request(self, book):
+        self.pending.add(book.symbol)
+        self.request_snapshot(book.symbol)
+
+    def on_update(self, event):
+        book = self.books.get(event['s'])
+        if book is None:
+            return
+        if not book.apply(event):
+            self.resyncs += 1
+            self.request(book)
+        elif not book.synced and book.symbol not in self.pending \
+                and time.time() >= self.retry_at.get(book.symbol, 0):
+            self.request(book)
+
+    def on_snapshot(self, symbol, snapshot=None):
+        ''' Load a requested snapshot, or schedule a retry if the request failed (snapshot None) '''
+        self.pending.discard(symbol)
+        book = self.books[symbol]
+        if snapshot is None:
+            self.retry_at[symbol] = time.time() + self.retry_delay
+        elif not book.load(snapshot):
+            self.resyncs += 1
+            self.request(book)
+
+    def synced(self):
+        return sum(book.synced for book in self.books.values())
@@ -0,0 +1,164 @@
+from collections import namedtuple
+
+import numpy as np
+
+SIDE_BUY = 'BUY'
+SIDE_SELL = 'SELL'
+
+# plan status codes, in order of precedence
+TRADE_READY = 0
+TRADE_COIN = 1
+TOO_SMALL = 2
+TOO_LARGE = 3
+INSUFFICIENT_SALE = 4
+INSUFFICIENT_PURCHASE = 5
+BOOK_TOO_THIN = 6
+SPREAD_TOO_WIDE = 7
+
+Plan = namedtuple('Plan', ['buy',
+                           'quantity',
+                           'rounded',
+                           'price',
+                           'notional',
+                           'status',
+                           'slippage'])
+Plan.__doc__ = '''
+Rebalance plan for every coin in a PortfolioState, as parallel arrays:
+buy is True where the coin must be bought and False where it must be
+sold, quantity is the exact required quantity, rounded is that quantity
+rounded down to the step size, price is the bid (sells) or ask (buys),
+notional is quantity * price, status is one of the status codes and
+slippage is the estimated slippage of a market order for the quantity
+as a fraction of the best price, or NaN without an order book.
+'''
+
+
+def floor_step(quantity, stepsize):
+    ''' Round quantities down to a multiple of their step size, element-wise '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stepped = np.floor(quantity / stepsize) * stepsize
+    return np.where(stepsize > 0, stepped, np.round(quantity, 8))
+
+
+def plan_trades(state):
+    '''
+    Compute the trade required to bring every coin to its target
+    allocation, and whether it can be placed, in one vectorized pass
+    '''
+    value = (state.allocation - state.actual) / 100.0 * state.total
+    buy = value > 0
+    # sized at the live price the order is placed at
+    price = np.where(buy, state.askprice, state.bidprice)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quantity = np.absolute(value) / price
+    notional = quantity * price
+    free = state.exchange_balance - state.locked_balance
+    tradecoin_free = free[state.trade_index]
+
+    status = np.full(len(quantity), TRADE_READY, dtype=np.int8)
+    status[buy & (notional > tradecoin_free)] = INSUFFICIENT_PURCHASE
+    status[~buy & (quantity > free)] = INSUFFICIENT_SALE
+    status[quantity > state.maxqty] = TOO_LARGE
+    status[(quantity < state.minqty) | (notional < state.minnotional)] = TOO_SMALL
+    status[state.trade_index] = TRADE_COIN
+    slippage = np.full(len(quantity), np.nan)
+    return Plan(buy, quantity, floor_step(quantity, state.stepsize), price, notional, status, slippage)
+
+
+def limit_depth(plan, state, books, budget):
+    '''
+    Estimate the slippage of every ready trade from the local order
+    books, and cut trades whose average fill would be more than budget
+    (a fraction) away from the best price down to the quantity that
+    stays within it, leaving the rest for a later slice. Trades cut
+    below the symbol minimums are marked BOOK_TOO_THIN. Return the new
+    plan and a mask of the trades that were cut.
+    '''
+    quantity = plan.quantity.copy()
+    slippage = plan.slippage.copy()
+    status = plan.status.copy()
+    cut = np.zeros(len(quantity), dtype=bool)
+    for i in np.flatnonzero(status == TRADE_READY):
+        book = books.get(state.symbols[i])
+        if book is None:
+            continue
+        buy = bool(plan.buy[i])
+        slippage[i] = book.estimate(buy, quantity[i])[1]
+        if not slippage[i] > budget:
+            continue
+        quantity[i] = book.within(buy, budget)
+        slippage[i] = book.estimate(buy, quantity[i])[1]
+        cut[i] = True
+        if quantity[i] < state.minqty[i] or quantity[i] * plan.price[i] < state.minnotional[i]:
+            status[i] = BOOK_TOO_THIN
+    return plan._replace(quantity=quantity,
+                         rounded=floor_step(quantity, state.stepsize),
+                         notional=quantity * plan.price,
+                         status=status,
+                         slippage=slippage), cut
+
+
+def limit_spread(plan, indicators, limit):
+    '''
+    Hold back ready trades in coins whose current spread is more than
+    limit times its moving average, marking them SPREAD_TOO_WIDE, so
+    they are placed by a later rebalance once the spread has narrowed.
+    Coins without enough ticks for the indicators are left alone.
+    '''
+    with np.errstate(invalid='ignore'):
+        wide = indicators.spread > limit * indicators.ewma_spread
+    status = np.where((plan.status == TRADE_READY) & wide, SPREAD_TOO_WIDE, plan.status).astype(np.int8)
+    return plan._replace(status=status)
+
+
+def ready(plan, side):
+    ''' Indices of the coins whose trade is on the given side and can be placed '''
+    if side == SIDE_BUY:
+        on_side = plan.buy
+    else:
+        on_side = ~plan.buy
+    return np.flatnonzero(on_side & (plan.status == TRADE_READY))
+
+
+def check_order(state, i, quantity, price, market):
+    '''
+    Validate an order of quantity at price (decimals) for row i
+    against the compiled exchange filters of its symbol, with the
+    mid price as the PERCENT_PRICE reference. Return None if it
+    would be accepted, or the reason it would be rejected.
+    '''
+    reference = (state.bidprice[i] + state.askprice[i]) / 2.0
+    return state.rules[i].check(quantity, price, reference, market)
+
+
+def describe(plan, state, indicators=None):
+    '''
+    Return the action and status strings of a plan for display. The
+    indicators are only needed to describe SPREAD_TOO_WIDE trades.
+    '''
+    actions = []
+    statuses = []
+    trade_coin = state.trade_coin
+    for i, coin in enumerate(state.coins):
+        side = SIDE_BUY if plan.buy[i] else SIDE_SELL
+        actions.append('{0} {1}'.format(side, state.rules[i].quantity(plan.quantity[i])))
+        status = plan.status[i]
+        if status == TRADE_COIN:
+            statuses.append('Ready')
+        elif status == TOO_SMALL:
+            statuses.append('Trade value too small ({0:.0f}%)'.format(100.0 * plan.notional[i] / state.minnotional[i]))
+        elif status == TOO_LARGE:
+            statuses.append('Trade quantity too large')
+        elif status == INSUFFICIENT_SALE:
+            statuses.append('Insufficient ' + coin + ' for sale')
+        elif status == INSUFFICIENT_PURCHASE:
+            statuses.append('Insufficient ' + trade_coin + ' for purchase')
+        elif status == BOOK_TOO_THIN:
+            statuses.append('Order book too thin')
+        elif status == SPREAD_TOO_WIDE:
+            statuses.append('Spread too wide ({0:.3f}%)'.format(indicators.spread[i]))
+        elif not np.isnan(plan.slippage[i]):
+            statuses.append('Trade Ready ({0:.2f}% slippage)'.format(100.0 * plan.slippage[i]))
+        else:
+            statuses.append('Trade Ready')
+    return actions, statuses
@@ -0,0 +1,122 @@
+import numpy as np
+
+from filters import compile_rules
+
+
+def round_decimal(num, decimal):
+    '''
+    Round a given floating point down number 'num' to the nearest integer
+    multiple of another floating point number 'decimal' smaller than
+    'num' and return it as a string with up to 8 decimal places,
+    dropping any trailing zeros.
+    '''
+    if decimal > 0:
+        x = int(num/decimal)*decimal
+    else:
+        x = np.round(num, 8)
+    return '{0:.8f}'.format(x).rstrip('0').rstrip('.')
+
+
+class PortfolioState(object):
+    '''
+    Compact store for the live portfolio. Every per-coin quantity is kept
+    in a contiguous NumPy array and rows are found through a coin -> index
+    map, so price and balance updates touch a single element and adjust
+    the portfolio total by delta instead of re-summing it. The exchange
+    filters of every coin are also compiled once into SymbolRules.
+    '''
+    fields = ('fixed_balance',
+              'exchange_balance',
+              'locked_balance',
+              'allocation',
+              'price',
+              'askprice',
+              'bidprice',
+              'minprice',
+              'maxprice',
+              'ticksize',
+              'minqty',
+              'maxqty',
+              'stepsize',
+              'minnotional',
+              'multiplierup',
+              'multiplierdown',
+              'last_placement',
+              'last_execution')
+
+    # re-sum the total from scratch every so often so that the
+    # floating point error of the delta updates cannot accumulate
+    resum_interval = 4096
+
+    def __init__(self, coins, trade_coin):
+        '''
+        Build the store from the merged allocation/exchange DataFrame
+        produced by populate_portfolio.
+        '''
+        self.coins = [str(coin) for coin in coins['coin']]
+        self.symbols = [str(symbol) for symbol in coins['symbol']]
+        self.index = {coin: i for i, coin in enumerate(self.coins)}
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.trade_coin = trade_coin
+        self.trade_index = self.index[trade_coin]
+        for field in self.fields:
+            setattr(self, field, np.array(coins[field].values, dtype=np.float64))
+        self.rules = compile_rules(self)
+        self.value = (self.exchange_balance + self.fixed_balance) * self.price
+        self.actual = np.zeros(len(self.coins))
+        self.deviation = np.zeros(len(self.coins))
+        self.total = 0.0
+        self.updates = 0
+        self.resum()
+
+    def __len__(self):
+        return len(self.coins)
+
+    def resum(self):
+        ''' Recompute the total from the value array and refresh allocations '''
+        self.total = float(np.sum(self.value))
+        self.updates = 0
+        self.refresh_actual()
+
+    def refresh_actual(self):
+        '''
+        Recompute the actual allocation percentages, and their absolute
+        deviation from the target allocation, in one vectorized pass
+        '''
+        if self.total > 0:
+            np.multiply(self.value, 100.0 / self.total, out=self.actual)
+        else:
+            self.actual.fill(0.0)
+        np.subtract(self.actual, self.allocation, out=self.deviation)
+        np.absolute(self.deviation, out=self.deviation)
+
+    def imbalance(self):
+        '''
+        Percentage of the portfolio value that would have to change
+        hands to restore the target allocation
+        '''
+        return 0.5 * float(np.sum(self.deviation))
+
+    def _set_value(self, i, value):
+        self.total += value - self.value[i]
+        self.value[i] = value
+        self.updates += 1
+        if self.updates >= self.resum_interval:
+            self.resum()
+
+    def set_price(self, i, bid, ask):
+        ''' Store a new bid/ask, and their mid as the price, for row i and revalue it at the ask '''
+        self.bidprice[i] = bid
+        self.askprice[i] = ask
+        self.price[i] = (bid + ask) / 2.0
+        self._set_value(i, (self.exchange_balance[i] + self.fixed_balance[i]) * ask)
+
+    def set_balance(self, i, exchange_balance, locked_balance):
+        ''' Store new exchange balances for row i and revalue it at the ask '''
+        self.exchange_balance[i] = exchange_balance
+        self.locked_balance[i] = locked_balance
+        self._set_value(i, (exchange_balance + self.fixed_balance[i]) * self.askprice[i])
+
+    def coin_for_symbol(self, symbol):
+        ''' Return the row index for a trading pair, or None if it is not held '''
+        return self.symbol_index.get(symbol)
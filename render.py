@@ -0,0 +1,45 @@
+class CellRenderer(object):
+    '''
+    Buffer writes to a ttk.Treeview and apply them in batches. Only cells
+    whose formatted text differs from what is already on screen are
+    written, and a cell set several times between flushes is written
+    once, so the number of Tcl round-trips per frame is bounded by the
+    number of cells that actually changed.
+    '''
+    def __init__(self, tree, max_fps=10):
+        self.tree = tree
+        self.interval = max(1, int(1000.0 / max_fps))
+        self.shown = dict()
+        self.pending = dict()
+        self.requested = 0
+        self.writes = 0
+
+    def set(self, iid, column, value):
+        ''' Schedule a cell for writing on the next flush if its text changed '''
+        self.requested += 1
+        key = (iid, column)
+        if self.shown.get(key) == value:
+            self.pending.pop(key, None)
+        else:
+            self.pending[key] = value
+
+    def flush(self):
+        ''' Write all changed cells to the Treeview and return how many were written '''
+        pending = self.pending
+        if not pending:
+            return 0
+        self.pending = dict()
+        for (iid, column), value in pending.items():
+            self.tree.set(iid, column=column, value=value)
+            self.shown[(iid, column)] = value
+        self.writes += len(pending)
+        return len(pending)
+
+    def reset(self):
+        ''' Forget the screen contents, e.g. after the Treeview rows were rebuilt '''
+        self.shown.clear()
+        self.pending.clear()
+
+    def saved(self):
+        ''' Number of requested cell writes that never reached the Treeview '''
+        return self.requested - self.writes - len(self.pending)
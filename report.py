@@ -0,0 +1,277 @@
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from timing import parse_time
+
+INDEX_VERSION = 1
+
+# journal columns read by the report, see engine.column_headers
+JOURNAL_COLUMNS = ('symbol',
+                   'side',
+                   'current_execution_type',
+                   'current_order_status',
+                   'last_executed_quantity',
+                   'last_executed_price',
+                   'last_quote_asset_transacted_qty',
+                   'commission_amount',
+                   'commission_asset',
+                   'transaction_time')
+
+# row kinds in the cache
+KIND_OTHER = 0
+KIND_NEW = 1
+KIND_TRADE = 2
+KIND_CLOSED = 3
+
+CLOSED_STATUSES = ('CANCELED', 'REJECTED', 'EXPIRED')
+
+
+class TradeHistoryCache(object):
+    '''
+    Columnar cache of a trade journal (trade_history.csv) for reporting.
+    The journal is read as a stream of byte blocks of at most chunk_bytes,
+    and each block is stored as one part file of NumPy columns: time (ms),
+    symbol and commission asset codes, row kind, side (+1 buy, -1 sell),
+    executed quantity, price, quote quantity, commission and the P&L the
+    fill realised. index.json records the byte offset read so far, the
+    parts with their time ranges, the code tables and the running
+    average cost of every symbol, so an update only reads the rows
+    appended since the last one. A journal that shrank or whose header
+    changed is read again from the start.
+    '''
+    def __init__(self, journal='trade_history.csv', directory=None, chunk_bytes=8 * 1024 * 1024):
+        self.journal = journal
+        self.directory = directory or journal + '.cache'
+        self.chunk_bytes = chunk_bytes
+        self.index = self.load_index()
+
+    def empty_index(self):
+        return {'version': INDEX_VERSION,
+                'header': None,
+                'offset': 0,
+                'rows': 0,
+                'parts': [],
+                'symbols': [],
+                'assets': [],
+                # symbol -> [position, cost] for average cost P&L
+                'positions': {}}
+
+    def load_index(self):
+        try:
+            with open(os.path.join(self.directory, 'index.json')) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            return self.empty_index()
+        if index.get('version') != INDEX_VERSION:
+            return self.empty_index()
+        return index
+
+    def store_index(self):
+        path = os.path.join(self.directory, 'index.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, path)
+
+    def reset(self):
+        ''' Drop every part, e.g. when the journal was replaced '''
+        for part in self.index['parts']:
+            try:
+                os.remove(os.path.join(self.directory, part['file']))
+            except OSError:
+                pass
+        self.index = self.empty_index()
+
+    def update(self):
+        ''' Add the journal rows appended since the last update; return how many were added '''
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.isfile(self.journal):
+            return 0
+        added = 0
+        with open(self.journal, 'rb') as f:
+            header_line = f.readline()
+            header = header_line.decode('utf-8').strip().split(',')
+            size = f.seek(0, os.SEEK_END)
+            index = self.index
+            if index['header'] != header or size < index['offset']:
+                self.reset()
+                index = self.index
+                index['header'] = header
+                index['offset'] = len(header_line)
+            f.seek(index['offset'])
+            while True:
+                block = f.read(self.chunk_bytes)
+                # only complete lines; a partial line is read by the next update
+                end = block.rfind(b'\n') + 1
+                if end == 0:
+                    if len(block) == self.chunk_bytes:
+                        # a single line longer than a chunk, read it whole
+                        f.seek(index['offset'])
+                        block = f.readline()
+                        end = len(block) if block.endswith(b'\n') else 0
+                    if end == 0:
+                        break
+                f.seek(index['offset'] + end)
+                added += self.add_part(block[:end])
+                index['offset'] += end
+                self.store_index()
+        return added
+
+    def code(self, table, values):
+        ''' Map strings to their position in a code table, growing it as needed '''
+        codes = {value: i for i, value in enumerate(self.index[table])}
+        for value in pd.unique(values):
+            if value not in codes:
+                codes[value] = len(self.index[table])
+                self.index[table].append(value)
+        return np.array([codes[value] for value in values], dtype=np.int32)
+
+    def add_part(self, block):
+        header = self.index['header']
+        usecols = [column for column in JOURNAL_COLUMNS if column in header]
+        rows = pd.read_csv(io.BytesIO(block), header=None, names=header, usecols=usecols,
+                           dtype={'symbol': str, 'side': str, 'commission_asset': str})
+        if len(rows) == 0:
+            return 0
+        for column in JOURNAL_COLUMNS:
+            if column not in rows:
+                rows[column] = np.nan
+        execution = rows['current_execution_type'].astype(str).values
+        status = rows['current_order_status'].astype(str).values
+        kind = np.full(len(rows), KIND_OTHER, dtype=np.int8)
+        kind[execution == 'NEW'] = KIND_NEW
+        kind[np.isin(status, CLOSED_STATUSES)] = KIND_CLOSED
+        kind[execution == 'TRADE'] = KIND_TRADE
+        trade = kind == KIND_TRADE
+        quantity = np.where(trade, rows['last_executed_quantity'].astype(float).fillna(0).values, 0.0)
+        price = rows['last_executed_price'].astype(float).fillna(0).values
+        quote = rows['last_quote_asset_transacted_qty'].astype(float).values
+        quote = np.where(np.isnan(quote), quantity * price, quote)
+        quote = np.where(trade, quote, 0.0)
+        fee = np.where(trade, rows['commission_amount'].astype(float).fillna(0).values, 0.0)
+        side = np.where(rows['side'].values == 'BUY', 1, -1).astype(np.int8)
+        symbol = self.code('symbols', rows['symbol'].fillna('').values)
+        asset = self.code('assets', rows['commission_asset'].fillna('').values)
+        filled = trade & (status == 'FILLED')
+        pnl = self.realise(symbol, side, quantity, quote, trade)
+        times = rows['transaction_time'].fillna(0).astype(np.int64).values
+
+        name = 'part-{0:06d}.npz'.format(len(self.index['parts']))
+        np.savez(os.path.join(self.directory, name),
+                 time=times, symbol=symbol, asset=asset, kind=kind, side=side, filled=filled,
+                 quantity=quantity, price=price, quote=quote, fee=fee, pnl=pnl)
+        self.index['parts'].append({'file': name,
+                                    'rows': len(rows),
+                                    'start': int(times.min()),
+                                    'end': int(times.max())})
+        self.index['rows'] += len(rows)
+        return len(rows)
+
+    def realise(self, symbol, side, quantity, quote, trade):
+        '''
+        P&L in the quote asset realised by each fill at the average cost
+        of the position it sells from. Fills are sequential by nature, so
+        this is the only per-row loop, and it runs once per row.
+        '''
+        pnl = np.zeros(len(symbol))
+        symbols = self.index['symbols']
+        positions = self.index['positions']
+        for i in np.flatnonzero(trade):
+            position = positions.setdefault(symbols[symbol[i]], [0.0, 0.0])
+            if side[i] > 0:
+                position[0] += quantity[i]
+                position[1] += quote[i]
+            elif position[0] > 0:
+                sold = min(quantity[i], position[0])
+                cost = position[1] * sold / position[0]
+                pnl[i] = quote[i] * sold / quantity[i] - cost
+                position[0] -= sold
+                position[1] -= cost
+        return pnl
+
+    def parts(self, start=None, end=None):
+        ''' Load the parts that may hold rows with start <= time < end, one at a time '''
+        for part in self.index['parts']:
+            if start is not None and part['end'] < start:
+                continue
+            if end is not None and part['start'] >= end:
+                continue
+            with np.load(os.path.join(self.directory, part['file'])) as data:
+                columns = {name: data[name] for name in data.files}
+            mask = np.ones(part['rows'], dtype=bool)
+            if start is not None:
+                mask &= columns['time'] >= start
+            if end is not None:
+                mask &= columns['time'] < end
+            yield {name: column[mask] for name, column in columns.items()}
+
+
+def summarize(cache, trade_currency='BTC', period=None, start=None, end=None):
+    '''
+    Per-coin totals of a trade history: quantities bought and sold,
+    turnover in the trade currency, realised P&L, orders placed, filled
+    and cancelled, the fill rate and the commission paid in each asset.
+    With period ('D', 'W' or 'M') the totals are given per period and
+    coin. Each part is aggregated on its own and the partial sums are
+    added up, so memory use is bounded by the size of one part.
+    '''
+    coins = np.array([symbol[:-len(trade_currency)] if symbol.endswith(trade_currency) else symbol
+                      for symbol in cache.index['symbols']], dtype=object)
+    assets = cache.index['assets']
+    totals = []
+    for part in cache.parts(start, end):
+        trade = part['kind'] == KIND_TRADE
+        buy = trade & (part['side'] > 0)
+        sell = trade & (part['side'] < 0)
+        frame = pd.DataFrame({'coin': coins[part['symbol']],
+                              'bought': np.where(buy, part['quantity'], 0.0),
+                              'sold': np.where(sell, part['quantity'], 0.0),
+                              'turnover': part['quote'],
+                              'realised_pnl': part['pnl'],
+                              'orders': (part['kind'] == KIND_NEW).astype(np.int64),
+                              'filled': part['filled'].astype(np.int64),
+                              'cancelled': (part['kind'] == KIND_CLOSED).astype(np.int64)})
+        for code, asset in enumerate(assets):
+            if asset:
+                frame['fee_' + asset] = np.where(trade & (part['asset'] == code), part['fee'], 0.0)
+        keys = ['coin']
+        if period is not None:
+            frame['period'] = pd.to_datetime(part['time'], unit='ms').to_period(period).astype(str)
+            keys = ['period', 'coin']
+        totals.append(frame.groupby(keys).sum())
+    if not totals:
+        return pd.DataFrame()
+    summary = pd.concat(totals).fillna(0).groupby(level=list(range(len(keys)))).sum()
+    # no fill rate where the orders were placed before the range
+    orders = summary['orders'].where(summary['orders'] > 0)
+    summary['fill_rate'] = summary['filled'] / orders
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the trade journal')
+    parser.add_argument('--journal', default='trade_history.csv')
+    parser.add_argument('--cache', default=None, help='cache directory (default JOURNAL.cache)')
+    parser.add_argument('--period', choices=['D', 'W', 'M'], default=None, help='summarize per day, week or month')
+    parser.add_argument('--start', type=parse_time, default=None)
+    parser.add_argument('--end', type=parse_time, default=None)
+    parser.add_argument('--trade-currency', default='BTC')
+    parser.add_argument('--rebuild', action='store_true', help='drop the cache and read the whole journal')
+    args = parser.parse_args()
+
+    cache = TradeHistoryCache(args.journal, args.cache)
+    if args.rebuild:
+        cache.reset()
+    cache.update()
+    summary = summarize(cache, args.trade_currency, args.period, args.start, args.end)
+    # NaN fill rates (no orders in a period) become null
+    summary = summary.reset_index().astype(object).where(summary.reset_index().notna(), None)
+    print(json.dumps(summary.to_dict('records'), indent=2, default=float))
+
+if __name__ == '__main__':
+    main()
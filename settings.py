@@ -0,0 +1,100 @@
+import configparser
+
+
+class ConfigError(Exception):
+    ''' Raised when config.ini contains an unsupported or invalid value '''
+    pass
+
+
+class Settings(object):
+    '''
+    Read and validate config.ini. Values are stored as attributes,
+    with times in seconds.
+    '''
+    def __init__(self, path='config.ini'):
+        s_to_ms = 1000
+        config = configparser.RawConfigParser(allow_no_value=False)
+        config.read(path)
+        self.trade_currency = config.get('trades', 'trade_currency')
+        if self.trade_currency != 'BTC':
+            raise ConfigError('{0} trading pairs are not supported yet, only BTC'.format(self.trade_currency))
+        self.rebalance_period = int(config.get('trades', 'rebalance_period'))
+        if self.rebalance_period <= 0:
+            raise ConfigError('Rebalance period must be a positive integer (seconds)')
+        self.min_trade_value = float(config.get('trades', 'min_trade_value'))
+        if self.min_trade_value <= 0:
+            self.min_trade_value = None
+        self.trade_type = config.get('trades', 'trade_type')
+        if self.trade_type != 'MARKET' and self.trade_type != 'LIMIT':
+            raise ConfigError('{0} is not a supported trade type. Use MARKET or LIMIT'.format(self.trade_type))
+        self.rebalance_trigger = config.get('trades', 'trigger', fallback='timer')
+        if self.rebalance_trigger not in ('timer', 'drift'):
+            raise ConfigError('{0} is not a supported rebalance trigger. Use timer or drift'.format(self.rebalance_trigger))
+        self.drift_band = config.getfloat('trades', 'drift_band', fallback=1.0)
+        self.drift_hysteresis = config.getfloat('trades', 'drift_hysteresis', fallback=0.5)
+        self.min_rebalance_interval = config.getfloat('trades', 'min_rebalance_interval', fallback=60)
+        if self.drift_band <= 0 or not 0 <= self.drift_hysteresis <= self.drift_band:
+            raise ConfigError('Drift band must be positive and hysteresis between 0 and the band (percent)')
+        if self.min_rebalance_interval < 0:
+            raise ConfigError('Minimum rebalance interval must not be negative (seconds)')
+        self.ignore_backlog = int(config.get('websockets', 'ignore_backlog'))
+        self.reconnect_base = config.getfloat('websockets', 'reconnect_base', fallback=1)
+        self.reconnect_max = config.getfloat('websockets', 'reconnect_max', fallback=60)
+        self.stale_after = config.getfloat('websockets', 'stale_after', fallback=30)
+        if self.reconnect_base <= 0 or self.reconnect_max < self.reconnect_base or self.stale_after <= 0:
+            raise ConfigError('Reconnect delays and the stale stream timeout must be positive numbers (seconds)')
+        self.dispatch_budget = config.getfloat('websockets', 'dispatch_budget', fallback=5) / s_to_ms
+        if self.dispatch_budget <= 0:
+            raise ConfigError('Dispatch budget must be a positive number (milliseconds)')
+        self.max_fps = config.getfloat('display', 'max_fps', fallback=10)
+        if self.max_fps <= 0:
+            raise ConfigError('Maximum frame rate must be a positive number (Hz)')
+        self.log_interval = config.getfloat('headless', 'log_interval', fallback=60)
+        if self.log_interval <= 0:
+            raise ConfigError('Log interval must be a positive number (seconds)')
+        self.concurrent_startup = config.getboolean('startup', 'concurrent', fallback=True)
+        self.exchange_info_cache = config.get('startup', 'exchange_info_cache', fallback='exchange_info.json')
+        self.exchange_info_ttl = config.getfloat('startup', 'exchange_info_ttl', fallback=3600)
+        self.window_budget = config.getfloat('startup', 'window_budget', fallback=1.0)
+        self.state_path = config.get('startup', 'state_file', fallback='state.json')
+        self.state_interval = config.getfloat('startup', 'state_interval', fallback=60)
+        self.state_max_age = config.getfloat('startup', 'state_max_age', fallback=86400)
+        if self.state_interval < 0 or self.state_max_age < 0:
+            raise ConfigError('State snapshot interval and maximum age must not be negative (seconds)')
+        self.order_workers = config.getint('orders', 'workers', fallback=8)
+        self.orders_per_second = config.getfloat('orders', 'orders_per_second', fallback=10)
+        self.weight_per_minute = config.getfloat('orders', 'weight_per_minute', fallback=1200)
+        if self.order_workers <= 0 or self.orders_per_second <= 0 or self.weight_per_minute <= 0:
+            raise ConfigError('Order workers and rate limits must be positive numbers')
+        self.limit_timeout = config.getfloat('orders', 'limit_timeout', fallback=300)
+        self.reprice_ticks = config.getint('orders', 'reprice_ticks', fallback=5)
+        if self.limit_timeout < 0 or self.reprice_ticks < 0:
+            raise ConfigError('LIMIT order timeout and reprice ticks must not be negative (0 disables them)')
+        self.records_directory = config.get('records', 'directory', fallback='records')
+        self.records_max_bytes = config.getint('records', 'max_segment_mb', fallback=64) * 1024 * 1024
+        self.records_batch_size = config.getint('records', 'batch_size', fallback=4096)
+        self.records_flush_interval = config.getfloat('records', 'flush_interval', fallback=1.0)
+        self.records_fsync = config.getboolean('records', 'fsync', fallback=False)
+        if self.records_max_bytes <= 0 or self.records_batch_size <= 0 or self.records_flush_interval <= 0:
+            raise ConfigError('Record segment size, batch size and flush interval must be positive numbers')
+        self.journal_path = config.get('journal', 'path', fallback='trade_history.csv')
+        self.journal_fsync = config.getboolean('journal', 'fsync', fallback=True)
+        self.journal_tail = config.getint('journal', 'tail', fallback=100)
+        self.depth_books = config.getboolean('depth', 'enabled', fallback=False)
+        self.depth_levels = config.getint('depth', 'levels', fallback=100)
+        self.max_slippage = config.getfloat('depth', 'max_slippage', fallback=0.5) / 100.0
+        self.slice_interval = config.getfloat('depth', 'slice_interval', fallback=30)
+        if self.depth_levels not in (5, 10, 20, 50, 100, 500, 1000, 5000):
+            raise ConfigError('Depth levels must be one of 5, 10, 20, 50, 100, 500, 1000 or 5000')
+        if self.max_slippage <= 0 or self.slice_interval <= 0:
+            raise ConfigError('Maximum slippage (percent) and slice interval (seconds) must be positive numbers')
+        self.indicator_window = config.getint('indicators', 'window', fallback=100)
+        self.spread_limit = config.getfloat('indicators', 'spread_limit', fallback=3)
+        self.indicator_columns = config.getboolean('indicators', 'columns', fallback=False)
+        if self.indicator_window < 3 or self.spread_limit < 0:
+            raise ConfigError('Indicator window must be at least 3 ticks and the spread limit must not be negative')
+        self.metrics_file = config.get('metrics', 'file', fallback='')
+        self.metrics_interval = config.getfloat('metrics', 'interval', fallback=15)
+        self.metrics_port = config.getint('metrics', 'port', fallback=0)
+        if self.metrics_interval <= 0:
+            raise ConfigError('Metrics interval must be a positive number (seconds)')
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from connection import ReactorScheduler, StreamSupervisor
+
+
+class FakeReactor(object):
+    ''' Queues callFromThread calls until run() is called, like a reactor that is busy elsewhere '''
+    def __init__(self):
+        self.queue = []
+        self.delayed = []
+
+    def callFromThread(self, fn, *args):
+        self.queue.append((fn, args))
+
+    def callLater(self, delay, fn, *args):
+        self.delayed.append((delay, fn, args))
+
+    def run(self):
+        while self.queue:
+            fn, args = self.queue.pop(0)
+            fn(*args)
+
+    def fire(self):
+        delayed, self.delayed = self.delayed, []
+        for delay, fn, args in delayed:
+            fn(*args)
+        self.run()
+
+
+class Transport(object):
+    ''' start/stop pair that records every call and can be made to fail '''
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+        self.opened = threading.Event()
+        self.handles = 0
+
+    def start(self, callback):
+        if self.failures:
+            self.failures -= 1
+            self.calls.append(('start', None))
+            raise IOError('listen key request failed')
+        self.handles += 1
+        self.calls.append(('start', self.handles))
+        self.opened.set()
+        return self.handles
+
+    def stop(self, handle):
+        self.calls.append(('stop', handle))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+class StreamSupervisorTest(unittest.TestCase):
+    def test_failed_stream_is_stopped_then_reopened(self):
+        transport = Transport()
+        supervisor = StreamSupervisor()
+        stream = supervisor.add('user', transport.start, transport.stop, lambda msg: None, base=0.001, cap=0.001)
+        stream.callback({'e': 'error', 'm': 'connection lost'})
+        self.assertTrue(wait_for(lambda: transport.handles == 2))
+        supervisor.close()
+        self.assertEqual(transport.calls[:3], [('start', 1), ('stop', 1), ('start', 2)])
+        self.assertEqual(supervisor.stats()['user']['reconnects'], 1)
+
+    def test_open_failure_is_retried(self):
+        transport = Transport(failures=2)
+        supervisor = StreamSupervisor()
+        supervisor.add('user', transport.start, transport.stop, lambda msg: None, base=0.001, cap=0.001)
+        self.assertTrue(wait_for(lambda: supervisor.stats()['user']['connected']))
+        supervisor.close()
+        self.assertEqual(supervisor.stats()['user']['errors'], 2)
+
+    def test_reactor_scheduler_keeps_sockets_on_the_reactor(self):
+        reactor = FakeReactor()
+        transport = Transport()
+        supervisor = StreamSupervisor(scheduler=ReactorScheduler(reactor))
+        stream = supervisor.add('market', transport.start, transport.stop, lambda msg: None, stale_after=10)
+        self.assertEqual(transport.calls, [])
+        reactor.run()
+        self.assertEqual(transport.calls, [('start', 1)])
+        supervisor.check(now=time.time() + 11)
+        self.assertEqual(transport.calls, [('start', 1)])
+        reactor.run()
+        self.assertEqual(transport.calls, [('start', 1), ('stop', 1)])
+        reactor.fire()
+        self.assertEqual(transport.calls[-1], ('start', 2))
+        self.assertIsNone(stream.timer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from drift import DriftTrigger
+
+
+class DriftTriggerTest(unittest.TestCase):
+    def setUp(self):
+        self.trigger = DriftTrigger(3, band=5.0, hysteresis=2.0, min_interval=10)
+
+    def check(self, deviation, now):
+        return list(self.trigger.check(np.array(deviation), now))
+
+    def test_fires_outside_the_band(self):
+        self.assertEqual(self.check([1.0, 5.0, 1.0], 0), [])
+        self.assertEqual(self.check([1.0, 5.5, 6.0], 0), [1, 2])
+        self.assertEqual(self.trigger.last_fired, 0)
+        self.assertEqual(self.trigger.fired, 1)
+
+    def test_untraded_coins_stay_armed(self):
+        self.assertEqual(self.check([6.0, 6.0, 0.0], 0), [0, 1])
+        self.trigger.disarm([0])
+        self.assertEqual(self.check([6.0, 6.0, 0.0], 10), [1])
+
+    def test_rearms_below_band_minus_hysteresis(self):
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 0), [0])
+        self.trigger.disarm([0])
+        # back inside the band but not below the re-arm threshold
+        self.assertEqual(self.check([4.0, 0.0, 0.0], 10), [])
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 20), [])
+        self.assertFalse(self.trigger.armed[0])
+        self.assertEqual(self.check([2.9, 0.0, 0.0], 30), [])
+        self.assertTrue(self.trigger.armed[0])
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 40), [0])
+
+    def test_minimum_interval(self):
+        self.assertEqual(self.trigger.due(0), 0)
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 100), [0])
+        self.assertEqual(self.trigger.due(104), 6)
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 104), [])
+        self.assertEqual(self.trigger.fired, 1)
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 110), [0])
+        self.assertEqual(self.trigger.due(200), 0)
+
+    def test_rearms_while_waiting_for_the_interval(self):
+        self.check([6.0, 0.0, 0.0], 0)
+        self.trigger.disarm([0])
+        self.assertEqual(self.check([1.0, 0.0, 0.0], 5), [])
+        self.assertEqual(self.check([6.0, 0.0, 0.0], 10), [0])
+
+    def test_reset(self):
+        self.check([6.0, 6.0, 0.0], 0)
+        self.trigger.disarm([0, 1])
+        self.trigger.reset()
+        self.assertTrue(self.trigger.armed.all())
+        self.assertIsNone(self.trigger.last_fired)
+        self.assertEqual(self.check([6.0, 6.0, 0.0], 1), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
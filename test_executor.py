@@ -0,0 +1,77 @@
+import threading
+import unittest
+from unittest import mock
+
+from requests.exceptions import ConnectionError, Timeout
+
+from executor import OrderExecutor
+
+
+def order(**fields):
+    return dict({'coin': 'ETH',
+                 'symbol': 'ETHBTC',
+                 'side': 'BUY',
+                 'type': 'MARKET',
+                 'quantity': '1',
+                 'price': '0.03',
+                 'dryrun': False}, **fields)
+
+
+class OrderExecutorFailureTest(unittest.TestCase):
+    '''
+    A REST call that fails on the network must still post a result, or the
+    engine would wait for it forever
+    '''
+    def setUp(self):
+        self.client = mock.Mock()
+        self.results = []
+        self.executor = OrderExecutor(self.client, self.results.append, workers=4,
+                                      orders_per_second=1000, weight_per_minute=60000)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_order_connection_error_posts_failure(self):
+        self.client.create_order.side_effect = ConnectionError('connection reset')
+        result = self.executor.submit([order()])[0].result(timeout=5)
+        self.assertEqual(self.results, [result])
+        self.assertEqual(result['e'], 'orderResult')
+        self.assertIn('ConnectionError', result['error'])
+        self.assertEqual(self.executor.stats()['failed'], 1)
+
+    def test_cancel_timeout_posts_failure(self):
+        self.client.cancel_order.side_effect = Timeout('read timed out')
+        result = self.executor.submit([order(replace=42, quantity=None)])[0].result(timeout=5)
+        self.assertIn('Timeout', result['error'])
+        self.assertNotIn('cancelled', result)
+
+    def test_fetch_connection_error_posts_failure(self):
+        fn = mock.Mock(side_effect=ConnectionError('no route to host'))
+        self.executor.fetch('depthSnapshot', 1, fn, symbol='ETHBTC').result(timeout=5)
+        self.assertEqual(len(self.results), 1)
+        self.assertEqual(self.results[0]['e'], 'depthSnapshot')
+        self.assertEqual(self.results[0]['symbol'], 'ETHBTC')
+        self.assertIn('error', self.results[0])
+
+    def test_counters_are_consistent_under_concurrency(self):
+        lock = threading.Lock()
+        calls = [0]
+
+        def create_order(**params):
+            with lock:
+                calls[0] += 1
+                failing = calls[0] % 2 == 0
+            if failing:
+                raise ConnectionError('dropped')
+            return {'orderId': 1}
+        self.client.create_order.side_effect = create_order
+        futures = self.executor.submit([order() for i in range(200)])
+        for future in futures:
+            future.result(timeout=10)
+        stats = self.executor.stats()
+        self.assertEqual(stats['sent'], 200)
+        self.assertEqual(stats['failed'], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from decimal import Decimal
+
+from filters import Quantizer, SymbolRules, format_decimal
+
+
+def rules(**filters):
+    return SymbolRules(**dict({'minprice': 0.000001,
+                               'maxprice': 100000.0,
+                               'ticksize': 0.000001,
+                               'minqty': 0.001,
+                               'maxqty': 100000.0,
+                               'stepsize': 0.001,
+                               'minnotional': 0.001,
+                               'multiplierup': 5.0,
+                               'multiplierdown': 0.2}, **filters))
+
+
+class QuantizerTest(unittest.TestCase):
+    def test_rounds_down_to_power_of_ten_step(self):
+        self.assertEqual(Quantizer(0.001)(1.23456), '1.234')
+        self.assertEqual(Quantizer(0.001)(0.0009), '0')
+
+    def test_no_float_error(self):
+        # 0.3 / 0.1 is 2.9999999999999996 in floats
+        self.assertEqual(Quantizer(0.1)(0.3), '0.3')
+        self.assertEqual(Quantizer(0.00001)(0.00003), '0.00003')
+
+    def test_rounds_down_to_other_steps(self):
+        quantizer = Quantizer(0.05)
+        self.assertFalse(quantizer.power_of_ten)
+        self.assertEqual(quantizer.decimal(1.27), Decimal('1.25'))
+        self.assertEqual(Quantizer(5)(17), '15')
+
+    def test_without_step_rounds_to_eight_places(self):
+        self.assertEqual(Quantizer(0)(0.123456789), '0.12345679')
+
+    def test_format_decimal(self):
+        self.assertEqual(format_decimal(Decimal('1.2300')), '1.23')
+        self.assertEqual(format_decimal(Decimal('100')), '100')
+        self.assertEqual(format_decimal(Decimal('1E-7')), '0.0000001')
+
+
+class SymbolRulesTest(unittest.TestCase):
+    def test_accepts_valid_order(self):
+        self.assertIsNone(rules().check(Decimal('1.5'), Decimal('0.03'), reference=0.03))
+
+    def test_lot_size(self):
+        self.assertEqual(rules().check(Decimal('0.0005'), Decimal('0.03')), 'Filter failure: LOT_SIZE')
+        self.assertEqual(rules().check(Decimal('1.0005'), Decimal('0.03')), 'Filter failure: LOT_SIZE')
+        self.assertEqual(rules(maxqty=10.0).check(Decimal('11'), Decimal('0.03')), 'Filter failure: LOT_SIZE')
+
+    def test_unlimited_maximum_quantity(self):
+        self.assertIsNone(rules(maxqty=float('inf')).check(Decimal('1e9'), Decimal('0.03')))
+
+    def test_price_filter(self):
+        self.assertEqual(rules().check(Decimal('1'), Decimal('0.0300005')), 'Filter failure: PRICE_FILTER')
+        self.assertEqual(rules(maxprice=1.0).check(Decimal('1'), Decimal('2')), 'Filter failure: PRICE_FILTER')
+
+    def test_percent_price(self):
+        self.assertEqual(rules().check(Decimal('1'), Decimal('0.2'), reference=0.03), 'Filter failure: PERCENT_PRICE')
+        self.assertEqual(rules().check(Decimal('1'), Decimal('0.005'), reference=0.03),
+                         'Filter failure: PERCENT_PRICE')
+
+    def test_market_orders_skip_price_filters(self):
+        self.assertIsNone(rules().check(Decimal('1'), Decimal('0.0300005'), reference=0.001, market=True))
+
+    def test_min_notional(self):
+        self.assertEqual(rules(minnotional=0.1).check(Decimal('1'), Decimal('0.03')), 'Filter failure: MIN_NOTIONAL')
+        self.assertEqual(rules(minnotional=0.1).check(Decimal('1'), Decimal('0.03'), market=True),
+                         'Filter failure: MIN_NOTIONAL')
+
+    def test_zero_limits_are_disabled(self):
+        unfiltered = rules(minprice=0.0, maxprice=0.0, ticksize=0.0, minqty=0.0, maxqty=0.0,
+                           stepsize=0.0, minnotional=0.0, multiplierup=0.0, multiplierdown=0.0)
+        self.assertIsNone(unfiltered.check(Decimal('123.456'), Decimal('0.0123457'), reference=1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
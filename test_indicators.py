@@ -0,0 +1,97 @@
+import math
+import random
+import statistics
+import unittest
+
+from indicators import MarketIndicators, PairIndicators
+
+
+def recompute(ticks, window):
+    '''
+    The indicators of the last window (bid, ask, size) ticks, from scratch.
+    The returns reach one tick further back, into the first tick kept.
+    '''
+    all_mids = [(bid + ask) / 2.0 for bid, ask, size in ticks[-window - 1:]]
+    returns = [math.log(b / a) for a, b in zip(all_mids, all_mids[1:])]
+    ticks = ticks[-window:]
+    mids = all_mids[-len(ticks):]
+    n = len(mids)
+    mean_index = (n - 1) / 2.0
+    mean_mid = sum(mids) / n
+    slope = (sum((i - mean_index) * (mid - mean_mid) for i, mid in enumerate(mids))
+             / sum((i - mean_index) ** 2 for i in range(n)))
+    fitted = mean_mid + slope * (n - 1 - mean_index)
+    vwap = sum(size * mid for (bid, ask, size), mid in zip(ticks, mids)) / sum(size for bid, ask, size in ticks)
+    return {'volatility': statistics.stdev(returns) * 100.0,
+            'detrended': (mids[-1] / fitted - 1) * 100.0,
+            'vwap_drift': (mids[-1] / vwap - 1) * 100.0}
+
+
+def random_ticks(count, seed=0):
+    rng = random.Random(seed)
+    mid = 0.03
+    ticks = []
+    for k in range(count):
+        mid *= math.exp(rng.gauss(0, 1e-3))
+        spread = mid * rng.uniform(1e-4, 1e-3)
+        ticks.append((mid - spread / 2, mid + spread / 2, rng.uniform(0.1, 10)))
+    return ticks
+
+
+class PairIndicatorsTest(unittest.TestCase):
+    def check(self, pair, ticks):
+        expected = recompute(ticks, pair.window)
+        self.assertAlmostEqual(pair.volatility(), expected['volatility'], places=9)
+        self.assertAlmostEqual(pair.detrended(), expected['detrended'], places=9)
+        self.assertAlmostEqual(pair.vwap_drift(), expected['vwap_drift'], places=9)
+
+    def test_running_sums_match_a_full_recompute(self):
+        ticks = random_ticks(1000)
+        pair = PairIndicators(window=50)
+        for k, (bid, ask, size) in enumerate(ticks):
+            pair.update(bid, ask, size)
+            if k >= 2 and k % 97 == 0:
+                self.check(pair, ticks[:k + 1])
+        self.check(pair, ticks)
+
+    def test_resum_keeps_the_values(self):
+        ticks = random_ticks(300, seed=1)
+        pair = PairIndicators(window=20)
+        pair.resum_interval = 7
+        for bid, ask, size in ticks:
+            pair.update(bid, ask, size)
+        self.check(pair, ticks)
+
+    def test_spread_and_its_average(self):
+        pair = PairIndicators(window=3)
+        pair.update(0.99, 1.01)
+        self.assertAlmostEqual(pair.spread, 2.0)
+        self.assertAlmostEqual(pair.ewma_spread, 2.0)
+        pair.update(0.995, 1.005)
+        self.assertAlmostEqual(pair.spread, 1.0)
+        self.assertAlmostEqual(pair.ewma_spread, 2.0 + 0.5 * (1.0 - 2.0))
+
+    def test_short_windows_and_bad_quotes(self):
+        pair = PairIndicators(window=10)
+        self.assertTrue(math.isnan(pair.vwap_drift()))
+        pair.update(0, 1.0)
+        self.assertEqual(len(pair), 0)
+        pair.update(0.99, 1.01)
+        pair.update(0.99, 1.01)
+        self.assertTrue(math.isnan(pair.volatility()))
+        self.assertTrue(math.isnan(pair.detrended()))
+
+
+class MarketIndicatorsTest(unittest.TestCase):
+    def test_warmup(self):
+        indicators = MarketIndicators(2, window=5)
+        for bid, ask, size in random_ticks(4):
+            indicators.update(1, bid, ask, size)
+        self.assertTrue(math.isnan(indicators.volatility[1]))
+        indicators.update(1, 0.03, 0.0301, 1.0)
+        self.assertFalse(math.isnan(indicators.volatility[1]))
+        self.assertTrue(math.isnan(indicators.as_dict()['spread'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
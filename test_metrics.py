@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from prometheus_client.parser import text_string_to_metric_families
+except ImportError:
+    text_string_to_metric_families = None
+
+from benchmarks import synthetic_coins
+from settings import Settings
+from engine import RebalanceEngine
+from connection import ThreadScheduler
+
+
+@unittest.skipIf(text_string_to_metric_families is None, 'prometheus_client is not installed')
+class MetricsTextTest(unittest.TestCase):
+    ''' metrics_text must be valid Prometheus text exposition '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        settings = Settings('config.ini')
+        settings.records_directory = os.path.join(self.tmp, 'records')
+        settings.journal_path = os.path.join(self.tmp, 'trade_history.csv')
+        settings.state_path = ''
+        coins = synthetic_coins(5, settings.trade_currency)
+        self.engine = RebalanceEngine(coins[['coin', 'fixed_balance', 'allocation']], settings)
+        self.engine.set_state(coins)
+        self.engine.supervisor.scheduler = ThreadScheduler()
+        for name in ('user', 'market'):
+            self.engine.supervisor.add(name, lambda callback: object(), lambda handle: None, lambda msg: None)
+        self.engine.latency.record('bookTicker', 1558282800000, 1558282800.01, 1558282800.02, 1558282800.03)
+
+    def tearDown(self):
+        self.engine.supervisor.close()
+        self.engine.journal.close()
+        self.engine.records.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_parses(self):
+        families = {family.name: family for family in text_string_to_metric_families(self.engine.metrics_text())}
+        connected = families['binancebalance_stream_connected']
+        self.assertEqual(connected.type, 'gauge')
+        self.assertEqual(sorted(sample.labels['stream'] for sample in connected.samples), ['market', 'user'])
+        self.assertIn('binancebalance_queue_depth', families)
+        self.assertEqual(families['binancebalance_message_latency_seconds'].type, 'summary')
+
+    def test_help_and_type_once_per_metric(self):
+        types = [line.split()[2] for line in self.engine.metrics_text().splitlines() if line.startswith('# TYPE')]
+        self.assertEqual(len(types), len(set(types)))
+        self.assertFalse(any('{' in name for name in types))
+
+
+if __name__ == '__main__':
+    unittest.main()
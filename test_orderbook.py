@@ -0,0 +1,87 @@
+import math
+import unittest
+
+from orderbook import DepthBooks, OrderBook
+
+
+def snapshot(last_update_id=10):
+    return {'lastUpdateId': last_update_id,
+            'bids': [['0.99', '1'], ['0.98', '2']],
+            'asks': [['1.00', '1'], ['1.01', '1'], ['1.02', '2']]}
+
+
+def event(first, last, bids=(), asks=()):
+    return {'e': 'depthUpdate', 's': 'ETHBTC', 'U': first, 'u': last, 'b': list(bids), 'a': list(asks)}
+
+
+class OrderBookTest(unittest.TestCase):
+    def setUp(self):
+        self.book = OrderBook('ETHBTC')
+        self.assertTrue(self.book.load(snapshot()))
+
+    def test_estimate(self):
+        average, slippage = self.book.estimate(True, 1.5)
+        self.assertAlmostEqual(average, (1.00 + 0.5 * 1.01) / 1.5)
+        self.assertAlmostEqual(slippage, average - 1.0)
+        # beyond the visible depth the rest fills at the last level
+        self.assertAlmostEqual(self.book.estimate(True, 5)[0], (1.00 + 1.01 + 3 * 1.02) / 5)
+        self.assertAlmostEqual(self.book.estimate(False, 2)[0], (0.99 + 0.98) / 2)
+
+    def test_within(self):
+        quantity = self.book.within(True, 0.01)
+        self.assertAlmostEqual(quantity, 3.0)
+        self.assertAlmostEqual(self.book.estimate(True, quantity)[1], 0.01)
+        # the whole side when even the last level is within budget
+        self.assertAlmostEqual(self.book.within(False, 0.5), 3.0)
+
+    def test_empty_side(self):
+        book = OrderBook('ETHBTC')
+        book.load({'lastUpdateId': 1, 'bids': [], 'asks': []})
+        self.assertTrue(all(math.isnan(x) for x in book.estimate(True, 1)))
+        self.assertEqual(book.within(True, 0.01), 0.0)
+
+    def test_updates_and_removed_levels(self):
+        self.assertTrue(self.book.apply(event(11, 12, asks=[['1.00', '0'], ['1.005', '3']])))
+        self.assertEqual(self.book.asks.best(), 1.005)
+        self.assertEqual(self.book.asks.levels[1.005], 3.0)
+        # an event the snapshot already contains is skipped
+        self.assertTrue(self.book.apply(event(5, 9, bids=[['0.995', '1']])))
+        self.assertEqual(self.book.bids.best(), 0.99)
+
+
+class DepthBooksTest(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.books = DepthBooks(['ETHBTC'], self.requests.append)
+        self.books.start()
+
+    def test_buffers_until_snapshot(self):
+        self.books.on_update(event(9, 11, bids=[['0.995', '2']]))
+        self.assertIsNone(self.books.get('ETHBTC'))
+        self.books.on_snapshot('ETHBTC', snapshot(10))
+        book = self.books.get('ETHBTC')
+        self.assertEqual(book.bids.best(), 0.995)
+        self.assertEqual(book.last_update_id, 11)
+        self.assertEqual(self.requests, ['ETHBTC'])
+
+    def test_gap_resyncs(self):
+        self.books.on_snapshot('ETHBTC', snapshot(10))
+        self.books.on_update(event(15, 16))
+        self.assertIsNone(self.books.get('ETHBTC'))
+        self.assertEqual(self.books.resyncs, 1)
+        self.assertEqual(self.requests, ['ETHBTC', 'ETHBTC'])
+        self.books.on_update(event(17, 18))
+        self.books.on_snapshot('ETHBTC', snapshot(17))
+        self.assertEqual(self.books.get('ETHBTC').last_update_id, 18)
+
+    def test_failed_snapshot_is_retried_later(self):
+        self.books.on_snapshot('ETHBTC')
+        self.books.on_update(event(1, 2))
+        self.assertEqual(self.requests, ['ETHBTC'])
+        self.books.retry_at['ETHBTC'] = 0
+        self.books.on_update(event(3, 4))
+        self.assertEqual(self.requests, ['ETHBTC', 'ETHBTC'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import types
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from planner import (INSUFFICIENT_PURCHASE, INSUFFICIENT_SALE, SIDE_BUY, SIDE_SELL, SPREAD_TOO_WIDE,
+                     TOO_LARGE, TOO_SMALL, TRADE_COIN, TRADE_READY, check_order, limit_spread,
+                     plan_trades, ready)
+from portfolio import PortfolioState
+
+DEFAULTS = {'fixed_balance': 0.0,
+            'locked_balance': 0.0,
+            'minprice': 0.0,
+            'maxprice': 0.0,
+            'ticksize': 0.000001,
+            'minqty': 0.0,
+            'maxqty': 1e9,
+            'stepsize': 0.001,
+            'minnotional': 0.1,
+            'multiplierup': 5.0,
+            'multiplierdown': 0.2,
+            'last_placement': 0.0,
+            'last_execution': 0.0}
+
+
+def portfolio(rows):
+    ''' A PortfolioState trading against BTC from (coin, balance, bid, ask, allocation, overrides) '''
+    records = []
+    for coin, balance, bid, ask, allocation, overrides in rows:
+        record = dict(DEFAULTS,
+                      coin=coin,
+                      symbol=coin + 'BTC',
+                      exchange_balance=balance,
+                      allocation=allocation,
+                      bidprice=bid,
+                      askprice=ask,
+                      price=(bid + ask) / 2.0)
+        record.update(overrides)
+        records.append(record)
+    return PortfolioState(pd.DataFrame(records), 'BTC')
+
+
+class PlanTradesTest(unittest.TestCase):
+    '''
+    A portfolio worth 10 BTC with one coin in every plan status. ETH
+    and LTC are quoted 0.099/0.101 around a 0.1 mid.
+    '''
+    def plan(self, btc_locked=0.0):
+        self.state = portfolio([
+            ('BTC', 5.0, 1.0, 1.0, 50.0, {'locked_balance': btc_locked}),
+            # 10% held, 20% wanted: buy 1 BTC worth
+            ('ETH', 10.0, 0.099, 0.101, 20.0, {}),
+            # 20% held, 10% wanted: sell 1 BTC worth
+            ('LTC', 20.0, 0.099, 0.101, 10.0, {}),
+            # a 0.01 BTC buy is under the minimum notional
+            ('XRP', 100.0, 0.01, 0.01, 10.1, {}),
+            # a 1 BTC sale but only 5 of the 100 coins are free
+            ('BNB', 100.0, 0.01, 0.01, 0.0, {'locked_balance': 95.0}),
+            # a 0.5 BTC buy of 500 coins over the maximum quantity
+            ('ADA', 0.0, 0.001, 0.001, 5.0, {'maxqty': 100.0}),
+        ])
+        return plan_trades(self.state)
+
+    def test_statuses(self):
+        plan = self.plan()
+        self.assertAlmostEqual(self.state.total, 10.0)
+        self.assertEqual(list(plan.status),
+                         [TRADE_COIN, TRADE_READY, TRADE_READY, TOO_SMALL, INSUFFICIENT_SALE, TOO_LARGE])
+        self.assertEqual(list(plan.buy), [False, True, False, True, False, True])
+
+    def test_sized_at_the_live_price(self):
+        plan = self.plan()
+        self.assertAlmostEqual(plan.price[1], 0.101)
+        self.assertAlmostEqual(plan.price[2], 0.099)
+        self.assertAlmostEqual(plan.quantity[1], 1.0 / 0.101)
+        self.assertAlmostEqual(plan.quantity[2], 1.0 / 0.099)
+        self.assertAlmostEqual(plan.notional[1], 1.0)
+        self.assertAlmostEqual(plan.rounded[1], 9.9)
+        self.assertAlmostEqual(plan.rounded[2], 10.101)
+        self.assertTrue(np.isnan(plan.slippage).all())
+
+    def test_insufficient_purchase(self):
+        plan = self.plan(btc_locked=4.6)
+        self.assertEqual(plan.status[1], INSUFFICIENT_PURCHASE)
+        # the more specific status wins where several apply
+        self.assertEqual(plan.status[5], TOO_LARGE)
+
+    def test_ready(self):
+        plan = self.plan()
+        self.assertEqual(list(ready(plan, SIDE_BUY)), [1])
+        self.assertEqual(list(ready(plan, SIDE_SELL)), [2])
+
+    def test_limit_spread(self):
+        plan = self.plan()
+        nan = float('nan')
+        indicators = types.SimpleNamespace(spread=np.array([nan, 3.0, 3.0, 3.0, nan, nan]),
+                                           ewma_spread=np.array([nan, 1.0, 2.0, 1.0, nan, nan]))
+        limited = limit_spread(plan, indicators, 2.0)
+        self.assertEqual(list(limited.status),
+                         [TRADE_COIN, SPREAD_TOO_WIDE, TRADE_READY, TOO_SMALL, INSUFFICIENT_SALE, TOO_LARGE])
+        self.assertEqual(list(ready(limited, SIDE_BUY)), [])
+
+    def test_check_order(self):
+        self.plan()
+        rules = self.state.rules[1]
+        self.assertIsNone(check_order(self.state, 1, rules.quantity.decimal(9.9), rules.price.decimal(0.101), False))
+        # PERCENT_PRICE is measured from the mid
+        self.assertEqual(check_order(self.state, 1, rules.quantity.decimal(9.9), rules.price.decimal(0.6), False),
+                         'Filter failure: PERCENT_PRICE')
+
+
+if __name__ == '__main__':
+    unittest.main()
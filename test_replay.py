@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from marketdata import MarketDataStream, ReplayTransport
+
+try:
+    from benchmarks import bench_replay
+except ImportError:
+    bench_replay = None
+
+
+def ticker(symbol, k):
+    return {'stream': symbol.lower() + MarketDataStream.stream_suffix,
+            'data': {'u': k, 's': symbol, 'b': '0.1', 'B': '1.0', 'a': '0.2', 'A': '2.0'}}
+
+
+class ReplayTest(unittest.TestCase):
+    ''' A recorded stream replays through MarketDataStream like the exchange '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'stream.jsonl')
+        self.messages = [ticker('ETHBTC', 0), ticker('XRPBTC', 1), ticker('ETHBTC', 2), ticker('ETHBTC', 3)]
+        with open(self.path, 'w') as f:
+            for msg in self.messages:
+                f.write(json.dumps(msg) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def replay(self, transport, record=None):
+        received = []
+        stream = MarketDataStream(transport, ['ETHBTC'], received.append, record=record)
+        stream.start()
+        transport.join(5)
+        stream.close()
+        return received
+
+    def test_replays_subscribed_streams(self):
+        received = self.replay(ReplayTransport(self.path))
+        self.assertEqual([msg['e'] for msg in received], ['bookTicker'] * 3)
+        self.assertEqual({msg['s'] for msg in received}, {'ETHBTC'})
+
+    def test_record_round_trip(self):
+        record = os.path.join(self.tmp, 'record.jsonl')
+        self.replay(ReplayTransport(self.path), record)
+        with open(record) as f:
+            recorded = [json.loads(line) for line in f]
+        self.assertEqual(recorded, [msg for msg in self.messages if msg['data']['s'] == 'ETHBTC'])
+        self.assertEqual(len(self.replay(ReplayTransport(record))), 3)
+
+    def test_drop_after(self):
+        received = self.replay(ReplayTransport(self.path, drop_after=2))
+        self.assertEqual([msg['e'] for msg in received], ['bookTicker', 'bookTicker', 'error'])
+
+
+@unittest.skipIf(bench_replay is None, 'the engine dependencies are not installed')
+class ReplayBenchmarkTest(unittest.TestCase):
+    ''' The replay benchmark drives the engine's supervised market stream '''
+    def test_reconnects(self):
+        result = bench_replay(None, 0, 1, drop_after=1000, n=5)
+        self.assertGreater(result['handled'], 0)
+        self.assertGreater(result['reconnects'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
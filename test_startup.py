@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+try:
+    import tkinter
+    tkinter.Tk().destroy()
+    display = True
+except Exception:
+    display = False
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# run in a fresh interpreter, so only the imports of the window are in sys.modules
+FIRST_WINDOW = '''
+import importlib.util, json, sys, time
+spec = importlib.util.spec_from_file_location('binance_balance', 'binance-balance.py')
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+root = app.tk.Tk()
+root.withdraw()
+settings = app.Settings('config.ini')
+app.BalanceGUI(root, app.read_portfolio(sys.argv[1]), settings).grid(row=0, column=0)
+root.wm_title('BinanceBalance')
+root.update()
+first_window = time.perf_counter() - app.STARTED
+root.destroy()
+print(json.dumps({'first_window': first_window,
+                  'budget': settings.window_budget,
+                  'modules': [name for name in ('numpy', 'pandas', 'binance', 'twisted') if name in sys.modules]}))
+'''
+
+
+@unittest.skipIf(not display, 'no display')
+class FirstWindowTest(unittest.TestCase):
+    ''' The window must appear within window_budget, before the engine's dependencies are imported '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.allocation = os.path.join(self.tmp, 'allocation.csv')
+        with open(self.allocation, 'w') as f:
+            f.write('coin,fixed_balance,allocation\nBTC,0,50\nETH,0,30\nLTC,0,20\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_first_window(self):
+        output = subprocess.check_output([sys.executable, '-c', FIRST_WINDOW, self.allocation], cwd=HERE)
+        report = json.loads(output.decode().splitlines()[-1])
+        self.assertEqual(report['modules'], [])
+        self.assertLessEqual(report['first_window'], report['budget'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import argparse
+import glob
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+# event time (ms), VWAP, bid, ask, mid
+RECORD = struct.Struct('<qdddd')
+SEGMENT_SUFFIX = '.tick'
+
+
+def segment_day(time_ms):
+    ''' UTC day of an event time, as used in segment names '''
+    return datetime.utcfromtimestamp(time_ms / 1000.0).strftime('%Y%m%d')
+
+
+def segment_paths(directory, pair):
+    ''' All segment files of a pair, oldest first '''
+    return sorted(glob.glob(os.path.join(directory, pair, pair + '-*' + SEGMENT_SUFFIX)))
+
+
+class Segment(object):
+    ''' The open segment file a pair is currently appending to '''
+    def __init__(self, directory, pair, day, max_bytes, fsync=False):
+        self.directory = os.path.join(directory, pair)
+        self.pair = pair
+        self.day = day
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        existing = glob.glob(os.path.join(self.directory, '{0}-{1}-*{2}'.format(pair, day, SEGMENT_SUFFIX)))
+        self.sequence = max([int(path[:-len(SEGMENT_SUFFIX)].rsplit('-', 1)[1]) for path in existing] or [0])
+        self.open()
+
+    def path(self):
+        return os.path.join(self.directory, '{0}-{1}-{2:04d}{3}'.format(self.pair, self.day, self.sequence, SEGMENT_SUFFIX))
+
+    def open(self):
+        self.file = open(self.path(), 'ab')
+        size = self.file.tell()
+        # drop a partially written record left by a crash
+        if size % RECORD.size:
+            size -= size % RECORD.size
+            self.file.truncate(size)
+        self.size = size
+
+    def rotate(self):
+        self.close()
+        self.sequence += 1
+        self.open()
+
+    def write(self, data):
+        if self.size >= self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def sync(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class TickRecorder(object):
+    '''
+    Append fixed-width binary tick records to per-pair segment files.
+    record() only packs the tick and hands it to a background writer
+    thread, which writes in batches of at most batch_size records or
+    every flush_interval seconds, optionally fsyncs, and starts a new
+    segment when the current one reaches max_bytes or the UTC day of
+    the event time changes. Ticks arriving while max_pending are
+    already waiting are dropped and counted.
+    '''
+    def __init__(self, directory='records', max_bytes=64 * 1024 * 1024,
+                 batch_size=4096, flush_interval=1.0, fsync=False,
+                 max_pending=100000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.pending = queue.Queue(max_pending)
+        self.segments = dict()
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='tick-recorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, pair, time_ms, vwap, bid, ask, block=False):
+        ''' Queue one tick for writing, waiting for space only if block is set '''
+        data = RECORD.pack(int(time_ms), vwap, bid, ask, (bid + ask) / 2.0)
+        try:
+            self.pending.put((pair, int(time_ms), data), block)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.pending.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                self.write(batch)
+
+    def write(self, batch):
+        ''' Write a batch of ticks to their segments and flush them '''
+        touched = set()
+        for pair, time_ms, data in batch:
+            day = segment_day(time_ms)
+            segment = self.segments.get(pair)
+            if segment is None or segment.day != day:
+                if segment is not None:
+                    segment.close()
+                    touched.discard(segment)
+                segment = Segment(self.directory, pair, day, self.max_bytes, self.fsync)
+                self.segments[pair] = segment
+            segment.write(data)
+            touched.add(segment)
+        for segment in touched:
+            segment.sync()
+        self.written += len(batch)
+
+    def close(self):
+        ''' Write everything still queued and close all segments '''
+        self.pending.put(None)
+        self.thread.join()
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
+
+
+def convert_csv(path, recorder, pair=None):
+    '''
+    Convert a text recording written by the old print_price, with
+    time,vwap,mid lines, to binary records. The bid and ask were not
+    recorded, so both are set to the mid price.
+    '''
+    if pair is None:
+        pair = os.path.splitext(os.path.basename(path))[0]
+    count = 0
+    with open(path) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) != 3:
+                continue
+            try:
+                time_ms, vwap, mid = [float(field) for field in fields]
+            except ValueError:
+                continue
+            recorder.record(pair, time_ms, vwap, mid, mid, block=True)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert PAIR.csv price recordings to binary tick segments')
+    parser.add_argument('csv', nargs='+', help='text recordings, e.g. ETHBTC.csv')
+    parser.add_argument('--directory', default='records', help='output directory for segments')
+    args = parser.parse_args()
+    recorder = TickRecorder(args.directory, fsync=True)
+    for path in args.csv:
+        count = convert_csv(path, recorder)
+        print('{0}: {1} ticks'.format(path, count))
+    recorder.close()
+    if recorder.dropped:
+        print('{0} ticks dropped'.format(recorder.dropped), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def parse_time(text):
+    ''' Parse a YYYY-MM-DD[ HH:MM] UTC time to epoch ms, for command line arguments '''
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            moment = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        return int((moment - datetime(1970, 1, 1)).total_seconds() * 1000)
+    raise argparse.ArgumentTypeError('{0} is not a YYYY-MM-DD[ HH:MM] time'.format(text))
+
+
+class PhaseTimer(object):
+    '''
+    Record the wall-clock duration of named phases, in the order they
+    ran, for startup and benchmark reports.
+    '''
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        ''' Phase durations in milliseconds, plus the total since creation '''
+        report = OrderedDict((name, round(1000 * t, 3)) for name, t in self.phases.items())
+        report['total'] = round(1000 * self.total(), 3)
+        return report
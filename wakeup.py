@@ -0,0 +1,71 @@
+import os
+import threading
+import tkinter
+
+
+class TkWakeup(object):
+    '''
+    Wake the Tk main loop from another thread. wake() writes a byte to a
+    self-pipe whose read end is registered with Tk's file handler, so the
+    main loop sleeps in select() until there is something to do instead
+    of polling with after(). Wakes that arrive before the callback runs
+    are coalesced into one call. Where Tk has no file handlers (Windows),
+    the pipe is replaced by polling a flag every fallback_interval ms.
+    '''
+    def __init__(self, widget, callback, fallback_interval=100):
+        self.widget = widget
+        self.callback = callback
+        self.fallback_interval = fallback_interval
+        self.lock = threading.Lock()
+        self.pending = False
+        self.closed = False
+        self.read_fd = self.write_fd = None
+        if os.name != 'nt' and hasattr(widget.tk, 'createfilehandler'):
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+            widget.tk.createfilehandler(self.read_fd, tkinter.READABLE, self.on_readable)
+        else:
+            widget.after(fallback_interval, self.poll)
+
+    def wake(self):
+        ''' Request a callback on the Tk thread; safe to call from any thread '''
+        with self.lock:
+            if self.pending or self.closed:
+                return
+            self.pending = True
+        if self.write_fd is not None:
+            try:
+                os.write(self.write_fd, b'\0')
+            except BlockingIOError:
+                pass
+
+    def on_readable(self, fd, mask):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.run()
+
+    def poll(self):
+        if self.closed:
+            return
+        self.run()
+        self.widget.after(self.fallback_interval, self.poll)
+
+    def run(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.pending = False
+        self.callback()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        if self.read_fd is not None:
+            self.widget.tk.deletefilehandler(self.read_fd)
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+            self.read_fd = self.write_fd = None
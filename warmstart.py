@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from exchangeinfo import checksum
+
+STATE_VERSION = 1
+
+# per-coin columns restored from a snapshot; the fixed balances and the
+# allocations always come from the current allocation file, and the
+# price is the mid of the restored bid/ask
+STATE_FIELDS = ('exchange_balance',
+                'locked_balance',
+                'askprice',
+                'bidprice',
+                'minprice',
+                'maxprice',
+                'ticksize',
+                'minqty',
+                'maxqty',
+                'stepsize',
+                'minnotional',
+                'multiplierup',
+                'multiplierdown',
+                'last_placement',
+                'last_execution')
+
+
+class StateSnapshot(object):
+    '''
+    On-disk snapshot of the engine state for warm starts: the per-coin
+    columns of the PortfolioState, which include the symbol filters, the
+    last bid/ask and the placement and execution times, plus the open
+    orders. Columns are stored as lists, one per field, with NaN written
+    as null. Snapshots older than max_age seconds, from a different
+    version, with a bad checksum, or for a different set of coins are
+    ignored.
+    '''
+    def __init__(self, path='state.json', max_age=86400):
+        self.path = path
+        self.max_age = max_age
+        self.age = None
+
+    def load(self, coins, trade_coin):
+        ''' Return the snapshot payload for the given coins, or None if there is no valid one '''
+        self.age = None
+        if not self.path:
+            return None
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('version') != STATE_VERSION:
+            return None
+        age = time.time() - entry.get('saved', 0)
+        if age > self.max_age:
+            return None
+        payload = entry.get('payload')
+        if payload is None or checksum(payload) != entry.get('checksum'):
+            return None
+        if payload['trade_coin'] != trade_coin or sorted(payload['coins']) != sorted(coins):
+            return None
+        self.age = age
+        columns = payload['columns']
+        for field in STATE_FIELDS:
+            columns[field] = np.array([np.nan if x is None else x for x in columns[field]], dtype=np.float64)
+        columns['price'] = (columns['bidprice'] + columns['askprice']) / 2.0
+        return payload
+
+    def store(self, state, open_orders):
+        ''' Atomically replace the snapshot file with the current state '''
+        if not self.path:
+            return
+        columns = dict()
+        for field in STATE_FIELDS:
+            values = getattr(state, field)
+            columns[field] = [None if np.isnan(x) else float(x) for x in values]
+        payload = {'trade_coin': state.trade_coin,
+                   'coins':      list(state.coins),
+                   'symbols':    list(state.symbols),
+                   'columns':    columns,
+                   # a replacement in flight is not resumed after a restart
+                   'orders':     [{key: value for key, value in order.items() if key != 'replacing'}
+                                  for order in open_orders]}
+        entry = {'version': STATE_VERSION,
+                 'saved': time.time(),
+                 'checksum': checksum(payload),
+                 'payload': payload}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp, self.path)